@@ -2,31 +2,45 @@
 import asyncio
 from typing import Optional
 from fastapi import Body, Depends, FastAPI, File, HTTPException, Header, Query, Request, UploadFile
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from starlette.middleware.sessions import SessionMiddleware
 import time
 import aiomysql
 import requests
 import httpx
 import os
+import signal
 
 from contextlib import asynccontextmanager
 
 from json_classes import QuestionInput, AnswerInput, ValidateInput, LoginInput, SignUpInput, BooleanResponse, CreateQuestionResponse, ReportInput, ProfileUpdateInput
-from json_classes import LlmResponse, HomeInfoResponse, OnlineUserResponse, ProfileInfoResponse, QuestionPageResponse, UserMissionResponse
+from json_classes import LlmResponse, HomeInfoResponse, OnlineUserResponse, ProfileInfoResponse, QuestionPageResponse, UserMissionResponse, QuestionFeedResponse, LeaderboardResponse, ActivityFeedResponse
 from json_classes import CreateQuestionPageResponse, VoteInput, ChangePasswordInput, PhoneInput
-from utils.query_execute import execute_modify, execute_select
+from utils.query_execute import execute_modify, execute_select, run, begin_query_log, end_query_log, metrics, ER_DUP_ENTRY
 from utils.sign_up import sign_up_op, check_sign_up, insert_missions, insert_title
 from utils.sign_in import check_password, get_pass_and_salt
 from utils.startup import wait_for_ollama, close_connections, wait_for_nlp
-from utils.various_tools import get_specific_from_something, get_something
-from utils.create_question import insert_question, insert_theme, insert_tags, check_week_theme
+from utils.create_question import insert_question, insert_theme, insert_tags, request_tags, check_week_theme
 from utils.session_handler import timeout
-from utils.get_info import get_user_info, get_contributors, get_weekly_question, get_last_user_questions, get_last_user_answer, get_questions, get_trending_questions
-from utils.get_info import get_missions, get_user_stats, get_last_user_activities, get_week_themes, get_avatars, get_titles
-from utils.game_operation import insert_answer, ask_llm_answer, update_points, check_missions
-from utils.connection import Connection
-from utils.daily_check import chiudi_domande_scadute, chiudi_missioni_scadute
+from utils.get_info import get_user_info, get_contributors
+from utils.activity_feed import get_last_user_questions, get_last_user_answer, get_activity_feed, format_feed, ACTIVITY_KINDS
+from utils.activity_feed import get_last_user_questions_table, get_last_user_answer_table, activity_table
+from utils.get_info import get_missions, get_user_stats, get_last_user_activities, get_avatars, get_titles, get_leaderboard_page
+from utils.question_page import get_questions, get_question_feed, get_question_feed_table
+from utils.wire_format import compact_response
+from utils.game_operation import insert_answer, ask_llm_answer, update_points
+from utils.mission_events import MissionEventWorker, enqueue_event, purge_events
+from utils.points_ledger import PointsAggregator, record_points_bulk
+from utils.connection import Connection, PoolExhaustedError
+from utils.fan_out import FanOut
+from utils.home_snapshot import HomeSnapshot
+from utils.catalog import Catalog
+from utils.leaderboard import Leaderboard, LEADERBOARD_PERIODS
+from utils.leaderboard_missions import LeaderboardMissions
+from utils.votes import VoteCounter, vote, remove_vote
+from utils.migrations import migrate
+from utils.user_stats import increment_user_stat, repair_user_stats
+from utils.daily_check import chiudi_domande_scadute, chiudi_missioni_scadute, ricalcola_answer_count
 from utils.edit_profile import check_edit_profile, set_image, check_current_pass, edit_password, check_first_edit
 
 
@@ -81,13 +95,22 @@ async def session_timeout(timeout_seconds: int = 1800):
 
 
 async def periodic_task():
-    while True:
-        async with Connection.get_connection() as connection:
+    """Task in background che esegue i controlli giornalieri: la connessione viene presa per ogni giro e rilasciata
+    prima dell'attesa, e un errore in un controllo non ferma gli altri né i giri successivi"""
 
-            print("periodic_task")
-            await chiudi_domande_scadute(connection)
-            await chiudi_missioni_scadute(connection)
-            await asyncio.sleep(24 * 60 * 60)  # ogni 24 ore
+    steps = (chiudi_domande_scadute, chiudi_missioni_scadute, repair_user_stats, purge_events, ricalcola_answer_count, VoteCounter.reconcile)
+    while True:
+        print("periodic_task")
+        try:
+            async with Connection.get_connection() as connection:
+                for step in steps:
+                    try:
+                        await step(connection)
+                    except Exception as e:
+                        print(f"Errore nel controllo giornaliero {step.__name__}: ", e)
+        except (aiomysql.Error, PoolExhaustedError) as e:
+            print("Errore mariadb nei controlli giornalieri: ", e)
+        await asyncio.sleep(24 * 60 * 60)  # ogni 24 ore
 
 
 
@@ -100,6 +123,12 @@ async def lifespan(app: FastAPI):
 
     await Connection.start_connection()
 
+    async with Connection.get_connection() as connection:
+        # Lo schema viene portato all'ultima versione prima di servire richieste
+        await migrate(connection)
+        await Catalog.load(connection)
+        await Leaderboard.load(connection)
+        await LeaderboardMissions.load(connection)
 
 
     await wait_for_ollama()
@@ -108,10 +137,28 @@ async def lifespan(app: FastAPI):
 
     periodic = asyncio.create_task(periodic_task())
 
+    home_snapshot = asyncio.create_task(HomeSnapshot.run())
+    mission_events = asyncio.create_task(MissionEventWorker.run())
+    catalog = asyncio.create_task(Catalog.run())
+    points = asyncio.create_task(PointsAggregator.run())
+    votes = asyncio.create_task(VoteCounter.run())
+    leaderboard_missions = asyncio.create_task(LeaderboardMissions.run())
+    # kill -HUP sul processo del backend ricarica il catalogo
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, Catalog.request_reload)
+
     yield  # Periodo in cui applicazione è attiva
 
     periodic.cancel()
-
+    home_snapshot.cancel()
+    mission_events.cancel()
+    catalog.cancel()
+    points.cancel()
+    votes.cancel()
+    leaderboard_missions.cancel()
+
+    # I voti ancora in memoria vengono riportati in question prima di chiudere il pool
+    async with Connection.get_connection() as connection:
+        await VoteCounter.flush(connection)
 
     await close_connections()
     
@@ -122,6 +169,30 @@ app = FastAPI(title = "Backend-CulturaLLM", lifespan=lifespan, dependencies=[Dep
 app.add_middleware(SessionMiddleware, secret_key=os.environ["SECRET_KEY"])
 
 
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    """Ogni richiesta parte con lo stato delle scritture azzerato, legato all'utente dell'header user-id:
+    dopo una scrittura le letture della richiesta, e per qualche secondo quelle dell'utente, vanno sul primario"""
+
+
+    user_id = request.headers.get("user-id")
+    Connection.begin_request(int(user_id) if user_id is not None and user_id.isdigit() else None)
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def query_log(request: Request, call_next):
+    """Registra le query eseguite da ogni richiesta: il numero viene restituito nell'header X-Query-Count
+    e le richieste con troppe query o con query ripetute (N+1) vengono segnalate nel log"""
+
+
+    begin_query_log()
+    response = await call_next(request)
+    summary = end_query_log(f"{request.method} {request.url.path}")
+    response.headers["X-Query-Count"] = str(summary["queries"])
+    return response
+
+
     
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException) -> JSONResponse:
@@ -145,6 +216,42 @@ async def http_exception_handler(request: Request, exc: HTTPException) -> JSONRe
 
 
 
+@app.exception_handler(PoolExhaustedError)
+async def pool_exhausted_handler(request: Request, exc: PoolExhaustedError) -> JSONResponse:
+    """Se il pool non ha connessioni libere entro il tempo massimo la richiesta fallisce subito invece di restare in coda"""
+
+
+    print("Pool di connessioni esaurito:", exc)
+    return JSONResponse(status_code=503, content={"detail": "Servizio momentaneamente sovraccarico, riprova"}, headers={"Retry-After": "1"})
+
+
+
+
+@app.get("/pool_stats")
+def pool_stats() -> dict[str, object]:
+    """API per leggere lo stato del pool di connessioni al db"""
+
+
+    return Connection.stats()
+
+
+@app.get("/metrics")
+def get_metrics() -> dict[str, object]:
+    """API per leggere le statistiche delle query per fingerprint (esecuzioni, tempi, righe, istogramma delle durate) e del pool"""
+
+
+    return {**metrics(), "pool": Connection.stats(), "mission_events": MissionEventWorker.stats(), "points_ledger": PointsAggregator.stats(), "votes": VoteCounter.stats(), "leaderboard_missions": LeaderboardMissions.stats()}
+
+
+@app.post("/reload_catalog")
+def reload_catalog() -> BooleanResponse:
+    """API per ricaricare il catalogo delle tabelle di riferimento dopo una modifica fatta direttamente sul db"""
+
+
+    Catalog.request_reload()
+    return BooleanResponse(status = True)
+
+
 @app.get("/health")
 def health() -> dict[str, str]:
     """API per la sincronizzazione del frontend con il backend."""
@@ -191,14 +298,13 @@ async def login(login_json: LoginInput, request: Request) -> BooleanResponse:
         password = result["password"]
         salt:str = result["salt"]
         if check_password(password, login_json.password, salt):
-            user_id = await get_specific_from_something(connection, "user", "user_id", f"email=%s or username=%s", (login_json.user, login_json.user,))
+            user_id = await run(connection, "user.id_by_login", login_json.user, login_json.user)
             user_id = user_id[0][0]
             request.session["user_id"] = int(user_id)
             request.session["last_active"] = time.time()
             active_users[user_id] = time.time()
 
-            update_last_login_query = "update user set last_login_at = %s where user_id = %s"
-            await execute_modify(connection, update_last_login_query, (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), request.session["user_id"],))
+            await run(connection, "user.set_last_login", time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), request.session["user_id"])
 
 
 
@@ -220,11 +326,18 @@ async def sign_up(sign_up_json: SignUpInput, request: Request) -> BooleanRespons
         if await check_sign_up(sign_up_json.username, connection):      
             return BooleanResponse(status = False, warning = "Username already in use!")
         
-        status = await sign_up_op(sign_up_json.password, sign_up_json.username, sign_up_json.email, connection)
+        # Utente, missioni e titolo di default vengono creati insieme o per niente
+        async with Connection.transaction(connection):
+            status = await sign_up_op(sign_up_json.password, sign_up_json.username, sign_up_json.email, connection)
 
-        await insert_missions(sign_up_json.username, connection)
+            if status:
+                await insert_missions(sign_up_json.username, connection)
 
-        await insert_title(sign_up_json.username, connection)
+                await insert_title(sign_up_json.username, connection)
+
+        if status:
+            user_id = await run(connection, "user.id_by_username", sign_up_json.username)
+            Leaderboard.users.set_points(user_id[0][0], 0)
 
         return BooleanResponse(status = status)
     
@@ -242,27 +355,15 @@ async def question(question_json: QuestionInput, request: Request) -> CreateQues
         question = question_json.question
         async with httpx.AsyncClient(timeout = 600.0) as client:
             try:
-                if question_json.llm == "":
-                    id = request.session.get("user_id")
-                    print("ID:", id)
-                    question_id = await insert_question(connection, "question_text, created_by_user_id", (question, id,))
-                    print("domanda inserita!!!")
-                    points = 10
-                    if await check_week_theme(connection, question_json.theme):
-                        points *= 2.5
-
-                    await update_points(connection, "user", points, id)  #DECIDERE POI QUANTI PUNTI DARE PER LA CREAZIONE DI UNA DOMANDA
-                    print("punti assegnati!!!")
-                    await check_missions(connection, "question", request.session.get("user_id"), question_json.theme)
-                    print("missioni aggiornate!!!")
-                    id = await get_specific_from_something(connection, "llm", "llm_id", "name=%s", (question_json.answering_llm,))
-                    id = int(id[0][0]) 
-                    print(f"LLM ID = {id}")
-                else:
-                    
-                    theme = await get_specific_from_something(connection, "theme", "name", f"theme_id = {question_json.theme}")
-                    theme = theme[0][0]
-                    yellow_json = {"argument" : theme}
+                # Prima tutte le chiamate ai servizi esterni (generazione, tags, risposta), poi le scritture
+                # in un'unica transazione: una domanda non resta mai a metà, senza tags, tema o risposta
+                if question_json.answering_llm not in Catalog.llm_ids or (question_json.llm != "" and question_json.llm not in Catalog.llm_ids):
+                    raise HTTPException(status_code=400, detail="LLM non esistente")
+                if question_json.llm != "":
+                    theme = await Catalog.theme(connection, question_json.theme)
+                    if theme is None:
+                        raise HTTPException(status_code=400, detail="Tema non esistente")
+                    yellow_json = {"argument" : theme["name"]}
 
                     response = await client.post("http://nlp_server:8069/yellow", json = yellow_json)
                     # PER TESTARE SENZA NLP EVITA RICHIESTE DI DOMANDA A LLM:
@@ -270,39 +371,54 @@ async def question(question_json: QuestionInput, request: Request) -> CreateQues
                     result = response.json()
 
                     print(result)   
-                    id = await get_specific_from_something(connection, "llm", "llm_id", "name=%s", (question_json.llm,))
-                    id = int(id[0][0]) 
-                    print(f"LLM ID = {id}")
                     question:str = result["question_generated"]
                     if question.find("Question Generated: ") != -1:
                         question = question.replace("Question Generated: ","")
-                    question_id = await insert_question(connection, "question_text, created_by_llm_id", (question, id,))
 
-                    points = 10
-                    if await check_week_theme(connection, question_json.theme):
-                        points *= 2.5
+                tags = await request_tags(client, question)
+                # PER TESTARE SENZA NLP commenta quello dentro questa funzione sopra
 
-                    await update_points(connection, "llm", points, id)
+                llm_answer = await ask_llm_answer(question, client, question_json.answering_llm)
+                # PER TESTARE SENZA NLP commentra dentro questa funzione
 
+                async with Connection.transaction(connection):
+                    if question_json.llm == "":
+                        id = request.session.get("user_id")
+                        print("ID:", id)
+                        question_id = await insert_question(connection, "question_text, created_by_user_id", (question, id,), id)
+                        print("domanda inserita!!!")
+                        points = 10
+                        if await check_week_theme(connection, question_json.theme):
+                            points *= 2.5
 
-                    await check_missions(connection, "llm", request.session.get("user_id"), question_json.theme)
+                        await update_points(connection, "user", points, id)  #DECIDERE POI QUANTI PUNTI DARE PER LA CREAZIONE DI UNA DOMANDA
+                        print("punti assegnati!!!")
+                        await enqueue_event(connection, "question_created", request.session.get("user_id"), question_json.theme)
+                        id = Catalog.llm_ids[question_json.answering_llm]
+                        print(f"LLM ID = {id}")
+                    else:
+                        id = Catalog.llm_ids[question_json.llm]
+                        print(f"LLM ID = {id}")
+                        question_id = await insert_question(connection, "question_text, created_by_llm_id", (question, id,))
 
-                print("DOMANDA INSERITA")
-                await insert_tags(client, connection, question, question_id)
-                # PER TESTARE SENZA NLP commenta quello dentro questa funzione sopra
-                
+                        points = 10
+                        if await check_week_theme(connection, question_json.theme):
+                            points *= 2.5
 
-                
-                print("TAG INSERITI")
-                await insert_theme(connection, question_json.theme, question_id)
-                
+                        await update_points(connection, "llm", points, id)
 
-                llm_answer = await ask_llm_answer(question, client, question_json.answering_llm)
-                # PER TESTARE SENZA NLP commentra dentro questa funzione
 
-                await insert_answer(connection, llm_answer, question_id, id, user = None)
+                        await enqueue_event(connection, "llm_question_created", request.session.get("user_id"), question_json.theme)
+
+                    print("DOMANDA INSERITA")
+                    await insert_tags(connection, tags, question_id)
+                    print("TAG INSERITI")
+                    await insert_theme(connection, question_json.theme, question_id)
+
+                    await insert_answer(connection, llm_answer, question_id, id, user = None)
 
                 print("RISPOSTA GENERATA")
+                HomeSnapshot.invalidate()
                 return CreateQuestionResponse(answer = llm_answer, question = question)
             except aiomysql.Error as e:
                 print("Errore mariadb in creazione question: ",e)
@@ -326,18 +442,21 @@ async def answer(answer_json: AnswerInput, request: Request) -> BooleanResponse:
             if answer_json.answering_llm == "":
                 user = request.session.get("user_id")
                 answer = answer_json.answer
-                theme = await get_specific_from_something(connection, "question_theme", "theme_id" ,f"question_id = {question_id}")
-                await check_missions(connection, "answer", request.session.get("user_id"), theme[0][0])
             else:
                 async with httpx.AsyncClient(timeout = 660.0) as client:
-                    question = await get_specific_from_something(connection, "question", "question_text", f"question_id = {question_id}")
+                    question = await run(connection, "question.text", question_id)
                     answer = await ask_llm_answer(question, client, answer_json.answering_llm)
-                id = await get_specific_from_something(connection, "llm", "llm_id", "name=%s", (answer_json.answering_llm,))
-                if id == []:
+                if answer_json.answering_llm not in Catalog.llm_ids:
                     return BooleanResponse(status = False)
-                llm = id[0][0]
-
-            await insert_answer(connection, answer, question_id, llm, user)
+                llm = Catalog.llm_ids[answer_json.answering_llm]
+
+            # La risposta e il suo evento per le missioni vengono confermati insieme
+            async with Connection.transaction(connection):
+                await insert_answer(connection, answer, question_id, llm, user)
+                if user is not None:
+                    theme = await run(connection, "question.theme", question_id)
+                    await enqueue_event(connection, "answer_created", user, theme[0][0])
+            HomeSnapshot.invalidate()
         except aiomysql.Error as e:
             print("Errore nella answer",e)
             return BooleanResponse(status = False)    
@@ -359,29 +478,30 @@ async def validate(ranking_json: ValidateInput, request: Request) -> BooleanResp
             question_id = ranking_json.question
             ranking: dict[int,int] = ranking_json.ranking
 
-            check_ranking = f"select count(*) from user_ranked_question where user_id = {user_id} and question_id = {question_id}"
-            check = await execute_select(connection, check_ranking)
-            if(check[0][0] == 0):
+            # Marcatore del ranking, punti, contatori ed evento missioni vengono confermati con un solo commit.
+            # Il marcatore viene inserito per primo: un secondo ranking concorrente viene respinto dalla chiave primaria
+            # di user_ranked_question e la sua transazione annullata prima di assegnare punti
+            async with Connection.transaction(connection):
+                await run(connection, "ranking.insert", user_id, question_id)
 
+                awards = []
                 points = 250
                 for position in ranking.keys():
-                    answer = ranking[position]
-                    await update_points(connection, "answer", points, answer)
-                    print(f"AGGIUNTI {points} a Risposta {answer}")
+                    awards.append(("answer", ranking[position], points))
                     points -= 50
-                number_ranking_query = "update question set rankings_times = rankings_times+1 where question_id = %s"
-                await execute_modify(connection, number_ranking_query, (question_id,))
-
-                await update_points(connection, "user", 50, user_id)
-
-                theme = await get_specific_from_something(connection, "question_theme", "theme_id", f"question_id = {question_id}")
-                await check_missions(connection, "ranking", user_id, theme[0][0])
+                awards.append(("user", user_id, 50))
+                await record_points_bulk(connection, awards)
 
-                insert_user_ranking = "insert into user_ranked_question(user_id, question_id) values (%s,%s)"
-                await execute_modify(connection, insert_user_ranking, (user_id, question_id,))
-            else:
-                return BooleanResponse(status=False, warning="RANKING GIà EFFETTUATO DALL'UTENTE SU QUESTA DOMANDA")
+                await run(connection, "question.add_ranking", question_id)
+                await execute_modify(connection, *increment_user_stat(user_id, "ranking_number"))
+                theme = await run(connection, "question.theme", question_id)
+                await enqueue_event(connection, "ranking_submitted", user_id, theme[0][0])
 
+        except aiomysql.IntegrityError as e:
+            if e.args[0] != ER_DUP_ENTRY:
+                print("Errore nella validate", e)
+                return BooleanResponse(status = False)
+            return BooleanResponse(status=False, warning="RANKING GIà EFFETTUATO DALL'UTENTE SU QUESTA DOMANDA")
         except aiomysql.Error as e:
             print("Errore nella validate", e)
             return BooleanResponse(status = False)
@@ -400,8 +520,7 @@ async def report(report_json: ReportInput, request: Request) -> BooleanResponse:
         user_id = request.session.get("user_id")
         try:
 
-            check_report = f"select count(*) from report where question_id = {report_json.question} and user_id = {user_id}"
-            check = await execute_select(connection, check_report)
+            check = await run(connection, "report.count", report_json.question, user_id)
             if int(check[0][0]) == 0:
                 #report_query = "insert into report (description, report_type_id, user_id, question_id) values (?,?,?,?)"
                 report_query = "insert into report (user_id, question_id) values (%s,%s)"
@@ -426,8 +545,7 @@ async def report(report_json: ReportInput, request: Request) -> BooleanResponse:
         user_id = request.session.get("user_id")
         try:
             #report_query = "insert into report (description, report_type_id, user_id, question_id) values (?,?,?,?)"
-            check_report = f"select count(*) from report where question_id = {report_json.question} and user_id = {user_id}"
-            check = await execute_select(connection, check_report)
+            check = await run(connection, "report.count", report_json.question, user_id)
             if int(check[0][0]) == 1:
 
                 report_query = "delete from report where user_id = %s and question_id = %s"
@@ -450,24 +568,20 @@ async def get_home_info(request: Request) -> HomeInfoResponse:
 
     request.session["last_active"] = time.time()
     active_users[request.session["user_id"]] = time.time()
-    async with Connection.get_connection() as connection:
-
-        # Costruiamo il dizionario dei 10 migliori contributors
-        contributors: dict[int,dict[str, str]] = await get_contributors(connection)
+    # Le sezioni sono indipendenti e girano in parallelo, ognuna sulla propria connessione
+    sections = FanOut()
 
-        # Costruiamo il dizionario dello user
-        user_data = await get_user_info(connection, request.session["user_id"])
+    # Costruiamo il dizionario dei 10 migliori contributors
+    sections.add("contributors", get_contributors, default = {}, read_only = True)
 
-        # Calcoliamo le domande settimanali
-        weekly_question = await get_weekly_question(connection)
+    # Costruiamo il dizionario dello user
+    sections.add("user_data", get_user_info, request.session["user_id"], required = True, read_only = True)
 
-        # Calcoliamo le trending questions
-        trending_questions = await get_trending_questions(connection)
+    result = await sections.run()
 
-        # Calcoliamo i temi della settimana
-        week_themes = await get_week_themes(connection)
-
-        return HomeInfoResponse(contributors = contributors, user_data = user_data, weekly_question = weekly_question, trending_question = trending_questions, week_themes = week_themes)
+    # Domande settimanali, trending questions e temi della settimana sono globali e vengono letti dalla snapshot
+    snapshot = await HomeSnapshot.get()
+    return HomeInfoResponse(contributors = result["contributors"], user_data = result["user_data"], weekly_question = snapshot["weekly_question"], trending_question = snapshot["trending_questions"], week_themes = snapshot["week_themes"], stale = sections.stale)
 
 
 
@@ -478,33 +592,142 @@ async def get_profile_info(request: Request, user_id: Optional[int] = Query(None
 
     request.session["last_active"] = time.time()
     active_users[request.session["user_id"]] = time.time()
-    async with Connection.get_connection() as connection:
-        if user_id:
-            user_id = user_id
-        else:
-            user_id = request.session.get("user_id")
-        user_data = await get_user_info(connection, user_id)
-        user_question = await get_last_user_questions(connection, user_id)
-        user_answer = await get_last_user_answer(connection, user_id)
-        user_last = await get_last_user_activities(connection, user_id)
-        user_avatars = await get_avatars(connection, user_id)
-        user_titles = await get_titles(connection, user_id)
+    if user_id:
+        user_id = user_id
+    else:
+        user_id = request.session.get("user_id")
+    sections = FanOut()
+    sections.add("user_data", get_user_info, user_id, required = True, read_only = True)
+    sections.add("user_question", get_last_user_questions, user_id, default = ({}, None), read_only = True)
+    sections.add("user_answer", get_last_user_answer, user_id, default = ({}, None), read_only = True)
+    sections.add("user_last", get_last_user_activities, user_id, default = {}, read_only = True)
+    sections.add("user_avatars", get_avatars, user_id, default = {}, read_only = True)
+    sections.add("user_titles", get_titles, user_id, default = {}, read_only = True)
+    result = await sections.run()
+    user_question, question_cursor = result["user_question"]
+    user_answer, answer_cursor = result["user_answer"]
 
-        print(user_data)
+    print(result["user_data"])
 
-        return ProfileInfoResponse(user_data = user_data, user_question = user_question, user_answer = user_answer, user_activities = user_last, user_avatars = user_avatars, user_titles = user_titles)
+    return ProfileInfoResponse(user_data = result["user_data"], user_question = user_question, user_answer = user_answer, user_activities = result["user_last"], user_avatars = result["user_avatars"], user_titles = result["user_titles"], question_cursor = question_cursor, answer_cursor = answer_cursor, stale = sections.stale)
+
+
+@app.get("/get_user_activity", dependencies=[Depends(set_user_id)])
+async def get_user_activity(request: Request, user_id: Optional[int] = Query(None), cursor: Optional[str] = Query(None), limit: int = Query(10, ge=1, le=50), kinds: list[str] = Query(list(ACTIVITY_KINDS))) -> ActivityFeedResponse:
+    """API per ottenere una pagina delle attività di un utente (domande, risposte e missioni completate)"""
+
+
+    request.session["last_active"] = time.time()
+    active_users[request.session["user_id"]] = time.time()
+    if not user_id:
+        user_id = request.session.get("user_id")
+    async with Connection.get_read_connection() as connection:
+        try:
+            activities, next_cursor = await get_activity_feed(connection, user_id, limit, cursor, tuple(kinds))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return ActivityFeedResponse(activity = await format_feed(activities, tuple(kinds)), next_cursor = next_cursor)
+
+
+@app.get("/v2/get_profile_info", dependencies=[Depends(set_user_id)], response_class=ORJSONResponse)
+async def get_profile_info_v2(request: Request, user_id: Optional[int] = Query(None)) -> ORJSONResponse:
+    """API per ottenere le informazioni della pagina profilo, con domande e risposte nel formato compatto v2"""
+
+
+    request.session["last_active"] = time.time()
+    active_users[request.session["user_id"]] = time.time()
+    if not user_id:
+        user_id = request.session.get("user_id")
+    empty_table = {"fields": [], "rows": []}
+    sections = FanOut()
+    sections.add("user_data", get_user_info, user_id, required = True, read_only = True)
+    sections.add("user_question", get_last_user_questions_table, user_id, default = (empty_table, None), read_only = True)
+    sections.add("user_answer", get_last_user_answer_table, user_id, default = (empty_table, None), read_only = True)
+    sections.add("user_last", get_last_user_activities, user_id, default = {}, read_only = True)
+    sections.add("user_avatars", get_avatars, user_id, default = {}, read_only = True)
+    sections.add("user_titles", get_titles, user_id, default = {}, read_only = True)
+    result = await sections.run()
+    user_question, question_cursor = result["user_question"]
+    user_answer, answer_cursor = result["user_answer"]
+    return compact_response(user_data = result["user_data"], user_question = user_question, user_answer = user_answer, user_activities = result["user_last"], user_avatars = result["user_avatars"], user_titles = result["user_titles"], question_cursor = question_cursor, answer_cursor = answer_cursor, stale = sections.stale)
+
+
+@app.get("/v2/get_user_activity", dependencies=[Depends(set_user_id)], response_class=ORJSONResponse)
+async def get_user_activity_v2(request: Request, user_id: Optional[int] = Query(None), cursor: Optional[str] = Query(None), limit: int = Query(10, ge=1, le=50), kinds: list[str] = Query(list(ACTIVITY_KINDS))) -> ORJSONResponse:
+    """API per ottenere una pagina delle attività di un utente nel formato compatto v2"""
+
+
+    request.session["last_active"] = time.time()
+    active_users[request.session["user_id"]] = time.time()
+    if not user_id:
+        user_id = request.session.get("user_id")
+    async with Connection.get_read_connection() as connection:
+        try:
+            activities, next_cursor = await get_activity_feed(connection, user_id, limit, cursor, tuple(kinds))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return compact_response(activity = await activity_table(activities, tuple(kinds)), next_cursor = next_cursor)
 
 
 @app.get("/get_question_page_info", dependencies=[Depends(set_user_id)])
-async def get_question_page_info(request: Request) -> QuestionPageResponse:
-    """API per ottenere le informazioni della pagina delle questions"""
+async def get_question_page_info(request: Request, cursor: Optional[str] = Query(None), limit: int = Query(20, ge=1, le=100)) -> QuestionPageResponse:
+    """API per ottenere una pagina delle informazioni della pagina delle questions, con paginazione a cursore"""
 
 
     request.session["last_active"] = time.time()
     active_users[request.session["user_id"]] = time.time()
     async with Connection.get_connection() as connection:
-        questions = await get_questions(connection, request.session["user_id"])
-    return QuestionPageResponse(questions= questions)
+        try:
+            questions, next_cursor = await get_questions(connection, request.session["user_id"], limit, cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return QuestionPageResponse(questions = questions, next_cursor = next_cursor)
+
+
+@app.get("/get_question_feed", dependencies=[Depends(set_user_id)])
+async def question_feed(request: Request, cursor: Optional[str] = Query(None), limit: int = Query(20, ge=1, le=100), status: Optional[str] = Query(None), theme: Optional[int] = Query(None), creator_type: Optional[str] = Query(None), question_id: Optional[int] = Query(None)) -> QuestionFeedResponse:
+    """API per ottenere una pagina del feed delle domande, ordinata per data di creazione con paginazione a cursore"""
+
+
+    request.session["last_active"] = time.time()
+    active_users[request.session["user_id"]] = time.time()
+    async with Connection.get_read_connection() as connection:
+        try:
+            questions, next_cursor = await get_question_feed(connection, request.session["user_id"], limit, cursor, status, theme, creator_type, question_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return QuestionFeedResponse(questions = questions, next_cursor = next_cursor)
+
+
+@app.get("/v2/get_question_feed", dependencies=[Depends(set_user_id)], response_class=ORJSONResponse)
+async def question_feed_v2(request: Request, cursor: Optional[str] = Query(None), limit: int = Query(20, ge=1, le=100), status: Optional[str] = Query(None), theme: Optional[int] = Query(None), creator_type: Optional[str] = Query(None), question_id: Optional[int] = Query(None)) -> ORJSONResponse:
+    """API per ottenere una pagina del feed delle domande nel formato compatto v2 (tabelle con valori nativi)"""
+
+
+    request.session["last_active"] = time.time()
+    active_users[request.session["user_id"]] = time.time()
+    async with Connection.get_read_connection() as connection:
+        try:
+            questions, next_cursor = await get_question_feed_table(connection, request.session["user_id"], limit, cursor, status, theme, creator_type, question_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return compact_response(questions = questions, next_cursor = next_cursor)
+
+
+@app.get("/get_leaderboard", dependencies=[Depends(set_user_id)])
+async def get_leaderboard(request: Request, item: str = Query("user"), page: int = Query(0, ge=0), size: int = Query(10, ge=1, le=100), period: str = Query("all")) -> LeaderboardResponse:
+    """API per ottenere una pagina della classifica di utenti o llm, di sempre (all), della settimana (weekly) o della stagione (season)"""
+
+
+    if item not in ("user", "llm"):
+        raise HTTPException(status_code=400, detail="Classifica non esistente")
+    if period != "all" and period not in LEADERBOARD_PERIODS:
+        raise HTTPException(status_code=400, detail="Periodo non esistente")
+    request.session["last_active"] = time.time()
+    active_users[request.session["user_id"]] = time.time()
+    async with Connection.get_read_connection() as connection:
+        leaderboard = await get_leaderboard_page(connection, item, page, size, period)
+    return LeaderboardResponse(leaderboard = leaderboard, total = len(Leaderboard.index(item, period)))
 
 
 @app.get("/get_llms")
@@ -514,13 +737,7 @@ async def get_llms(request: Request) -> LlmResponse:
 
     request.session["last_active"] = time.time()
     active_users[request.session["user_id"]] = time.time()
-    async with Connection.get_connection() as connection:
-        llms_query = "select llm_id, name, llm_points from llm"
-        llms = await execute_select(connection, llms_query)
-        result = {}
-        for llm in llms:
-            result[llm[0]] = llm[1]
-        return LlmResponse(llms = result)
+    return LlmResponse(llms = dict(Catalog.llms))
     
 @app.get("/get_user_missions", dependencies=[Depends(set_user_id)])
 async def get_user_missions(request: Request) -> UserMissionResponse:
@@ -580,9 +797,10 @@ async def edit_profile(request: Request, profile_json: ProfileUpdateInput) -> Bo
             values_text +=", current_avatar_id = %s"
             values_tuple += (profile_json.new_avatar,)
 
-        update_profile_query = f"update user set {values_text} where user_id = {user_id}"        
+        # Le colonne da aggiornare dipendono dai campi compilati: la query resta dinamica, i valori passano come parametri
+        update_profile_query = f"update user set {values_text} where user_id = %s"
 
-        await execute_modify(connection, update_profile_query, values_tuple)
+        await execute_modify(connection, update_profile_query, values_tuple + (user_id,))
 
         return BooleanResponse(status = True)
     
@@ -619,8 +837,7 @@ async def change_email_notifications(request: Request) -> BooleanResponse:
 
 
     async with Connection.get_connection() as connection:
-        update_email_notification = f"update user set email_notification = 1 - email_notification where user_id = {request.session["user_id"]}"
-        await execute_modify(connection, update_email_notification)
+        await run(connection, "user.toggle_email_notification", request.session["user_id"])
     return BooleanResponse(status= True)
 
     
@@ -629,9 +846,8 @@ async def change_email_notifications(request: Request) -> BooleanResponse:
 async def get_setting_info(request: Request) -> dict[str, str | None]:
     """API per prendere le informazioni per la pagina settings"""
 
-    info_query = f"select phone_number, email_notification from user where user_id = {request.session["user_id"]}"
     async with Connection.get_connection() as connection:
-        info = await execute_select(connection, info_query)
+        info = await run(connection, "user.setting_info", request.session["user_id"])
     
     return {"phone_number" : info[0][0], "email_notification": str(info[0][1])}
 
@@ -644,29 +860,9 @@ async def get_create_question_info(request: Request) -> CreateQuestionPageRespon
 
 
     request.session["last_active"] = time.time()
-    async with Connection.get_connection() as connection:  
-        themes_db = await get_something(connection, "theme", "*")
-        i = 0
-        themes = {}
-        for theme in themes_db:
-            themes[i] = {}
-            themes[i]["id"] = str(theme[0])
-            themes[i]["name"] = theme[1]
-            i += 1
-
-        
-        llms_db = await get_something(connection, "llm" , "llm_id, name")
-
-        i = 0
-        llms = {}
-        for llm in llms_db:
-            llms[i] = {}
-            llms[i]["id"] = str(llm[0])
-            llms[i]["name"] = llm[1]
-            i += 1
-
-
-        return CreateQuestionPageResponse(themes = themes, llms = llms)
+    themes = {i: {"id": str(theme_id), "name": theme["name"]} for i, (theme_id, theme) in enumerate(Catalog.themes.items())}
+    llms = {i: {"id": str(llm_id), "name": name} for i, (llm_id, name) in enumerate(Catalog.llms.items())}
+    return CreateQuestionPageResponse(themes = themes, llms = llms)
 
 
 @app.post("/upvote", dependencies=[Depends(set_user_id)])
@@ -675,21 +871,12 @@ async def upvote(request: Request, upvote_json: VoteInput) -> BooleanResponse:
     
     
     request.session["last_active"] = time.time()
+    active_users[request.session["user_id"]] = time.time()
     async with Connection.get_connection() as connection:
-        question_id = upvote_json.question_id
-        print(question_id)
-        user_id = request.session["user_id"]
-        check_upvote_query = f"select count(*) from user_question_upvote where question_id = {question_id} and user_id = {user_id}"
-        check = await execute_select(connection, check_upvote_query)
-        if(int(check[0][0]) == 0):
-            upvote_query = "insert into user_question_upvote(question_id, user_id) values (%s,%s)"
-            await execute_modify(connection, upvote_query, (question_id, user_id,))
-            update_upvote = f"update question set upvotes = upvotes + 1 where question_id = {question_id}"
-            await execute_modify(connection, update_upvote)
-
+        if await vote(connection, "upvote", upvote_json.question_id, request.session["user_id"]):
+            HomeSnapshot.invalidate()
             return BooleanResponse(status = True)
-        else:
-            return BooleanResponse(status = False)
+        return BooleanResponse(status = False)
         
 @app.post("/downvote", dependencies=[Depends(set_user_id)])
 async def downvote(request: Request, downvote_json: VoteInput) -> BooleanResponse:
@@ -699,64 +886,37 @@ async def downvote(request: Request, downvote_json: VoteInput) -> BooleanRespons
     request.session["last_active"] = time.time()
     active_users[request.session["user_id"]] = time.time()
     async with Connection.get_connection() as connection:
-        question_id = downvote_json.question_id
-        user_id = request.session["user_id"]
-        check_downvote_query = f"select count(*) from user_question_downvote where question_id = {question_id} and user_id = {user_id}"
-        check = await execute_select(connection, check_downvote_query)
-        if(int(check[0][0]) == 0):
-            downvote_query = "insert into user_question_downvote(question_id, user_id) values (%s,%s)"
-            await execute_modify(connection, downvote_query, (question_id, user_id,))
-            update_downvote = f"update question set downvotes = downvotes + 1 where question_id = {question_id}"
-            await execute_modify(connection, update_downvote)
-            
+        if await vote(connection, "downvote", downvote_json.question_id, request.session["user_id"]):
+            HomeSnapshot.invalidate()
             return BooleanResponse(status = True)
-        else:
-            return BooleanResponse(status = False)
+        return BooleanResponse(status = False)
         
 
 @app.post("/remove_upvote", dependencies=[Depends(set_user_id)])
-async def upvote(request: Request, upvote_json: VoteInput) -> BooleanResponse:
+async def remove_upvote(request: Request, upvote_json: VoteInput) -> BooleanResponse:
     """API per rimuovere l'upvote di una question da parte dell'utente"""
     
     
     request.session["last_active"] = time.time()
     active_users[request.session["user_id"]] = time.time()
     async with Connection.get_connection() as connection:
-        question_id = upvote_json.question_id
-        user_id = request.session["user_id"]
-        check_upvote_query = f"select count(*) from user_question_upvote where question_id = {question_id} and user_id = {user_id}"
-        check = await execute_select(connection, check_upvote_query)
-        if(int(check[0][0]) == 1):
-            upvote_query = "delete from user_question_upvote where question_id = %s and user_id = %s"
-            await execute_modify(connection, upvote_query, (question_id, user_id,))
-            update_upvote = f"update question set upvotes = upvotes - 1 where question_id = {question_id}"
-            await execute_modify(connection, update_upvote)
-            
+        if await remove_vote(connection, "upvote", upvote_json.question_id, request.session["user_id"]):
+            HomeSnapshot.invalidate()
             return BooleanResponse(status = True)
-        else:
-            return BooleanResponse(status = False)
+        return BooleanResponse(status = False)
         
 @app.post("/remove_downvote", dependencies=[Depends(set_user_id)])
-async def upvote(request: Request, upvote_json: VoteInput) -> BooleanResponse:
+async def remove_downvote(request: Request, downvote_json: VoteInput) -> BooleanResponse:
     """API per rimuovere il downvote di una question da parte dell'utente"""
     
     
     request.session["last_active"] = time.time()
     active_users[request.session["user_id"]] = time.time()
     async with Connection.get_connection() as connection:
-        question_id = upvote_json.question_id
-        user_id = request.session["user_id"]
-        check_downvote_query = f"select count(*) from user_question_downvote where question_id = {question_id} and user_id = {user_id}"
-        check = await execute_select(connection, check_downvote_query)
-        if(int(check[0][0]) == 1):
-            downvote_query = "delete from user_question_downvote where question_id = %s and user_id = %s"
-            await execute_modify(connection, downvote_query, (question_id, user_id,))
-            update_downvote = f"update question set downvotes = downvotes - 1 where question_id = {question_id}"
-            await execute_modify(connection, update_downvote)
-            
+        if await remove_vote(connection, "downvote", downvote_json.question_id, request.session["user_id"]):
+            HomeSnapshot.invalidate()
             return BooleanResponse(status = True)
-        else:
-            return BooleanResponse(status = False)
+        return BooleanResponse(status = False)
         
 
 @app.post("/delete_user", dependencies=[Depends(set_user_id)])
@@ -766,8 +926,8 @@ async def delete_user(request: Request) -> BooleanResponse:
 
     user_id = request.session["user_id"]
     async with Connection.get_connection() as connection:
-        delete_query = f"delete from user where user_id = {user_id}"
-        await execute_modify(connection, delete_query)
+        await run(connection, "user.delete", user_id)
+    Leaderboard.users.remove(user_id)
     request.session.clear()
     if user_id in active_users.keys():
         del active_users[user_id]
@@ -103,6 +103,9 @@ class HomeInfoResponse(BaseModel):
 
     week_themes: dict[int, dict[str, str]]
 
+    """Sezioni non completate entro il budget della richiesta, restituite vuote"""
+    stale: list[str] = []
+
 
 class OnlineUserResponse(BaseModel):
 
@@ -126,11 +129,41 @@ class ProfileInfoResponse(BaseModel):
 
     user_titles: dict[int, dict[str, str]]
 
+    """Cursori per caricare altre domande e risposte dell'utente"""
+    question_cursor: Optional[str] = None
+
+    answer_cursor: Optional[str] = None
+
+    """Sezioni non completate entro il budget della richiesta, restituite vuote"""
+    stale: list[str] = []
+
+
+class ActivityFeedResponse(BaseModel):
+
+    """Attività dell'utente dalla più recente"""
+    activity: dict[int, dict[str, str]]
+
+    """Cursore da passare per ottenere la pagina successiva, None se le attività sono finite"""
+    next_cursor: Optional[str] = None
+
+
 class QuestionPageResponse(BaseModel):
 
     """Domande e relativi dati"""
     questions: dict[int, dict[str, Union[str, dict[int, dict[str, str]], list[str]]]]
 
+    """Cursore da passare per ottenere la pagina successiva, None se le domande sono finite"""
+    next_cursor: Optional[str] = None
+
+
+class QuestionFeedResponse(BaseModel):
+
+    """Pagina di domande e relativi dati"""
+    questions: dict[int, dict[str, Union[str, dict[int, dict[str, str]], list[str]]]]
+
+    """Cursore da passare per ottenere la pagina successiva, None se le domande sono finite"""
+    next_cursor: Optional[str] = None
+
 
 class AnswerResponse(BaseModel):
 
@@ -146,6 +179,15 @@ class LlmResponse(BaseModel):
     """Nomi delle LLM presenti"""
     llms: dict[int, str]
 
+class LeaderboardResponse(BaseModel):
+
+    """Pagina della classifica, con chiave la posizione nella pagina"""
+    leaderboard: dict[int, dict[str, str]]
+
+    """Numero totale di elementi in classifica"""
+    total: int
+
+
 class UserMissionResponse(BaseModel):
 
 
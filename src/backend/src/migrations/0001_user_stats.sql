@@ -0,0 +1,13 @@
+/* Tabelle aggiunte dopo la prima versione di init.sql: vengono create sui db già esistenti senza toccare i dati */
+
+create table if not exists user_stats(
+    user_id int primary key,
+    question_number int not null default 0,
+    answer_number int not null default 0,
+    ranking_number int not null default 0,
+    mission_number int not null default 0,      /* missioni completate */
+    active_missions int not null default 0,     /* missioni non completate e non scadute */
+    badge_missions int not null default 0,      /* missioni completate con badge come premio */
+    mission_points int not null default 0,      /* punti guadagnati con le missioni */
+    foreign key(user_id) references user(user_id) on delete cascade on update cascade
+);
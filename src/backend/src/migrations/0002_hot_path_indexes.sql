@@ -0,0 +1,22 @@
+/* Indici per le query più frequenti di get_info.py, activity_feed.py, question_page.py e daily_check.py.
+   InnoDB indicizza già da solo le colonne delle foreign key: questi indici composti aggiungono la colonna
+   di ordinamento, così le query "ultime N righe di ..." leggono solo le righe che restituiscono */
+
+/* risposte di una domanda (answer loader, conteggi) e ultime risposte di un utente (profilo, feed attività) */
+create index if not exists answer_question_idx on answer(question_id, answered_at);
+create index if not exists answer_user_idx on answer(user_id, answered_at);
+
+/* feed delle domande filtrato per stato, chiusura giornaliera delle domande e ultime domande di un utente */
+create index if not exists question_status_created_idx on question(status, created_at);
+create index if not exists question_created_idx on question(created_at);
+create index if not exists question_creator_idx on question(created_by_user_id, created_at);
+
+/* missioni attive e completate di un utente */
+create index if not exists mission_user_state_idx on mission_user(user_id, completed, expired);
+
+/* classifica degli utenti */
+create index if not exists user_points_idx on user(user_points);
+
+/* voti di un utente su una domanda */
+create index if not exists upvote_question_user_idx on user_question_upvote(question_id, user_id);
+create index if not exists downvote_question_user_idx on user_question_downvote(question_id, user_id);
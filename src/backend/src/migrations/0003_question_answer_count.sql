@@ -0,0 +1,8 @@
+/* Numero di risposte mantenuto su question da insert_answer, al posto dei count(*) sulla tabella answer */
+
+alter table question add column if not exists answer_count int not null default 0;
+
+update question q
+left join (select question_id, count(*) as answers from answer group by question_id) a on a.question_id = q.question_id
+set q.answer_count = ifnull(a.answers, 0)
+where q.answer_count <> ifnull(a.answers, 0);
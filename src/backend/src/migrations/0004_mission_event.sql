@@ -0,0 +1,14 @@
+/* Coda durevole degli eventi di dominio che fanno avanzare le missioni, consumata da MissionEventWorker */
+
+create table if not exists mission_event(
+    event_id bigint AUTO_INCREMENT primary key,
+    user_id int not null,
+    event varchar(64) not null,             /* answer_created, question_created, ranking_submitted, ... */
+    theme int default null,
+    created_at timestamp(3) default CURRENT_TIMESTAMP(3),
+    processed_at timestamp(3) null default null,
+    foreign key(user_id) references user(user_id) on delete cascade on update cascade
+);
+
+create index if not exists mission_event_pending_idx on mission_event(processed_at, event_id);
+create index if not exists mission_event_user_idx on mission_event(user_id, processed_at, event_id);
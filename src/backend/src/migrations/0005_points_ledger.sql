@@ -0,0 +1,14 @@
+/* Registro append-only dei punti assegnati: update_points inserisce una riga, PointsAggregator somma a blocchi
+   le righe non ancora riportate nei totali di user, answer e llm. Le righe restano come storico delle assegnazioni */
+
+create table if not exists points_ledger(
+    ledger_id bigint AUTO_INCREMENT primary key,
+    item ENUM('user', 'answer', 'llm') not null,
+    target_id int not null,                 /* user_id, answer_id o llm_id in base a item */
+    points int not null,
+    created_at timestamp(3) default CURRENT_TIMESTAMP(3),
+    folded_at timestamp(3) null default null  /* istante in cui i punti sono stati sommati al totale */
+);
+
+create index if not exists points_ledger_pending_idx on points_ledger(folded_at, ledger_id);
+create index if not exists points_ledger_target_idx on points_ledger(item, target_id, folded_at);
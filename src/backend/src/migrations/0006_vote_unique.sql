@@ -0,0 +1,21 @@
+/* Un solo voto per (domanda, utente): i voti doppi lasciati da click concorrenti vengono cancellati tenendo
+   il più vecchio, poi l'indice unico prende il posto di quello non unico della 0002 e rende idempotenti
+   gli insert ignore di utils/votes.py */
+
+delete v1 from user_question_upvote v1
+join user_question_upvote v2 on v2.question_id = v1.question_id and v2.user_id = v1.user_id and v2.upvote_id < v1.upvote_id;
+delete v1 from user_question_downvote v1
+join user_question_downvote v2 on v2.question_id = v1.question_id and v2.user_id = v1.user_id and v2.downvote_id < v1.downvote_id;
+
+create unique index if not exists upvote_question_user_unique on user_question_upvote(question_id, user_id);
+create unique index if not exists downvote_question_user_unique on user_question_downvote(question_id, user_id);
+
+drop index if exists upvote_question_user_idx on user_question_upvote;
+drop index if exists downvote_question_user_idx on user_question_downvote;
+
+/* contatori riallineati ai voti rimasti */
+update question q
+left join (select question_id, count(*) as votes from user_question_upvote group by question_id) u on u.question_id = q.question_id
+left join (select question_id, count(*) as votes from user_question_downvote group by question_id) d on d.question_id = q.question_id
+set q.upvotes = ifnull(u.votes, 0), q.downvotes = ifnull(d.votes, 0)
+where q.upvotes <> ifnull(u.votes, 0) or q.downvotes <> ifnull(d.votes, 0);
@@ -0,0 +1,12 @@
+/* Le missioni "Entra nella top N" avevano kind ranking, lo stesso delle missioni "Classifica N risposte":
+   avanzavano ad ogni ranking inviato invece che con la posizione in classifica. Passano al kind leaderboard,
+   completato da utils/leaderboard_missions.py quando l'utente entra nelle prime value posizioni */
+
+alter table mission modify kind ENUM('answer','question','ranking','llm','user', 'mission', 'leaderboard');
+
+update mission set kind = 'leaderboard' where type = 'objective' and kind = 'ranking' and description like 'Entra nella top %';
+
+/* l'avanzamento contato con i ranking non ha significato per la classifica */
+update mission_user mu join mission m on m.mission_id = mu.mission_id
+set mu.progress = 0
+where m.kind = 'leaderboard' and mu.completed = 0;
@@ -0,0 +1,28 @@
+/* Punti di utenti e llm per periodo (settimana ISO e stagione di tre mesi), sommati da PointsAggregator insieme
+   ai totali. Le classifiche settimanali e stagionali leggono solo le righe del periodo, mai lo storico del registro.
+   Al cambio di periodo si inizia semplicemente a scrivere su una nuova chiave */
+
+create table if not exists points_period(
+    item ENUM('user', 'llm') not null,
+    period varchar(16) not null,            /* 2026-W42 per le settimane, 2026-S4 per le stagioni */
+    target_id int not null,
+    points int not null default 0,
+    primary key(item, period, target_id)
+);
+
+create index if not exists points_period_rank_idx on points_period(item, period, points);
+
+/* periodi ricostruiti dalle righe del registro già sommate, quelle in attesa li aggiornano quando vengono sommate */
+insert into points_period (item, period, target_id, points)
+select item, concat(yearweek(created_at, 3) div 100, '-W', lpad(yearweek(created_at, 3) mod 100, 2, '0')), target_id, sum(points)
+from points_ledger
+where item <> 'answer' and folded_at is not null
+group by item, yearweek(created_at, 3), target_id
+on duplicate key update points = values(points);
+
+insert into points_period (item, period, target_id, points)
+select item, concat(year(created_at), '-S', quarter(created_at)), target_id, sum(points)
+from points_ledger
+where item <> 'answer' and folded_at is not null
+group by item, year(created_at), quarter(created_at), target_id
+on duplicate key update points = values(points);
@@ -0,0 +1,264 @@
+import base64
+import datetime
+from typing import Any, Optional, Union
+import aiomysql
+
+from utils.query_execute import execute_select
+from utils.get_info import get_hours
+from utils.wire_format import to_table
+from utils.votes import VoteCounter
+
+
+# Ordine delle attività a parità di data: prima le domande, poi le risposte, infine le missioni
+ACTIVITY_KINDS: dict[str, int] = {"question": 3, "answer": 2, "mission": 1}
+
+
+# Ogni ramo della union seleziona le stesse colonne:
+# kind, kind_rank, id, at, text, question_id, question_text, status, rankings_times, upvotes, downvotes, question_tags, answer_number
+ACTIVITY_BRANCHES: dict[str, str] = {
+    "question": """
+        (select 'question' as kind, 3 as kind_rank, q.question_id as id, q.created_at as at, q.question_text as text,
+                q.question_id, q.question_text, q.status, q.rankings_times, q.upvotes, q.downvotes, q.question_tags,
+                q.answer_count as answer_number
+         from question q
+         where q.created_by_user_id = %s {condition}
+         order by q.created_at desc, q.question_id desc
+         limit %s)""",
+    "answer": """
+        (select 'answer' as kind, 2 as kind_rank, a.answer_id as id, a.answered_at as at, a.answer_text as text,
+                q.question_id, q.question_text, q.status, q.rankings_times, q.upvotes, q.downvotes, q.question_tags,
+                null as answer_number
+         from answer a
+         join question q on q.question_id = a.question_id
+         where a.user_id = %s {condition}
+         order by a.answered_at desc, a.answer_id desc
+         limit %s)""",
+    "mission": """
+        (select 'mission' as kind, 1 as kind_rank, m.mission_id as id, mu.completed_at as at, m.description as text,
+                null, null, null, null, null, null, null, null
+         from mission_user mu
+         join mission m on m.mission_id = mu.mission_id
+         where mu.user_id = %s and mu.completed = 1 and mu.completed_at is not null {condition}
+         order by mu.completed_at desc, m.mission_id desc
+         limit %s)""",
+}
+
+ACTIVITY_COLUMNS: dict[str, tuple[str, str]] = {
+    "question": ("q.created_at", "q.question_id"),
+    "answer": ("a.answered_at", "a.answer_id"),
+    "mission": ("mu.completed_at", "m.mission_id"),
+}
+
+
+def encode_activity_cursor(at: datetime.datetime, kind: str, id: int) -> str:
+    """Metodo per creare il cursore opaco a partire dall'ultima attività restituita"""
+
+    raw = f"{at.strftime('%Y-%m-%d %H:%M:%S')}|{kind}|{id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_activity_cursor(cursor: str) -> tuple[str, str, int]:
+    """Metodo per leggere il cursore, solleva ValueError se è stato manomesso"""
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        at, kind, id = raw.split("|")
+        at = datetime.datetime.strptime(at, "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d %H:%M:%S")
+        if kind not in ACTIVITY_KINDS:
+            raise ValueError(kind)
+        return at, kind, int(id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Cursore non valido: {cursor}") from e
+
+
+def _branch_condition(kind: str, cursor: Optional[tuple[str, str, int]]) -> tuple[str, tuple[Union[str, int], ...]]:
+    """Metodo per tradurre il cursore (at, kind, id) nella condizione di keyset del singolo ramo"""
+
+    if cursor is None:
+        return "", ()
+    at, cursor_kind, cursor_id = cursor
+    at_column, id_column = ACTIVITY_COLUMNS[kind]
+    if ACTIVITY_KINDS[kind] < ACTIVITY_KINDS[cursor_kind]:
+        return f"and {at_column} <= %s", (at,)
+    if ACTIVITY_KINDS[kind] > ACTIVITY_KINDS[cursor_kind]:
+        return f"and {at_column} < %s", (at,)
+    return f"and ({at_column} < %s or ({at_column} = %s and {id_column} < %s))", (at, at, cursor_id,)
+
+
+async def get_activity_feed(connection: aiomysql.Connection, user_id: int, limit: int, cursor: Optional[str] = None, kinds: tuple[str, ...] = tuple(ACTIVITY_KINDS)) -> tuple[list[dict[str, Any]], Optional[str]]:
+    """Metodo per ritornare le attività di un utente (domande, risposte e missioni completate) dalla più recente,
+    con una sola query e il cursore della pagina successiva"""
+
+    decoded = decode_activity_cursor(cursor) if cursor is not None else None
+    branches = []
+    parametri: tuple[Union[str, int], ...] = ()
+    for kind in kinds:
+        if kind not in ACTIVITY_KINDS:
+            raise ValueError(f"Tipo di attività non valido: {kind}")
+        condition, condition_values = _branch_condition(kind, decoded)
+        branches.append(ACTIVITY_BRANCHES[kind].format(condition = condition))
+        parametri += (user_id,) + condition_values + (limit + 1,)
+    if len(branches) == 0:
+        return [], None
+
+    # Una riga in più serve solo per sapere se esiste una pagina successiva
+    feed_query = " union all ".join(branches) + " order by at desc, kind_rank desc, id desc limit %s"
+    parametri += (limit + 1,)
+    rows = await execute_select(connection, feed_query, parametri)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_activity_cursor(rows[-1][3], rows[-1][0], rows[-1][2])
+
+    activities = []
+    for row in rows:
+        upvotes, downvotes = VoteCounter.fresh(row[5], row[9], row[10]) if row[5] is not None else (row[9], row[10])
+        activities.append({
+            "kind": row[0],
+            "id": row[2],
+            "at": row[3],
+            "text": row[4],
+            "question_id": row[5],
+            "question_text": row[6],
+            "status": row[7],
+            "rankings_times": row[8],
+            "upvotes": upvotes,
+            "downvotes": downvotes,
+            "question_tags": row[11],
+            "answer_number": row[12],
+        })
+    return activities, next_cursor
+
+
+async def format_activities(activities: list[dict[str, Any]]) -> dict[int, dict[str, str]]:
+    """Metodo per formattare le attività come dizionario di stringhe"""
+
+    result: dict[int, dict[str, str]] = {}
+    i = 0
+    for activity in activities:
+        result[i] = {}
+        for key, value in activity.items():
+            if value is not None:
+                result[i][key] = str(value)
+        hours = await get_hours(str(activity["at"]))
+        result[i]["hours"] = str(hours["tempo"])
+        result[i]["hours_type"] = hours["tipo"]
+        i += 1
+    return result
+
+
+# Campi dei record delle domande e delle risposte del profilo, usati anche come colonne delle tabelle v2
+QUESTION_ACTIVITY_FIELDS = ("question_id", "question_text", "ranking_times", "status", "created_at", "hours", "hours_type",
+                            "answer_number", "upvotes", "downvotes", "question_tags")
+
+ANSWER_ACTIVITY_FIELDS = ("question_text", "question_id", "answered_at", "hours", "hours_type", "answer_id", "answer_text")
+
+
+async def question_activity_records(activities: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Metodo per costruire i record nativi delle domande del feed nel formato di user_question"""
+
+    records = []
+    for question in activities:
+        hours = await get_hours(str(question["at"]))
+        records.append({
+            "question_id": question["question_id"],
+            "question_text": question["question_text"],
+            "ranking_times": question["rankings_times"],
+            "status": question["status"],
+            "created_at": question["at"],
+            "hours": hours["tempo"],
+            "hours_type": hours["tipo"],
+            "answer_number": question["answer_number"],
+            "upvotes": question["upvotes"],
+            "downvotes": question["downvotes"],
+            "question_tags": question["question_tags"],
+        })
+    return records
+
+
+async def answer_activity_records(activities: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Metodo per costruire i record nativi delle risposte del feed nel formato di user_answer"""
+
+    records = []
+    for answer in activities:
+        hours = await get_hours(str(answer["at"]))
+        records.append({
+            "question_text": answer["question_text"],
+            "question_id": answer["question_id"],
+            "answered_at": answer["at"],
+            "hours": hours["tempo"],
+            "hours_type": hours["tipo"],
+            "answer_id": answer["id"],
+            "answer_text": answer["text"],
+        })
+    return records
+
+
+def _stringify(records: list[dict[str, Any]]) -> dict[int, dict[str, str]]:
+    return {i: {key: str(value) for key, value in record.items()} for i, record in enumerate(records)}
+
+
+async def format_question_activities(activities: list[dict[str, Any]]) -> dict[int, dict[str, str]]:
+    """Metodo per formattare le domande del feed nel formato di user_question"""
+
+    return _stringify(await question_activity_records(activities))
+
+
+async def format_answer_activities(activities: list[dict[str, Any]]) -> dict[int, dict[str, str]]:
+    """Metodo per formattare le risposte del feed nel formato di user_answer"""
+
+    return _stringify(await answer_activity_records(activities))
+
+
+async def activity_table(activities: list[dict[str, Any]], kinds: tuple[str, ...]) -> dict[str, list]:
+    """Metodo per trasformare il feed nella tabella compatta del formato v2, con le colonne della sezione del profilo se contiene un solo tipo"""
+
+    if kinds == ("question",):
+        return to_table(await question_activity_records(activities), QUESTION_ACTIVITY_FIELDS)
+    if kinds == ("answer",):
+        return to_table(await answer_activity_records(activities), ANSWER_ACTIVITY_FIELDS)
+    for activity in activities:
+        hours = await get_hours(str(activity["at"]))
+        activity["hours"] = hours["tempo"]
+        activity["hours_type"] = hours["tipo"]
+    return to_table(activities, ("kind", "id", "at", "text", "question_id", "question_text", "status", "rankings_times",
+                                 "upvotes", "downvotes", "question_tags", "answer_number", "hours", "hours_type"))
+
+
+async def format_feed(activities: list[dict[str, Any]], kinds: tuple[str, ...]) -> dict[int, dict[str, str]]:
+    """Metodo per formattare il feed: se contiene un solo tipo usa il formato della relativa sezione del profilo"""
+
+    if kinds == ("question",):
+        return await format_question_activities(activities)
+    if kinds == ("answer",):
+        return await format_answer_activities(activities)
+    return await format_activities(activities)
+
+
+async def get_last_user_questions(connection: aiomysql.Connection, user_id: int, limit: int = 10, cursor: Optional[str] = None) -> tuple[dict[int, dict[str, str]], Optional[str]]:
+    """Metodo per trovare le ultime domande poste da un utente con il numero di risposte ricevute"""
+
+    questions, next_cursor = await get_activity_feed(connection, user_id, limit, cursor, ("question",))
+    return await format_question_activities(questions), next_cursor
+
+
+async def get_last_user_answer(connection: aiomysql.Connection, user_id: int, limit: int = 10, cursor: Optional[str] = None) -> tuple[dict[int, dict[str, str]], Optional[str]]:
+    """Metodo per trovare le ultime risposte fornite dall'utente e le rispettive domande"""
+
+    answers, next_cursor = await get_activity_feed(connection, user_id, limit, cursor, ("answer",))
+    return await format_answer_activities(answers), next_cursor
+
+
+async def get_last_user_questions_table(connection: aiomysql.Connection, user_id: int, limit: int = 10, cursor: Optional[str] = None) -> tuple[dict[str, list], Optional[str]]:
+    """Metodo per trovare le ultime domande poste da un utente nel formato compatto v2"""
+
+    questions, next_cursor = await get_activity_feed(connection, user_id, limit, cursor, ("question",))
+    return await activity_table(questions, ("question",)), next_cursor
+
+
+async def get_last_user_answer_table(connection: aiomysql.Connection, user_id: int, limit: int = 10, cursor: Optional[str] = None) -> tuple[dict[str, list], Optional[str]]:
+    """Metodo per trovare le ultime risposte fornite dall'utente nel formato compatto v2"""
+
+    answers, next_cursor = await get_activity_feed(connection, user_id, limit, cursor, ("answer",))
+    return await activity_table(answers, ("answer",)), next_cursor
@@ -0,0 +1,93 @@
+from typing import Any, Optional
+import aiomysql
+
+from utils.query_execute import execute_select
+
+
+# Risposte di più domande con il creatore (llm o user con avatar e titolo) già risolto in una sola query.
+# I punti includono quelli del registro non ancora sommati dall'aggregatore, riportati a intero (sum ritorna un DECIMAL)
+ANSWERS_QUERY = """
+select a.answer_id, a.question_id, a.answer_text,
+       cast(a.points + (select ifnull(sum(p.points), 0) from points_ledger p where p.item = 'answer' and p.target_id = a.answer_id and p.folded_at is null) as signed),
+       a.answered_at, a.llm_id, a.user_id,
+       l.name, u.username, av.path, t.name
+from answer a
+left join llm l on l.llm_id = a.llm_id
+left join user u on u.user_id = a.user_id
+left join avatar av on av.avatar_id = u.current_avatar_id
+left join title t on t.title_id = u.current_title_id
+where a.question_id in ({placeholders})
+order by a.question_id, a.answer_id
+"""
+
+
+async def load_answers(connection: aiomysql.Connection, question_ids: list[int]) -> dict[int, list[dict[str, Any]]]:
+    """Metodo per caricare le risposte di una lista di domande, raggruppate per domanda"""
+
+    answers: dict[int, list[dict[str, Any]]] = {int(question_id): [] for question_id in question_ids}
+    if len(answers) == 0:
+        return answers
+    placeholders = ", ".join(["%s"] * len(answers))
+    rows = await execute_select(connection, ANSWERS_QUERY.format(placeholders = placeholders), tuple(answers.keys()))
+    for row in rows:
+        answer: dict[str, Any] = {
+            "answer_id": row[0],
+            "question_id": row[1],
+            "answer_text": row[2],
+            "points": row[3],
+            "answered_at": row[4],
+            "creator_type": None,
+            "creator": None,
+            "creator_avatar": None,
+            "creator_title": None,
+        }
+        if row[5] is not None:
+            answer["creator_type"] = "llm"
+            answer["creator"] = row[7]
+        elif row[6] is not None:
+            answer["creator_type"] = "user"
+            answer["creator"] = row[8]
+            answer["creator_avatar"] = row[9]
+            answer["creator_title"] = row[10]
+        answers[row[1]].append(answer)
+    return answers
+
+
+def format_answers(answers: list[dict[str, Any]]) -> dict[int, dict[str, str]]:
+    """Metodo per formattare le risposte di una domanda come dizionario numerato da 1"""
+
+    result: dict[int, dict[str, str]] = {}
+    i = 1
+    for answer in answers:
+        result[i] = {}
+        result[i]["answer_id"] = str(answer["answer_id"])
+        result[i]["answer_text"] = answer["answer_text"]
+        if answer["creator_type"] is not None:
+            result[i]["creator_type"] = answer["creator_type"]
+            result[i]["creator"] = answer["creator"]
+        result[i]["points"] = str(answer["points"])
+        result[i]["answered_at"] = str(answer["answered_at"])
+        i += 1
+    return result
+
+
+def rank_answers(answers: list[dict[str, Any]], top: Optional[int] = 5) -> list[dict[str, Any]]:
+    """Metodo per ordinare le risposte di una domanda in base ai punti e tenere le prime top"""
+
+    return sorted(answers, key = lambda answer: (-answer["points"], answer["answer_id"]))[:top]
+
+
+def format_ranking(answers: list[dict[str, Any]], top: Optional[int] = 5) -> dict[int, dict[str, str]]:
+    """Metodo per calcolare la classifica delle risposte di una domanda in base ai punti"""
+
+    ranking = rank_answers(answers, top)
+    result: dict[int, dict[str, str]] = {}
+    i = 1
+    for answer in ranking:
+        result[i] = {}
+        result[i]["answer_text"] = answer["answer_text"]
+        result[i]["points"] = str(answer["points"])
+        if answer["creator_type"] is not None:
+            result[i]["creator"] = answer["creator"]
+        i += 1
+    return result
@@ -0,0 +1,165 @@
+import asyncio
+from typing import Any, Optional
+import aiomysql
+
+from utils.connection import Connection, PoolExhaustedError
+from utils.query_execute import execute_select, run
+
+
+# Ogni quanti secondi il catalogo controlla se le tabelle di riferimento sono cambiate
+CATALOG_REFRESH = 30
+
+# Avatar usato quando un avatar_id non esiste più (es. immagine personalizzata cancellata)
+DEFAULT_AVATAR_ID = 1
+
+# Impronta delle tabelle di riferimento: cambia se cambia il loro contenuto. Di llm contano solo gli id e i nomi,
+# i punti cambiano ad ogni risposta e non fanno parte del catalogo
+CATALOG_CHECKSUM_QUERY = "checksum table avatar, title, badge, theme, mission"
+CATALOG_LLM_QUERY = "select count(*), max(llm_id), group_concat(name order by llm_id) from llm"
+
+
+class Catalog:
+    """Tabelle di riferimento piccole e quasi statiche (avatar, title, badge, theme, llm, mission) caricate in memoria
+    all'avvio e ricaricate quando cambiano, su POST /reload_catalog o con SIGHUP"""
+
+    avatars: dict[int, str] = {}
+    titles: dict[int, str] = {}
+    badges: dict[int, dict[str, str]] = {}
+    themes: dict[int, dict[str, Any]] = {}
+    llms: dict[int, str] = {}
+    llm_ids: dict[str, int] = {}
+    missions: dict[int, dict[str, Any]] = {}
+
+    # Id delle missioni per (kind, theme), theme None per le missioni senza tema
+    missions_by_kind: dict[tuple[str, Optional[int]], list[int]] = {}
+
+    _fingerprint: Optional[tuple] = None
+    _reload: asyncio.Event = None
+
+
+    @classmethod
+    async def _current_fingerprint(cls, connection: aiomysql.Connection) -> tuple:
+        checksums = await execute_select(connection, CATALOG_CHECKSUM_QUERY)
+        llm = await execute_select(connection, CATALOG_LLM_QUERY)
+        return tuple(row[1] for row in checksums) + tuple(llm[0])
+
+
+    @classmethod
+    async def load(cls, connection: aiomysql.Connection) -> None:
+        """Metodo per caricare tutte le tabelle del catalogo, sostituendo le mappe solo a caricamento completato"""
+
+        fingerprint = await cls._current_fingerprint(connection)
+        avatars = {row[0]: row[1] for row in await execute_select(connection, "select avatar_id, path from avatar")}
+        titles = {row[0]: row[1] for row in await execute_select(connection, "select title_id, name from title")}
+        badges = {row[0]: {"title": row[1], "description": row[2], "tier": row[3], "path": row[4]}
+                  for row in await execute_select(connection, "select badge_id, title, description, tier, path from badge")}
+        themes = {row[0]: {"name": row[1], "of_the_week": row[2], "text": row[3], "subtext": row[4]}
+                  for row in await execute_select(connection, "select theme_id, name, of_the_week, theme_text, theme_subtext from theme order by theme_id")}
+        llms = {row[0]: row[1] for row in await execute_select(connection, "select llm_id, name from llm order by llm_id")}
+        missions: dict[int, dict[str, Any]] = {}
+        missions_by_kind: dict[tuple[str, Optional[int]], list[int]] = {}
+        for row in await execute_select(connection, "select mission_id, type, kind, theme, description, reward_coins, reward_points, reward_badge, reward_title, value from mission order by mission_id"):
+            missions[row[0]] = {"type": row[1], "kind": row[2], "theme": row[3], "description": row[4], "reward_coins": row[5],
+                                "reward_points": row[6], "reward_badge": row[7], "reward_title": row[8], "value": row[9]}
+            missions_by_kind.setdefault((row[2], row[3]), []).append(row[0])
+
+        cls.avatars, cls.titles, cls.badges, cls.themes = avatars, titles, badges, themes
+        cls.llms, cls.llm_ids = llms, {name: llm_id for llm_id, name in llms.items()}
+        cls.missions, cls.missions_by_kind = missions, missions_by_kind
+        cls._fingerprint = fingerprint
+        print(f"Catalogo caricato: {len(avatars)} avatar, {len(titles)} titoli, {len(badges)} badge, {len(themes)} temi, {len(llms)} llm, {len(missions)} missioni")
+
+
+    @classmethod
+    async def reload_if_changed(cls, connection: aiomysql.Connection) -> bool:
+        """Metodo per ricaricare il catalogo solo se l'impronta delle tabelle è cambiata"""
+
+        if await cls._current_fingerprint(connection) == cls._fingerprint:
+            return False
+        await cls.load(connection)
+        return True
+
+
+    @classmethod
+    def request_reload(cls) -> None:
+        """Metodo per chiedere un ricaricamento completo al task in background (POST /reload_catalog, SIGHUP)"""
+
+        if cls._reload is None:
+            cls._reload = asyncio.Event()
+        cls._reload.set()
+
+
+    @classmethod
+    async def run(cls) -> None:
+        """Task in background che ricarica il catalogo quando cambia o quando viene richiesto"""
+
+        if cls._reload is None:
+            cls._reload = asyncio.Event()
+        while True:
+            requested = False
+            try:
+                await asyncio.wait_for(cls._reload.wait(), timeout = CATALOG_REFRESH)
+                requested = True
+            except asyncio.TimeoutError:
+                pass
+            cls._reload.clear()
+            try:
+                async with Connection.get_connection() as connection:
+                    if requested:
+                        await cls.load(connection)
+                    else:
+                        await cls.reload_if_changed(connection)
+            except (aiomysql.Error, PoolExhaustedError) as e:
+                print("Errore mariadb nel ricaricamento del catalogo: ", e)
+            except Exception as e:
+                print("Errore nel ricaricamento del catalogo: ", e)
+
+
+    @classmethod
+    async def avatar_path(cls, connection: aiomysql.Connection, avatar_id: int) -> str:
+        """Metodo per il path di un avatar: gli avatar personalizzati creati da un altro processo non ancora ricaricati
+        vengono letti dal db e aggiunti al catalogo, quelli cancellati ricadono sull'avatar di default"""
+
+        path = cls.avatars.get(avatar_id)
+        if path is None:
+            row = await run(connection, "avatar.path", avatar_id)
+            if len(row) == 0:
+                return cls.avatars.get(DEFAULT_AVATAR_ID, "/images/assets/avatar/default-avatar-circle.jpg")
+            path = row[0][0]
+            cls.avatars[avatar_id] = path
+        return path
+
+
+    @classmethod
+    async def theme(cls, connection: aiomysql.Connection, theme_id: int) -> Optional[dict[str, Any]]:
+        """Metodo per un tema del catalogo: un tema creato dopo l'ultimo caricamento viene letto dal db, aggiunto
+        al catalogo e viene chiesto un ricaricamento completo. Ritorna None se il tema non esiste"""
+
+        theme = cls.themes.get(theme_id)
+        if theme is None:
+            row = await run(connection, "theme.by_id", theme_id)
+            if len(row) == 0:
+                return None
+            theme = {"name": row[0][0], "of_the_week": row[0][1], "text": row[0][2], "subtext": row[0][3]}
+            cls.themes[theme_id] = theme
+            cls.request_reload()
+        return theme
+
+
+    @classmethod
+    def add_avatar(cls, avatar_id: int, path: str) -> None:
+        """Metodo per registrare un avatar personalizzato appena creato"""
+
+        cls.avatars[avatar_id] = path
+
+
+    @classmethod
+    def mission_ids(cls, kind: str, theme: Optional[int]) -> list[int]:
+        """Metodo per le missioni che avanzano con un evento di tipo kind sul tema theme: quelle senza tema
+        e, se theme è None, quelle di qualsiasi tema, altrimenti solo quelle del tema"""
+
+        ids = list(cls.missions_by_kind.get((kind, None), []))
+        for (mission_kind, mission_theme), mission_ids in cls.missions_by_kind.items():
+            if mission_kind == kind and mission_theme is not None and (theme is None or mission_theme == theme):
+                ids += mission_ids
+        return ids
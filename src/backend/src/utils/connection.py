@@ -1,52 +1,261 @@
 import asyncio
+import contextvars
+import os
+import time
+import weakref
 from contextlib import asynccontextmanager
-from typing import AsyncContextManager, AsyncGenerator
+from typing import AsyncContextManager, AsyncGenerator, Callable, Optional
 import aiomysql
 
 
+# Limiti superiori in secondi dei bucket dell'istogramma dei tempi di attesa per una connessione
+ACQUIRE_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float("inf"))
+
+
+class PoolExhaustedError(Exception):
+    """Nessuna connessione del pool si è liberata entro il tempo massimo di attesa"""
+
+
+# Stato della richiesta corrente: utente e se la richiesta ha già scritto sul primario.
+# È un dizionario condiviso, così anche i task figli (es. FanOut) vedono le scritture della richiesta
+_request_state: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("request_state", default=None)
+
+
 class Connection:
-    """Gestore asincrono della connessione al database MariaDB usando aiomysql."""
+    """Gestore asincrono della connessione al database MariaDB usando aiomysql.
+    Le scritture usano il pool del primario, le letture che lo scelgono possono usare il pool della replica"""
 
     pool: aiomysql.Pool = None
 
+    # Pool delle letture sulla replica, coincide con pool se DB_REPLICA_HOST non è impostato
+    read_pool: aiomysql.Pool = None
+
+    # Secondi per cui un utente che ha scritto legge dal primario anche nelle richieste successive
+    pin_seconds: float = 5.0
+
+    # Utenti che hanno scritto di recente, con l'istante fino a cui restano sul primario
+    _pinned_users: dict[int, float] = {}
+
+    # Secondi massimi di attesa per una connessione prima di fallire con PoolExhaustedError
+    acquire_timeout: float = 5.0
+
+    # Richieste in attesa di una connessione
+    waiters: int = 0
+
+    # Numero di attese scadute dall'avvio
+    acquire_timeouts: int = 0
+
+    # Conteggi delle attese per bucket di ACQUIRE_WAIT_BUCKETS
+    acquire_wait_histogram: list[int] = [0] * len(ACQUIRE_WAIT_BUCKETS)
+
+    # Connessioni con una transazione aperta da transaction(), con le callback da eseguire dopo il commit
+    _transactions: "weakref.WeakKeyDictionary[aiomysql.Connection, list[Callable[[], None]]]" = weakref.WeakKeyDictionary()
+
     @classmethod
     async def start_connection(cls) -> None:
-        """Inizializza il pool di connessioni al database, aspettando che sia pronto."""
+        """Inizializza il pool di connessioni al database, aspettando che sia pronto.
+        Parametri e dimensioni del pool vengono letti dalle variabili d'ambiente DB_*"""
+
+        cls.acquire_timeout = float(os.environ.get("DB_ACQUIRE_TIMEOUT", 5))
+        cls.pin_seconds = float(os.environ.get("DB_REPLICA_PIN_SECONDS", 5))
+        cls.pool = await cls._create_pool(
+            os.environ.get("DB_HOST", "mariadb-culturaLLM"),
+            int(os.environ.get("DB_PORT", 3306)),
+            int(os.environ.get("DB_POOL_MIN", 1)),
+            int(os.environ.get("DB_POOL_MAX", 10)),
+        )
+        if os.environ.get("DB_REPLICA_HOST"):
+            cls.read_pool = await cls._create_pool(
+                os.environ["DB_REPLICA_HOST"],
+                int(os.environ.get("DB_REPLICA_PORT", 3306)),
+                int(os.environ.get("DB_REPLICA_POOL_MIN", os.environ.get("DB_POOL_MIN", 1))),
+                int(os.environ.get("DB_REPLICA_POOL_MAX", os.environ.get("DB_POOL_MAX", 10))),
+            )
+        else:
+            cls.read_pool = cls.pool
+
 
+    @classmethod
+    async def _create_pool(cls, host: str, port: int, minsize: int, maxsize: int) -> aiomysql.Pool:
         for attempt in range(30):
             try:
-                cls.pool = await aiomysql.create_pool(
-                    host="mariadb-culturaLLM",
-                    port=3306,
-                    user="user",
-                    password="pwd",
-                    db="culturaLLM",
+                # create_pool apre subito minsize connessioni, così le prime richieste non pagano la connessione
+                pool = await aiomysql.create_pool(
+                    host=host,
+                    port=port,
+                    user=os.environ.get("DB_USER", "user"),
+                    password=os.environ.get("DB_PASSWORD", "pwd"),
+                    db=os.environ.get("DB_NAME", "culturaLLM"),
                     autocommit=True,
-                    minsize=1,
-                    maxsize=10,
+                    minsize=minsize,
+                    maxsize=maxsize,
                 )
-                print("Connessione asincrona al database stabilita!!")
-                return
+                print(f"Connessione asincrona al database {host} stabilita!! Pool {pool.size}/{maxsize}, attesa massima {cls.acquire_timeout}s")
+                return pool
             except aiomysql.OperationalError as e:
-                print(f"Tentativo {attempt+1}: DB non pronto, riprovo tra 2 secondi...")
+                print(f"Tentativo {attempt+1}: DB {host} non pronto, riprovo tra 2 secondi...")
                 await asyncio.sleep(2)
 
-        raise ConnectionError("Impossibile connettersi al db dopo 30 tentativi")
+        raise ConnectionError(f"Impossibile connettersi al db {host} dopo 30 tentativi")
+
+
+    @classmethod
+    def begin_request(cls, user_id: Optional[int] = None) -> None:
+        """Metodo da chiamare all'inizio di ogni richiesta: azzera lo stato delle scritture e ricorda l'utente"""
+
+        _request_state.set({"user_id": user_id, "wrote": False})
+
+
+    @classmethod
+    def mark_write(cls) -> None:
+        """Metodo chiamato da ogni scrittura: il resto della richiesta, e le richieste dello stesso utente
+        per pin_seconds, leggono dal primario per vedere le proprie scritture anche se la replica è in ritardo"""
+
+        state = _request_state.get()
+        if state is None:
+            return
+        state["wrote"] = True
+        if state["user_id"] is not None:
+            cls._pinned_users[state["user_id"]] = time.time() + cls.pin_seconds
+
+
+    @classmethod
+    def _pinned(cls) -> bool:
+        state = _request_state.get()
+        if state is None:
+            return False
+        if state["wrote"]:
+            return True
+        until = cls._pinned_users.get(state["user_id"])
+        if until is None:
+            return False
+        if until < time.time():
+            del cls._pinned_users[state["user_id"]]
+            return False
+        return True
 
     @classmethod
     @asynccontextmanager
     async def get_connection(cls) -> AsyncGenerator[aiomysql.Connection, None]:
-        if cls.pool is None:
+        """Connessione al primario, per le scritture e per le letture che devono essere sempre aggiornate"""
+
+        async with cls._acquire(cls.pool) as conn:
+            yield conn
+
+
+    @classmethod
+    @asynccontextmanager
+    async def get_read_connection(cls) -> AsyncGenerator[aiomysql.Connection, None]:
+        """Connessione per sole letture: usa la replica, tranne quando la richiesta o l'utente hanno appena scritto"""
+
+        pool = cls.pool if cls._pinned() else cls.read_pool
+        async with cls._acquire(pool) as conn:
+            yield conn
+
+
+    @classmethod
+    @asynccontextmanager
+    async def _acquire(cls, pool: aiomysql.Pool) -> AsyncGenerator[aiomysql.Connection, None]:
+        if pool is None:
             raise ConnectionError("Pool di connessioni non inizializzato")
-        conn = await cls.pool.acquire()
+        start = time.perf_counter()
+        cls.waiters += 1
+        try:
+            conn = await asyncio.wait_for(pool.acquire(), timeout = cls.acquire_timeout)
+        except asyncio.TimeoutError:
+            cls.acquire_timeouts += 1
+            raise PoolExhaustedError(f"Nessuna connessione libera dopo {cls.acquire_timeout}s")
+        finally:
+            cls.waiters -= 1
+            cls._observe_wait(time.perf_counter() - start)
         try:
             yield conn
         finally:
-            cls.pool.release(conn)
+            pool.release(conn)
+
+    @classmethod
+    def _observe_wait(cls, seconds: float) -> None:
+        for i, bound in enumerate(ACQUIRE_WAIT_BUCKETS):
+            if seconds <= bound:
+                cls.acquire_wait_histogram[i] += 1
+                return
+
+
+    @classmethod
+    def stats(cls) -> dict[str, object]:
+        """Metodo per leggere lo stato attuale del pool: dimensioni, connessioni in uso, attese e istogramma delle attese"""
+
+        result: dict[str, object] = {}
+        pools = {"write": cls.pool}
+        if cls.read_pool is not cls.pool:
+            pools["read"] = cls.read_pool
+        for name, pool in pools.items():
+            size = pool.size if pool is not None else 0
+            free = pool.freesize if pool is not None else 0
+            result[name] = {
+                "minsize": pool.minsize if pool is not None else 0,
+                "maxsize": pool.maxsize if pool is not None else 0,
+                "size": size,
+                "in_use": size - free,
+                "free": free,
+            }
+        result["waiters"] = cls.waiters
+        result["acquire_timeouts"] = cls.acquire_timeouts
+        result["pinned_users"] = len(cls._pinned_users)
+        result["acquire_wait_histogram"] = {str(bound): count for bound, count in zip(ACQUIRE_WAIT_BUCKETS, cls.acquire_wait_histogram)}
+        return result
+
+
+    @classmethod
+    @asynccontextmanager
+    async def transaction(cls, connection: Optional[aiomysql.Connection] = None) -> AsyncGenerator[aiomysql.Connection, None]:
+        """Unità di lavoro: tutte le scritture eseguite nel blocco vengono confermate con un unico commit,
+        oppure annullate insieme se il blocco solleva un'eccezione.
+        Senza connessione ne prende una dal pool; se la connessione è già in una transazione il blocco
+        entra in quella esterna, che resta l'unica a fare commit"""
+
+        if connection is None:
+            async with cls.get_connection() as connection:
+                async with cls.transaction(connection) as connection:
+                    yield connection
+            return
+
+        if connection in cls._transactions:
+            yield connection
+            return
+
+        cls.mark_write()
+        await connection.begin()
+        cls._transactions[connection] = []
+        try:
+            yield connection
+            await connection.commit()
+        except BaseException:
+            del cls._transactions[connection]
+            await connection.rollback()
+            raise
+        callbacks = cls._transactions.pop(connection)
+        for callback in callbacks:
+            callback()
+
+
+    @classmethod
+    def after_commit(cls, connection: aiomysql.Connection, callback: Callable[[], None]) -> None:
+        """Metodo per eseguire callback (es. aggiornare una cache in memoria) solo quando le scritture sono confermate:
+        subito se la connessione non è in una transazione, altrimenti dopo il commit e mai in caso di rollback"""
+
+        if connection in cls._transactions:
+            cls._transactions[connection].append(callback)
+        else:
+            callback()
+
 
     @classmethod
     async def close_connection(cls) -> None:
         """Chiude il pool di connessioni."""
+        if cls.read_pool and cls.read_pool is not cls.pool:
+            cls.read_pool.close()
+            await cls.read_pool.wait_closed()
         if cls.pool:
             cls.pool.close()
             await cls.pool.wait_closed()
@@ -2,9 +2,12 @@ import httpx
 import aiomysql
 
 
-from typing import Any, Union
+from typing import Any, Optional, Union
 
-from utils.query_execute import execute_modify, execute_select
+from utils.query_execute import execute_modify, execute_insert
+from utils.catalog import Catalog
+from utils.user_stats import increment_user_stat
+from utils.connection import Connection
 
 
 async def request_to_ollama(client: httpx.AsyncClient, content: str, llm: str) -> str:
@@ -28,26 +31,27 @@ async def insert_theme(connection: aiomysql.Connection, theme: int, question_id:
     await execute_modify(connection, question_theme_query, (question_id, theme,))
                     
 
-async def insert_question(connection: aiomysql.Connection, values_text: str, values: tuple[Union[str, int]]) -> int:
-    """Metodo per inserire la question e ritornare l'id della question appena inserita"""
+async def insert_question(connection: aiomysql.Connection, values_text: str, values: tuple[Union[str, int]], user_id: Optional[int] = None) -> int:
+    """Metodo per inserire la question e ritornare l'id della question appena inserita.
+    Se la domanda è di un utente, il suo contatore delle domande viene aggiornato nella stessa transazione"""
    
    
     question_query = "insert into question (" + values_text + ") values (%s, %s)"
        
     try:
-        async with connection.cursor() as cursor:
-            await cursor.execute(question_query, values)
-            await connection.commit()
-            question_id = cursor.lastrowid
-            print(question_id)
-            return question_id
+        async with Connection.transaction(connection):
+            question_id = await execute_insert(connection, question_query, values)
+            if user_id is not None:
+                await execute_modify(connection, *increment_user_stat(user_id, "question_number"))
+        print(question_id)
+        return question_id
     except aiomysql.Error as e:
         print(f"Errore durante l'esecuzione della query inser_question: {e}")
         raise e
         
 
-async def insert_tags(client: httpx.Client ,connection: aiomysql.Connection, question: str, question_id: int) -> None:
-    """Metodo che calcola i tags di una domanda e li inserisce nel db"""
+async def request_tags(client: httpx.Client, question: str) -> str:
+    """Metodo che chiede al server nlp i tags di una domanda"""
 
     orange_json = {"question" : question}
     #COMMENTA QUESTE 3 RIGHE SOTTO
@@ -55,7 +59,12 @@ async def insert_tags(client: httpx.Client ,connection: aiomysql.Connection, que
     response.raise_for_status()
     result = response.json()
 
-    tags = result["tags"]
+    return result["tags"]
+
+
+async def insert_tags(connection: aiomysql.Connection, tags: str, question_id: int) -> None:
+    """Metodo che inserisce nel db i tags di una domanda"""
+
     tags_query = "update question set question_tags = %s where question_id = %s"
     #COMMENTA QUI SOPRA E INSERISCI:
     #tags_query = "update question set question_tags = '['prova','prova2','prova3']' where question_id = %s"
@@ -66,6 +75,5 @@ async def insert_tags(client: httpx.Client ,connection: aiomysql.Connection, que
 async def check_week_theme(connection: aiomysql.Connection, theme_id: int) -> int:
     """Metodo per controllare se il tema è della settimana"""
 
-    theme_query = f"select of_the_week from theme where theme_id = {theme_id}"
-    result = await execute_select(connection, theme_query)
-    return result[0][0]
\ No newline at end of file
+    theme = await Catalog.theme(connection, int(theme_id))
+    return theme["of_the_week"] if theme is not None else 0
\ No newline at end of file
@@ -1,17 +1,17 @@
 import aiomysql
 
 from utils.sign_up import check_sign_up
-from utils.various_tools import get_specific_from_something
-from utils.query_execute import execute_modify, execute_select
+from utils.query_execute import execute_modify, execute_select, run
 from utils.sign_in import get_pass_and_salt, check_password
 from utils.sign_up import hash_password
-from utils.game_operation import check_missions
+from utils.mission_events import enqueue_event
+from utils.catalog import Catalog
 
 
 async def check_edit_profile(username: str, user_id: int, connection: aiomysql.Connection) -> bool:
     """Metodo per controllare che lo username non sia già in uso"""
 
-    check_user_username = await get_specific_from_something(connection, "user", "username", f"user_id = {user_id}")
+    check_user_username = await run(connection, "user.username", user_id)
 
     if username == check_user_username[0][0]:
         return False
@@ -24,21 +24,18 @@ async def set_image(user_id: int, path: str, connection: aiomysql.Connection) ->
     """Metodo per eliminare eventuali image già presenti per l'utente"""
 
     if path != "/images/assets/avatar/default-avatar-circle.jpg":
-        username = await get_specific_from_something(connection, "user", "username", f"user_id = {user_id}")
+        username = await run(connection, "user.username", user_id)
         username = username[0][0]
         if path != f"/images/uploads/{username}.jpg":
-            set_id = f"update user set current_avatar_id = 1 where user_id = {user_id}"
-            await execute_modify(connection, set_id)
-            old_image = f"delete from avatar where path ='/images/uploads/{username}.jpg'"
-            await execute_modify(connection, old_image)
+            await run(connection, "user.reset_avatar", user_id)
+            await run(connection, "avatar.delete_by_path", f"/images/uploads/{username}.jpg")
         
-        query = f"select count(*) from avatar where path = '{path}'"
-        check = await execute_select(connection, query)
+        check = await run(connection, "avatar.count_by_path", path)
         if check[0][0] == 0:
-            new_image = f"insert into avatar(path) values ('{path}')"
-            await execute_modify(connection, new_image)
+            await run(connection, "avatar.insert", path)
         new_id = "select avatar_id from avatar where path =%s"
         new_id = await execute_select(connection, new_id, (path,))
+        Catalog.add_avatar(new_id[0][0], path)
         return new_id[0][0]
     return 1
 
@@ -47,7 +44,7 @@ async def set_image(user_id: int, path: str, connection: aiomysql.Connection) ->
 async def check_current_pass(connection: aiomysql.Connection, current_password: str, user_id: int) -> bool:
     """Metodo per controllare se la password inserita dall'utente è corretta"""
 
-    username = await get_specific_from_something(connection, "user", "username", f"user_id = {user_id}")
+    username = await run(connection, "user.username", user_id)
 
     result = await get_pass_and_salt(connection, username[0][0])
     password = result["password"]
@@ -69,13 +66,11 @@ async def edit_password(connection: aiomysql.Connection, new_password: str, user
 async def check_first_edit(connection: aiomysql.Connection, user_id: int) -> None:
     """Metodo per controllare se l'utente sta inserendo dati per la prima volta"""
 
-    query = f"select name from user where user_id = {user_id}"
-
-    result = await execute_select(connection, query)
+    result = await run(connection, "user.name", user_id)
 
     if result[0][0] == None:
         print("PRIMA MODIFICA")
-        await check_missions(connection, "user", user_id)
+        await enqueue_event(connection, "profile_completed", user_id)
         return
     else:
         print("ACCOUNT GIA MODIFICATO")
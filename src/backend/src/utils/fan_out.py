@@ -0,0 +1,102 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from utils.connection import Connection
+
+
+# Numero massimo di connessioni del pool usate in parallelo da una singola richiesta
+FAN_OUT_CONCURRENCY = 3
+
+# Tempo massimo in secondi concesso alle sezioni non obbligatorie di una richiesta
+FAN_OUT_BUDGET = 2.0
+
+
+class Section:
+    """Sezione indipendente di un endpoint composito: una funzione che riceve la connessione e i suoi argomenti"""
+
+    def __init__(self, name: str, func: Callable[..., Awaitable[Any]], args: tuple, default: Any, required: bool, read_only: bool) -> None:
+        self.name = name
+        self.func = func
+        self.args = args
+
+        # Valore restituito al posto del risultato se la sezione non termina entro il budget
+        self.default = default
+
+        # Le sezioni obbligatorie vengono sempre attese, senza budget
+        self.required = required
+
+        # Le sezioni di sola lettura usano una connessione della replica
+        self.read_only = read_only
+
+
+class FanOut:
+    """Esegue in parallelo le sezioni indipendenti di una richiesta, ognuna su una propria connessione del pool.
+    Al massimo concurrency sezioni girano insieme; quelle non obbligatorie che superano il budget vengono
+    interrotte, sostituite dal loro valore di default e segnalate in stale"""
+
+    def __init__(self, concurrency: int = FAN_OUT_CONCURRENCY, budget: float = FAN_OUT_BUDGET) -> None:
+        self.sections: list[Section] = []
+        self.budget = budget
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+        # Nomi delle sezioni restituite con il valore di default perché scadute
+        self.stale: list[str] = []
+
+
+    def add(self, name: str, func: Callable[..., Awaitable[Any]], *args: Any, default: Any = None, required: bool = False, read_only: bool = False) -> None:
+        """Metodo per aggiungere una sezione, func viene chiamata come func(connection, *args)"""
+
+        self.sections.append(Section(name, func, args, default, required, read_only))
+
+
+    async def _run_section(self, section: Section) -> Any:
+        async with self._semaphore:
+            get_connection = Connection.get_read_connection if section.read_only else Connection.get_connection
+            async with get_connection() as connection:
+                try:
+                    return await section.func(connection, *section.args)
+                except asyncio.CancelledError:
+                    # Una query interrotta lascia il protocollo a metà: la connessione viene chiusa e non torna nel pool
+                    connection.close()
+                    raise
+
+
+    async def run(self) -> dict[str, Any]:
+        """Metodo per eseguire tutte le sezioni e ritornare i risultati per nome"""
+
+        start = time.perf_counter()
+        tasks: dict[str, asyncio.Task] = {section.name: asyncio.create_task(self._run_section(section)) for section in self.sections}
+        optional = [tasks[section.name] for section in self.sections if not section.required]
+        required = [tasks[section.name] for section in self.sections if section.required]
+
+        try:
+            if len(optional) != 0:
+                await asyncio.wait(optional, timeout = self.budget)
+            if len(required) != 0:
+                await asyncio.gather(*required)
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+
+        result: dict[str, Any] = {}
+        error: Optional[BaseException] = None
+        for section in self.sections:
+            task = tasks[section.name]
+            if not task.done():
+                task.cancel()
+                self.stale.append(section.name)
+                result[section.name] = section.default
+            elif task.exception() is not None:
+                error = error or task.exception()
+            else:
+                result[section.name] = task.result()
+        await asyncio.gather(*tasks.values(), return_exceptions = True)
+
+        if len(self.stale) != 0:
+            print(f"FanOut: sezioni scadute dopo {time.perf_counter() - start:.2f}s: {self.stale}")
+        if error is not None:
+            # Gli errori delle sezioni vengono propagati come se le sezioni fossero state eseguite in sequenza
+            raise error
+        return result
@@ -0,0 +1,90 @@
+import asyncio
+import time
+from typing import Union
+import aiomysql
+
+from utils.connection import Connection, PoolExhaustedError
+from utils.get_info import get_weekly_question, get_trending_questions, get_week_themes
+
+
+# Ogni quanti secondi la snapshot viene ricalcolata anche senza invalidazioni
+HOME_SNAPSHOT_REFRESH = 60
+
+# Attesa minima tra due ricalcoli, per raggruppare le invalidazioni ravvicinate (es. raffiche di voti)
+HOME_SNAPSHOT_DEBOUNCE = 2
+
+
+class HomeSnapshot:
+    """Sezioni globali della home (domande della settimana, trending questions e temi della settimana)
+    materializzate in memoria da un task in background, così le richieste della home non interrogano il db per esse"""
+
+    weekly_question: int = 0
+    trending_questions: dict[int, dict[str, Union[str, list[str]]]] = {}
+    week_themes: dict[int, dict[str, str]] = {}
+
+    # Istante dell'ultimo ricalcolo, None se la snapshot non è mai stata calcolata
+    refreshed_at: float = None
+
+    _dirty: asyncio.Event = None
+    _lock: asyncio.Lock = None
+
+
+    @classmethod
+    def _init_sync(cls) -> None:
+        # Gli oggetti asyncio vanno creati quando il loop è già attivo
+        if cls._dirty is None:
+            cls._dirty = asyncio.Event()
+            cls._lock = asyncio.Lock()
+
+
+    @classmethod
+    async def refresh(cls, connection: aiomysql.Connection) -> None:
+        """Metodo per ricalcolare tutte le sezioni della snapshot"""
+
+        cls._init_sync()
+        async with cls._lock:
+            weekly_question = await get_weekly_question(connection)
+            trending_questions = await get_trending_questions(connection)
+            week_themes = await get_week_themes(connection)
+            # Le sezioni vengono sostituite insieme, una richiesta non legge mai una snapshot a metà
+            cls.weekly_question, cls.trending_questions, cls.week_themes = weekly_question, trending_questions, week_themes
+            cls.refreshed_at = time.time()
+
+
+    @classmethod
+    def invalidate(cls) -> None:
+        """Metodo da chiamare quando cambia un dato della home (nuova domanda, voto, risposta): anticipa il prossimo ricalcolo"""
+
+        cls._init_sync()
+        cls._dirty.set()
+
+
+    @classmethod
+    async def run(cls) -> None:
+        """Task in background che ricalcola la snapshot ogni HOME_SNAPSHOT_REFRESH secondi o dopo un'invalidazione"""
+
+        cls._init_sync()
+        while True:
+            try:
+                async with Connection.get_read_connection() as connection:
+                    await cls.refresh(connection)
+            except (aiomysql.Error, PoolExhaustedError) as e:
+                print("Errore mariadb nel ricalcolo della snapshot della home: ", e)
+            except Exception as e:
+                print("Errore nel ricalcolo della snapshot della home: ", e)
+            try:
+                await asyncio.wait_for(cls._dirty.wait(), timeout = HOME_SNAPSHOT_REFRESH)
+                await asyncio.sleep(HOME_SNAPSHOT_DEBOUNCE)
+            except asyncio.TimeoutError:
+                pass
+            cls._dirty.clear()
+
+
+    @classmethod
+    async def get(cls) -> dict[str, Union[int, dict]]:
+        """Metodo per leggere la snapshot, calcolandola al volo solo se il task non l'ha ancora prodotta"""
+
+        if cls.refreshed_at is None:
+            async with Connection.get_read_connection() as connection:
+                await cls.refresh(connection)
+        return {"weekly_question": cls.weekly_question, "trending_questions": cls.trending_questions, "week_themes": cls.week_themes}
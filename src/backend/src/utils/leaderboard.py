@@ -0,0 +1,226 @@
+import datetime
+from typing import Iterable, Optional
+import aiomysql
+from sortedcontainers import SortedList
+
+from utils.query_execute import execute_select, execute_stream, run
+
+
+# Totali di user o llm più i punti del registro non ancora sommati, per caricare la classifica
+LEADERBOARD_LOAD_QUERY = """
+select t.{id}, cast(t.{points} + ifnull(p.pending, 0) as signed)
+from {table} t
+left join (select target_id, sum(points) as pending from points_ledger where item = '{item}' and folded_at is null group by target_id) p on p.target_id = t.{id}
+"""
+
+# Classifiche a finestra temporale oltre a quella di sempre ("all"): settimana ISO e stagione di tre mesi
+LEADERBOARD_PERIODS = ("weekly", "season")
+
+# Punti del periodo in corso: bucket già sommati più le righe del registro del periodo non ancora sommate
+PERIOD_LOAD_QUERY = """
+select target_id, cast(sum(points) as signed) from (
+    select target_id, points from points_period where item = %s and period = %s
+    union all
+    select target_id, points from points_ledger where item = %s and folded_at is null and created_at >= %s
+) p
+group by target_id
+"""
+
+
+def period_key(period: str, when: Optional[datetime.datetime] = None) -> str:
+    """Metodo per la chiave del periodo che contiene when (di default adesso), es. 2026-W42 o 2026-S4"""
+
+    when = when or datetime.datetime.now()
+    if period == "weekly":
+        year, week, _ = when.isocalendar()
+        return f"{year}-W{week:02d}"
+    elif period == "season":
+        return f"{when.year}-S{(when.month - 1) // 3 + 1}"
+    raise ValueError(f"Periodo non esistente: {period}")
+
+
+def period_start(period: str, when: Optional[datetime.datetime] = None) -> datetime.datetime:
+    """Metodo per l'istante di inizio del periodo che contiene when"""
+
+    when = when or datetime.datetime.now()
+    day = datetime.datetime(when.year, when.month, when.day)
+    if period == "weekly":
+        return day - datetime.timedelta(days = when.weekday())
+    elif period == "season":
+        return datetime.datetime(when.year, (when.month - 1) // 3 * 3 + 1, 1)
+    raise ValueError(f"Periodo non esistente: {period}")
+
+
+class LeaderboardIndex:
+    """Classifica in memoria ordinata per punti, con rank, top-N e paginazione in tempo logaritmico"""
+
+    def __init__(self) -> None:
+        # Le chiavi sono (-punti, id): l'ordine naturale è quello della classifica, a parità di punti vince l'id minore
+        self._entries: SortedList = SortedList()
+        self._points: dict[int, int] = {}
+
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+
+    def __contains__(self, id: int) -> bool:
+        return id in self._points
+
+
+    def load(self, rows: Iterable[tuple[int, int]]) -> None:
+        """Metodo per ricostruire l'indice da coppie (id, punti)"""
+
+        self._points = {int(row[0]): int(row[1] or 0) for row in rows}
+        self._entries = SortedList((-points, id) for id, points in self._points.items())
+
+
+    def set_points(self, id: int, points: int) -> None:
+        """Metodo per impostare il totale dei punti di un elemento, inserendolo se non presente"""
+
+        id = int(id)
+        old = self._points.get(id)
+        if old is not None:
+            self._entries.remove((-old, id))
+        self._points[id] = int(points)
+        self._entries.add((-int(points), id))
+
+
+    def add_points(self, id: int, points: int) -> None:
+        """Metodo per sommare punti ad un elemento"""
+
+        self.set_points(id, self._points.get(int(id), 0) + int(points))
+
+
+    def remove(self, id: int) -> None:
+        """Metodo per togliere un elemento dalla classifica"""
+
+        old = self._points.pop(int(id), None)
+        if old is not None:
+            self._entries.remove((-old, int(id)))
+
+
+    def points(self, id: int) -> Optional[int]:
+        return self._points.get(int(id))
+
+
+    def rank(self, id: int) -> Optional[int]:
+        """Metodo per calcolare la posizione di un elemento con la stessa semantica di RANK(): 1 + numero di elementi con più punti"""
+
+        points = self._points.get(int(id))
+        if points is None:
+            return None
+        return self._entries.bisect_left((-points,)) + 1
+
+
+    def count_above(self, points: int) -> int:
+        """Metodo per contare gli elementi con un punteggio strettamente maggiore"""
+
+        return self._entries.bisect_left((-int(points),))
+
+
+    def page(self, offset: int, limit: int) -> list[tuple[int, int, int]]:
+        """Metodo per ritornare una pagina della classifica come terne (posizione, id, punti)"""
+
+        result = []
+        for key in self._entries.islice(offset, offset + limit):
+            result.append((self._entries.bisect_left((key[0],)) + 1, key[1], -key[0]))
+        return result
+
+
+    def top(self, n: int) -> list[tuple[int, int, int]]:
+        """Metodo per ritornare i primi n elementi della classifica"""
+
+        return self.page(0, n)
+
+
+class Leaderboard:
+    """Classifiche globali di utenti e LLM, di sempre e del periodo in corso, caricate allo startup e aggiornate da update_points"""
+
+    users: LeaderboardIndex = LeaderboardIndex()
+    llms: LeaderboardIndex = LeaderboardIndex()
+
+    # Classifiche del periodo in corso per (item, periodo), con la chiave del periodo a cui si riferiscono
+    periods: dict[tuple[str, str], tuple[str, LeaderboardIndex]] = {}
+
+    # Utenti i cui punti sono cambiati dall'ultimo controllo delle missioni di classifica
+    changed: set[int] = set()
+
+
+    @classmethod
+    async def load(cls, connection: aiomysql.Connection) -> None:
+        """Metodo per caricare le classifiche dal db"""
+
+        # Gli utenti vengono letti in streaming: in memoria resta solo l'indice, non anche il risultato della select.
+        # Ai totali si aggiungono i punti del registro non ancora sommati dall'aggregatore
+        users: dict[int, int] = {}
+        async for rows in execute_stream(connection, LEADERBOARD_LOAD_QUERY.format(table = "user", id = "user_id", points = "user_points", item = "user")):
+            users.update((row[0], row[1]) for row in rows)
+        cls.users.load(users.items())
+        cls.llms.load(await execute_select(connection, LEADERBOARD_LOAD_QUERY.format(table = "llm", id = "llm_id", points = "llm_points", item = "llm")))
+        # Le classifiche dei periodi leggono solo le righe del periodo in corso
+        periods: dict[tuple[str, str], tuple[str, LeaderboardIndex]] = {}
+        for item in ("user", "llm"):
+            for period in LEADERBOARD_PERIODS:
+                key = period_key(period)
+                index = LeaderboardIndex()
+                index.load(await execute_select(connection, PERIOD_LOAD_QUERY, (item, key, item, period_start(period))))
+                periods[(item, period)] = (key, index)
+        cls.periods = periods
+        print(f"Leaderboard caricata: {len(cls.users)} utenti, {len(cls.llms)} llm")
+
+
+    @classmethod
+    def index(cls, item: str, period: str = "all") -> LeaderboardIndex:
+        """Metodo per scegliere la classifica in base all'item (user o llm) e al periodo (all, weekly, season).
+        Al cambio di periodo la classifica riparte vuota in tempo costante, i bucket dei periodi passati restano nel db"""
+
+        if item not in ("user", "llm"):
+            raise ValueError(f"Classifica non esistente: {item}")
+        if period == "all":
+            return cls.users if item == "user" else cls.llms
+        key = period_key(period)
+        current = cls.periods.get((item, period))
+        if current is None or current[0] != key:
+            current = (key, LeaderboardIndex())
+            cls.periods[(item, period)] = current
+        return current[1]
+
+
+    @classmethod
+    def add_points(cls, item: str, id: int, points: int) -> None:
+        """Metodo per aggiornare la classifica dopo un'assegnazione di punti, le risposte non hanno classifica"""
+
+        if item in ("user", "llm"):
+            cls.index(item).add_points(id, points)
+            for period in LEADERBOARD_PERIODS:
+                cls.index(item, period).add_points(id, points)
+        if item == "user":
+            cls.changed.add(int(id))
+
+
+    @classmethod
+    def take_changed(cls) -> set[int]:
+        """Metodo per prendere e azzerare gli utenti con punti cambiati"""
+
+        changed, cls.changed = cls.changed, set()
+        return changed
+
+
+    @classmethod
+    async def rank(cls, connection: aiomysql.Connection, item: str, id: int) -> Optional[int]:
+        """Metodo per la posizione di un elemento, se manca dall'indice viene letto dal db e aggiunto.
+        Ritorna None se l'elemento non esiste"""
+
+        index = cls.index(item)
+        position = index.rank(id)
+        if position is not None:
+            return position
+        if item == "user":
+            points = await run(connection, "user.points", id, id)
+        else:
+            points = await run(connection, "llm.points", id, id)
+        if len(points) == 0:
+            return None
+        index.set_points(id, points[0][0] or 0)
+        return index.rank(id)
@@ -0,0 +1,132 @@
+import asyncio
+from typing import Iterable
+import aiomysql
+
+from utils.connection import Connection, PoolExhaustedError
+from utils.query_execute import execute_modify, execute_select
+from utils.leaderboard import Leaderboard
+from utils.catalog import Catalog
+from utils.mission_events import enqueue_events
+
+
+# Ogni quanti secondi vengono controllati gli utenti con punti cambiati
+LEADERBOARD_MISSION_INTERVAL = 5
+
+# Missioni di classifica già raggiunte: completate o con l'avanzamento già scritto e in attesa del worker degli eventi
+LEADERBOARD_REACHED_QUERY = """
+select mu.mission_id, mu.user_id
+from mission_user mu
+join mission m on m.mission_id = mu.mission_id
+where m.kind = 'leaderboard' and (mu.completed = 1 or mu.progress = m.value)
+"""
+
+
+class LeaderboardMissions:
+    """Rilevatore delle soglie di classifica (missioni "Entra nella top N", kind leaderboard): ad ogni giro controlla
+    solo gli utenti i cui punti sono cambiati (update_points, chiusura giornaliera, ranking, missioni), ne calcola la
+    posizione sulla classifica in memoria e completa a blocchi le missioni delle soglie superate"""
+
+    # Utenti che hanno già raggiunto la soglia, per mission_id: non vengono più controllati
+    reached: dict[int, set[int]] = {}
+
+    detected: int = 0
+
+
+    @classmethod
+    def thresholds(cls) -> list[tuple[int, int]]:
+        """Metodo per le missioni di classifica del catalogo come (mission_id, posizione da raggiungere)"""
+
+        return [(mission_id, mission["value"]) for mission_id, mission in Catalog.missions.items() if mission["kind"] == "leaderboard"]
+
+
+    @classmethod
+    async def load(cls, connection: aiomysql.Connection) -> None:
+        """Metodo per caricare le soglie già raggiunte, da chiamare dopo Leaderboard.load. Gli utenti già nelle prime
+        posizioni vengono controllati al primo giro, senza leggere il resto della tabella user"""
+
+        reached: dict[int, set[int]] = {}
+        for mission_id, user_id in await execute_select(connection, LEADERBOARD_REACHED_QUERY):
+            reached.setdefault(mission_id, set()).add(user_id)
+        cls.reached = reached
+        thresholds = cls.thresholds()
+        if len(thresholds) != 0:
+            Leaderboard.changed.update(user_id for _, user_id, _ in Leaderboard.users.top(max(value for _, value in thresholds)))
+
+
+    @classmethod
+    def crossings(cls, users: Iterable[int]) -> list[tuple[int, int]]:
+        """Metodo che calcola in memoria le soglie superate come (mission_id, user_id), per ogni utente entrato nelle
+        prime value posizioni che non ha ancora la missione. Ogni posizione costa un bisect sull'indice della classifica"""
+
+        thresholds = cls.thresholds()
+        result = []
+        for user_id in users:
+            rank = Leaderboard.users.rank(user_id)
+            if rank is None:
+                continue
+            for mission_id, value in thresholds:
+                if rank <= value and user_id not in cls.reached.get(mission_id, ()):
+                    result.append((mission_id, user_id))
+        return result
+
+
+    @classmethod
+    def _mark(cls, crossings: list[tuple[int, int]]) -> None:
+        for mission_id, user_id in crossings:
+            cls.reached.setdefault(mission_id, set()).add(user_id)
+        cls.detected += len(crossings)
+
+
+    @classmethod
+    async def award(cls, connection: aiomysql.Connection, crossings: list[tuple[int, int]]) -> None:
+        """Metodo per assegnare le missioni delle soglie superate con un update per tutte le coppie e un insert per gli eventi:
+        l'avanzamento viene portato al valore della missione e il worker degli eventi la completa con premi e cascata"""
+
+        if len(crossings) == 0:
+            return
+        pairs = ", ".join(["(%s, %s)"] * len(crossings))
+        users = list(dict.fromkeys(user_id for _, user_id in crossings))
+        async with Connection.transaction(connection):
+            await execute_modify(connection, f"update mission_user mu join mission m on m.mission_id = mu.mission_id set mu.progress = m.value where mu.completed = 0 and (mu.mission_id, mu.user_id) in ({pairs})",
+                                 tuple(value for crossing in crossings for value in crossing))
+            await enqueue_events(connection, [("leaderboard_reached", user_id, None) for user_id in users])
+            Connection.after_commit(connection, lambda: cls._mark(crossings))
+
+
+    @classmethod
+    async def check(cls, connection: aiomysql.Connection) -> int:
+        """Metodo per controllare gli utenti con punti cambiati, ritorna il numero di soglie superate.
+        In caso di errore gli utenti restano da controllare al giro successivo"""
+
+        users = Leaderboard.take_changed()
+        try:
+            crossings = cls.crossings(users)
+            await cls.award(connection, crossings)
+        except Exception:
+            Leaderboard.changed.update(users)
+            raise
+        return len(crossings)
+
+
+    @classmethod
+    async def run(cls) -> None:
+        """Task in background che controlla le soglie ogni LEADERBOARD_MISSION_INTERVAL secondi"""
+
+        while True:
+            await asyncio.sleep(LEADERBOARD_MISSION_INTERVAL)
+            if len(Leaderboard.changed) == 0:
+                continue
+            try:
+                async with Connection.get_connection() as connection:
+                    await cls.check(connection)
+            except (aiomysql.Error, PoolExhaustedError) as e:
+                print("Errore mariadb nel controllo delle missioni di classifica: ", e)
+            except Exception as e:
+                print("Errore nel controllo delle missioni di classifica: ", e)
+
+
+    @classmethod
+    def stats(cls) -> dict[str, int]:
+        """Metodo per leggere lo stato del rilevatore: utenti da controllare e soglie superate"""
+
+        return {"pending": len(Leaderboard.changed), "detected": cls.detected}
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import re
+import sys
+from typing import Union
+import aiomysql
+
+from utils.connection import Connection
+from utils.query_execute import QUERIES, execute_modify, execute_select
+
+
+# Cartella delle migrazioni: file NNNN_nome.sql applicati in ordine di versione, una sola volta per db
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+
+# Lock di MariaDB che impedisce a due processi del backend di applicare le migrazioni insieme
+MIGRATION_LOCK = "culturaLLM_schema_migration"
+
+# Query del registro da controllare con EXPLAIN dopo le migrazioni degli indici
+HOT_QUERIES = (
+    "user.last_question",
+    "user.last_answer",
+    "user.last_mission",
+    "question.weekly_count",
+    "question.trending",
+    "question.to_ranking",
+    "question.points_pending",
+    "answer.by_question",
+    "mission.of_user",
+    "mission_user.to_expire",
+)
+
+
+def load_migrations() -> list[tuple[int, str, list[str]]]:
+    """Metodo per leggere le migrazioni dalla cartella, come (versione, nome, statement) ordinate per versione"""
+
+    migrations = []
+    for file_name in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = re.fullmatch(r"(\d+)_(\w+)\.sql", file_name)
+        if match is None:
+            continue
+        with open(os.path.join(MIGRATIONS_DIR, file_name)) as file:
+            sql = re.sub(r"/\*.*?\*/", "", file.read(), flags = re.S)
+        statements = [statement.strip() for statement in sql.split(";") if statement.strip() != ""]
+        migrations.append((int(match.group(1)), match.group(2), statements))
+    return migrations
+
+
+async def applied_versions(connection: aiomysql.Connection) -> set[int]:
+    """Metodo per trovare le versioni già applicate, creando la tabella delle migrazioni se non esiste"""
+
+    await execute_modify(connection, "create table if not exists schema_migration(version int primary key, name varchar(255) not null, applied_at timestamp default CURRENT_TIMESTAMP)")
+    rows = await execute_select(connection, "select version from schema_migration")
+    return {row[0] for row in rows}
+
+
+async def migrate(connection: aiomysql.Connection) -> list[str]:
+    """Metodo per applicare le migrazioni mancanti senza toccare i dati esistenti, ritorna i nomi di quelle applicate.
+    Le DDL di MariaDB non sono transazionali: ogni migrazione viene registrata solo dopo tutti i suoi statement,
+    che usano if not exists, così una migrazione interrotta viene semplicemente rieseguita all'avvio successivo"""
+
+    lock = await execute_select(connection, "select get_lock(%s, 60)", (MIGRATION_LOCK,))
+    if lock[0][0] != 1:
+        raise RuntimeError("Migrazioni già in corso in un altro processo")
+    try:
+        applied = await applied_versions(connection)
+        names = []
+        for version, name, statements in load_migrations():
+            if version in applied:
+                continue
+            for statement in statements:
+                await execute_modify(connection, statement)
+            await execute_modify(connection, "insert into schema_migration (version, name) values (%s, %s)", (version, name,))
+            names.append(f"{version:04d}_{name}")
+            print(f"Migrazione {version:04d}_{name} applicata")
+        return names
+    finally:
+        await execute_select(connection, "select release_lock(%s)", (MIGRATION_LOCK,))
+
+
+async def explain(connection: aiomysql.Connection, names: tuple[str, ...] = HOT_QUERIES) -> dict[str, list[dict[str, Union[str, int, None]]]]:
+    """Metodo per ottenere il piano di esecuzione delle query del registro, con 1 come valore di ogni segnaposto.
+    Serve per verificare che le query usino gli indici (colonne key e rows) prima e dopo una migrazione"""
+
+    plans = {}
+    for name in names:
+        query = QUERIES[name]
+        parametri = (1,) * query.count("?")
+        async with connection.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute("explain " + query.replace("?", "%s"), parametri)
+            plans[name] = await cursor.fetchall()
+    return plans
+
+
+async def main(args: list[str]) -> None:
+    """Uso: python -m utils.migrations [migrate | status | explain [nome_query ...]]"""
+
+    command = args[0] if len(args) != 0 else "migrate"
+    await Connection.start_connection()
+    try:
+        async with Connection.get_connection() as connection:
+            if command == "migrate":
+                names = await migrate(connection)
+                print(f"{len(names)} migrazioni applicate")
+            elif command == "status":
+                applied = await applied_versions(connection)
+                for version, name, _ in load_migrations():
+                    print(f"{version:04d}_{name}: {'applicata' if version in applied else 'da applicare'}")
+            elif command == "explain":
+                plans = await explain(connection, tuple(args[1:]) or HOT_QUERIES)
+                for name, plan in plans.items():
+                    print(name)
+                    for row in plan:
+                        print(f"    table={row['table']} type={row['type']} key={row['key']} rows={row['rows']} extra={row['Extra']}")
+            else:
+                print(main.__doc__)
+    finally:
+        await Connection.close_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
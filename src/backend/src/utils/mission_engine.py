@@ -0,0 +1,100 @@
+import time
+from typing import Any, Optional
+import aiomysql
+
+from utils.connection import Connection
+from utils.leaderboard import Leaderboard
+from utils.query_execute import execute_modify, execute_transaction, run
+from utils.catalog import Catalog
+from utils.user_stats import complete_mission_user_stat
+
+
+class MissionState:
+    """Stato di una missione non completata di un utente, letto una volta per evento"""
+
+    def __init__(self, row: tuple) -> None:
+        self.mission_id: int = row[0]
+        self.kind: str = row[1]
+        self.value: int = row[2]
+        self.progress: int = row[3]
+        self.reward_coins: int = row[4] or 0
+        self.reward_points: int = row[5] or 0
+        self.reward_badge: Optional[int] = row[6]
+        self.reward_title: Optional[int] = row[7]
+
+        # Vero per le missioni di tipo mission che avanzano ad ogni completamento
+        self.cascade: bool = bool(row[8])
+
+        # Avanzamento aggiunto dalla cascata, da scrivere nel db
+        self.delta: int = 0
+
+
+def simulate_cascade(missions: list[MissionState]) -> list[MissionState]:
+    """Metodo che calcola in memoria le missioni completate dall'evento: ogni missione pronta (progress = value)
+    viene completata una volta e fa avanzare di 1 tutte le missioni di tipo mission ancora aperte, che a loro volta
+    possono completarsi. Ritorna le missioni completate nell'ordine di completamento e aggiorna il delta delle altre"""
+
+    completed = [mission for mission in missions if mission.progress == mission.value]
+    open_cascade = [mission for mission in missions if mission.cascade and mission not in completed]
+    steps = 0
+    while steps < len(completed):
+        steps += 1
+        for mission in open_cascade:
+            if mission in completed:
+                continue
+            mission.delta += 1
+            if mission.progress + mission.delta == mission.value:
+                completed.append(mission)
+    return completed
+
+
+async def apply_mission_event(connection: aiomysql.Connection, item: Optional[str], user_id: int, theme: int = None) -> list[int]:
+    """Metodo che applica un evento (question, answer, ranking, llm, user) alle missioni dell'utente con un numero
+    costante di statement: avanzamento, lettura dello stato, avanzamento della cascata, completamenti, premi e contatori.
+    Con item None non avanza nessuna missione, vengono solo completate quelle già pronte.
+    Ritorna gli id delle missioni completate"""
+
+    async with Connection.transaction(connection):
+        # Le missioni che avanzano con l'evento vengono dal catalogo, indicizzate per (kind, theme)
+        event_missions = Catalog.mission_ids(item, theme)
+        if len(event_missions) != 0:
+            placeholders = ", ".join(["%s"] * len(event_missions))
+            await execute_modify(connection, f"update mission_user set progress = progress + 1 where user_id = %s and completed = 0 and mission_id in ({placeholders})", (user_id,) + tuple(event_missions))
+        missions = [MissionState(row) for row in await run(connection, "mission_user.event_state", theme, theme, user_id)]
+        completed = simulate_cascade(missions)
+
+        queries: list[tuple[str, tuple[Any, ...]]] = []
+        advanced = [mission for mission in missions if mission.delta != 0]
+        if len(advanced) != 0:
+            cases = " ".join(["when %s then %s"] * len(advanced))
+            placeholders = ", ".join(["%s"] * len(advanced))
+            parametri: tuple[Any, ...] = tuple(value for mission in advanced for value in (mission.mission_id, mission.delta))
+            queries.append((f"update mission_user set progress = progress + case mission_id {cases} end where user_id = %s and mission_id in ({placeholders})",
+                            parametri + (user_id,) + tuple(mission.mission_id for mission in advanced)))
+        if len(completed) != 0:
+            placeholders = ", ".join(["%s"] * len(completed))
+            completed_at = time.strftime('%Y-%m-%d %H:%M:%S')
+            queries.append((f"update mission_user set completed = 1, completed_at = %s where user_id = %s and mission_id in ({placeholders})",
+                            (completed_at, user_id) + tuple(mission.mission_id for mission in completed)))
+            points = sum(mission.reward_points for mission in completed)
+            coins = sum(mission.reward_coins for mission in completed)
+            # I punti del premio passano dal registro come tutte le altre assegnazioni: totale, classifiche dei periodi
+            # e ricaricamento della classifica vengono tutti da points_ledger
+            queries.append(("user.add_coins", (coins, user_id)))
+            if points != 0:
+                queries.append(("points_ledger.insert", ("user", user_id, points)))
+            badges = list(dict.fromkeys(mission.reward_badge for mission in completed if mission.reward_badge is not None))
+            if len(badges) != 0:
+                queries.append(("insert ignore into badge_user (badge_id, user_id) values " + ", ".join(["(%s, %s)"] * len(badges)),
+                                tuple(value for badge in badges for value in (badge, user_id))))
+            titles = list(dict.fromkeys(mission.reward_title for mission in completed if mission.reward_title is not None))
+            if len(titles) != 0:
+                queries.append(("insert ignore into title_user (title_id, user_id) values " + ", ".join(["(%s, %s)"] * len(titles)),
+                                tuple(value for title in titles for value in (title, user_id))))
+            badge_missions = len([mission for mission in completed if mission.reward_badge is not None])
+            queries.append(complete_mission_user_stat(user_id, badge_missions, points, len(completed)))
+            Connection.after_commit(connection, lambda: Leaderboard.add_points("user", user_id, points))
+        if len(queries) != 0:
+            await execute_transaction(connection, queries)
+
+    return [mission.mission_id for mission in completed]
@@ -0,0 +1,147 @@
+import asyncio
+from typing import Optional
+import aiomysql
+
+from utils.connection import Connection, PoolExhaustedError
+from utils.mission_engine import apply_mission_event
+from utils.query_execute import execute_modify, run
+
+
+# Eventi di dominio e tipo (kind) delle missioni che fanno avanzare. leaderboard_reached non fa avanzare nulla:
+# l'avanzamento è già scritto da utils/leaderboard_missions.py, l'evento completa le missioni pronte con premi e cascata
+MISSION_EVENTS: dict[str, Optional[str]] = {
+    "question_created": "question",
+    "llm_question_created": "llm",
+    "answer_created": "answer",
+    "ranking_submitted": "ranking",
+    "profile_completed": "user",
+    "leaderboard_reached": None,
+}
+
+# Utenti elaborati ad ogni giro del worker, ed eventi massimi per utente in un'unica transazione
+MISSION_EVENT_USERS = 50
+MISSION_EVENT_BATCH = 100
+
+# Ogni quanti secondi il worker controlla la coda anche senza notifiche (es. eventi rimasti da prima di un riavvio)
+MISSION_EVENT_POLL = 5
+
+# Giorni dopo cui gli eventi già elaborati vengono cancellati
+MISSION_EVENT_RETENTION = 7
+
+
+async def enqueue_event(connection: aiomysql.Connection, event: str, user_id: int, theme: Optional[int] = None) -> None:
+    """Metodo per accodare un evento di dominio: va chiamato nella stessa transazione della scrittura che lo genera,
+    così l'evento esiste se e solo se la scrittura è confermata. Il worker viene svegliato dopo il commit"""
+
+    if event not in MISSION_EVENTS:
+        raise ValueError(f"Evento non esistente: {event}")
+    await run(connection, "mission_event.insert", user_id, event, theme)
+    Connection.after_commit(connection, MissionEventWorker.notify)
+
+
+async def enqueue_events(connection: aiomysql.Connection, events: list[tuple[str, int, Optional[int]]]) -> None:
+    """Metodo per accodare più eventi (evento, user_id, tema) con un solo insert multi-riga, come enqueue_event"""
+
+    if len(events) == 0:
+        return
+    for event, _, _ in events:
+        if event not in MISSION_EVENTS:
+            raise ValueError(f"Evento non esistente: {event}")
+    values = ", ".join(["(%s, %s, %s)"] * len(events))
+    await execute_modify(connection, f"insert into mission_event (user_id, event, theme) values {values}",
+                         tuple(value for event, user_id, theme in events for value in (user_id, event, theme)))
+    Connection.after_commit(connection, MissionEventWorker.notify)
+
+
+class MissionEventWorker:
+    """Task in background che consuma la coda mission_event: gli eventi di ogni utente vengono applicati
+    in ordine alle missioni e marcati come elaborati in un'unica transazione"""
+
+    processed: int = 0
+    failed: int = 0
+
+    # Eventi non ancora elaborati e ritardo in secondi del più vecchio, aggiornati ad ogni giro
+    pending: int = 0
+    lag: float = 0.0
+
+    _wake: asyncio.Event = None
+
+
+    @classmethod
+    def notify(cls) -> None:
+        """Metodo per svegliare il worker dopo che un evento è stato confermato"""
+
+        if cls._wake is None:
+            cls._wake = asyncio.Event()
+        cls._wake.set()
+
+
+    @classmethod
+    async def process_user(cls, connection: aiomysql.Connection, user_id: int) -> int:
+        """Metodo per applicare gli eventi in attesa di un utente, ritorna il numero di eventi elaborati.
+        Con skip locked due worker non elaborano mai gli stessi eventi"""
+
+        async with Connection.transaction(connection):
+            events = await run(connection, "mission_event.claim", user_id, MISSION_EVENT_BATCH)
+            for _, event, theme in events:
+                await apply_mission_event(connection, MISSION_EVENTS[event], user_id, theme)
+            if len(events) != 0:
+                placeholders = ", ".join(["%s"] * len(events))
+                await execute_modify(connection, f"update mission_event set processed_at = now(3) where event_id in ({placeholders})", tuple(event[0] for event in events))
+        return len(events)
+
+
+    @classmethod
+    async def process(cls, connection: aiomysql.Connection) -> int:
+        """Metodo per fare un giro sulla coda: un errore su un utente lascia i suoi eventi in coda per il giro successivo
+        e viene contato in failed, senza fermare gli altri utenti"""
+
+        total = 0
+        for (user_id,) in await run(connection, "mission_event.pending_users", MISSION_EVENT_USERS):
+            try:
+                total += await cls.process_user(connection, user_id)
+            except Exception as e:
+                # Qualsiasi errore (db, catalogo, ...) lascia in coda solo gli eventi di questo utente
+                cls.failed += 1
+                print(f"Errore negli eventi missione dell'utente {user_id}: ", e)
+        cls.processed += total
+        lag = await run(connection, "mission_event.lag")
+        cls.pending = int(lag[0][0])
+        cls.lag = float(lag[0][1] or 0)
+        return total
+
+
+    @classmethod
+    async def run(cls) -> None:
+        """Task in background che elabora la coda dopo ogni notifica o almeno ogni MISSION_EVENT_POLL secondi"""
+
+        if cls._wake is None:
+            cls._wake = asyncio.Event()
+        while True:
+            cls._wake.clear()
+            try:
+                async with Connection.get_connection() as connection:
+                    # Finché un giro elabora eventi la coda non è vuota, si riparte senza aspettare
+                    while await cls.process(connection) != 0:
+                        pass
+            except (aiomysql.Error, PoolExhaustedError) as e:
+                print("Errore mariadb nel worker degli eventi missione: ", e)
+            except Exception as e:
+                print("Errore nel worker degli eventi missione: ", e)
+            try:
+                await asyncio.wait_for(cls._wake.wait(), timeout = MISSION_EVENT_POLL)
+            except asyncio.TimeoutError:
+                pass
+
+
+    @classmethod
+    def stats(cls) -> dict[str, float]:
+        """Metodo per leggere lo stato della coda: eventi in attesa, ritardo del più vecchio, elaborati e utenti falliti"""
+
+        return {"pending": cls.pending, "lag_seconds": cls.lag, "processed": cls.processed, "failed": cls.failed}
+
+
+async def purge_events(connection: aiomysql.Connection) -> None:
+    """Metodo per cancellare gli eventi elaborati da più di MISSION_EVENT_RETENTION giorni"""
+
+    await run(connection, "mission_event.purge", MISSION_EVENT_RETENTION)
@@ -0,0 +1,117 @@
+import asyncio
+from typing import Union
+import aiomysql
+
+from utils.connection import Connection, PoolExhaustedError
+from utils.query_execute import execute_modify, run
+from utils.leaderboard import Leaderboard, LEADERBOARD_PERIODS, period_key
+
+
+# Elementi che possono ricevere punti e query che ne aggiorna il totale
+POINTS_ITEMS: dict[str, str] = {
+    "user": "user.add_points",
+    "answer": "answer.add_points",
+    "llm": "llm.add_points",
+}
+
+# Righe del registro sommate ai totali in un'unica transazione
+POINTS_FOLD_BATCH = 1000
+
+# Ogni quanti secondi l'aggregatore riporta i punti nei totali
+POINTS_FOLD_INTERVAL = 2
+
+
+async def record_points(connection: aiomysql.Connection, item: str, points: int, id: int) -> None:
+    """Metodo per registrare un'assegnazione di punti: un insert nel registro, senza toccare la riga del destinatario"""
+
+    if item not in POINTS_ITEMS:
+        raise ValueError(f"Elemento non esistente: {item}")
+    await run(connection, "points_ledger.insert", item, id, points)
+
+
+async def record_points_bulk(connection: aiomysql.Connection, awards: list[tuple[str, int, int]]) -> None:
+    """Metodo per registrare più assegnazioni (item, id, punti) con un solo insert multi-riga.
+    Le classifiche in memoria vengono aggiornate dopo il commit"""
+
+    if len(awards) == 0:
+        return
+    for item, _, _ in awards:
+        if item not in POINTS_ITEMS:
+            raise ValueError(f"Elemento non esistente: {item}")
+    values = ", ".join(["(%s, %s, %s)"] * len(awards))
+    await execute_modify(connection, f"insert into points_ledger (item, target_id, points) values {values}", tuple(value for award in awards for value in award))
+    for item, id, points in awards:
+        Connection.after_commit(connection, lambda item = item, id = id, points = points: Leaderboard.add_points(item, id, points))
+
+
+async def pending_points(connection: aiomysql.Connection, item: str, id: int) -> int:
+    """Metodo per i punti assegnati ad un elemento e non ancora sommati al suo totale"""
+
+    pending = await run(connection, "points_ledger.pending", item, id)
+    return int(pending[0][0])
+
+
+class PointsAggregator:
+    """Task in background che somma le righe non ancora riportate del registro ai totali di user, answer e llm:
+    un solo update per destinatario per blocco, invece di uno per assegnazione"""
+
+    folded: int = 0
+
+    # Righe in attesa e ritardo in secondi della più vecchia, aggiornati ad ogni giro
+    pending: int = 0
+    lag: float = 0.0
+
+
+    @classmethod
+    async def fold(cls, connection: aiomysql.Connection) -> int:
+        """Metodo per riportare un blocco di righe nei totali e nei periodi (settimana e stagione della riga) di user e llm,
+        ritorna il numero di righe sommate. Totali, periodi e marcatura delle righe sono nella stessa transazione,
+        una riga non viene mai sommata due volte"""
+
+        async with Connection.transaction(connection):
+            rows = await run(connection, "points_ledger.claim", POINTS_FOLD_BATCH)
+            totals: dict[tuple[str, int], int] = {}
+            buckets: dict[tuple[str, str, int], int] = {}
+            for _, item, target_id, points, created_at in rows:
+                totals[(item, target_id)] = totals.get((item, target_id), 0) + points
+                if item != "answer":
+                    for period in LEADERBOARD_PERIODS:
+                        key = (item, period_key(period, created_at), target_id)
+                        buckets[key] = buckets.get(key, 0) + points
+            for (item, target_id), points in totals.items():
+                await run(connection, POINTS_ITEMS[item], points, target_id)
+            if len(buckets) != 0:
+                values = ", ".join(["(%s, %s, %s, %s)"] * len(buckets))
+                await execute_modify(connection, f"insert into points_period (item, period, target_id, points) values {values} on duplicate key update points = points + values(points)",
+                                     tuple(value for (item, period, target_id), points in buckets.items() for value in (item, period, target_id, points)))
+            if len(rows) != 0:
+                placeholders = ", ".join(["%s"] * len(rows))
+                await execute_modify(connection, f"update points_ledger set folded_at = now(3) where ledger_id in ({placeholders})", tuple(row[0] for row in rows))
+        cls.folded += len(rows)
+        return len(rows)
+
+
+    @classmethod
+    async def run(cls) -> None:
+        """Task in background che svuota il registro ogni POINTS_FOLD_INTERVAL secondi"""
+
+        while True:
+            try:
+                async with Connection.get_connection() as connection:
+                    while await cls.fold(connection) == POINTS_FOLD_BATCH:
+                        pass
+                    lag = await run(connection, "points_ledger.lag")
+                    cls.pending = int(lag[0][0])
+                    cls.lag = float(lag[0][1] or 0)
+            except (aiomysql.Error, PoolExhaustedError) as e:
+                print("Errore mariadb nell'aggregazione dei punti: ", e)
+            except Exception as e:
+                print("Errore nell'aggregazione dei punti: ", e)
+            await asyncio.sleep(POINTS_FOLD_INTERVAL)
+
+
+    @classmethod
+    def stats(cls) -> dict[str, Union[int, float]]:
+        """Metodo per leggere lo stato dell'aggregatore: righe in attesa, ritardo della più vecchia e righe sommate"""
+
+        return {"pending": cls.pending, "lag_seconds": cls.lag, "folded": cls.folded}
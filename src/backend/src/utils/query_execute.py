@@ -1,18 +1,253 @@
-from typing import Union
+import contextvars
+import os
+import re
+import time
+import weakref
+from typing import Any, AsyncIterator, Optional, Union
 import aiomysql
 
+from utils.connection import Connection
+
 
 # Variabile parametri serve per garantire sicurezza da SQL Injection
 
 
+# Registro delle query con nome: solo segnaposto ?, nessuna stringa costruita a runtime.
+# Ogni query viene preparata lato server una volta per connessione e poi rieseguita con EXECUTE ... USING
+QUERIES: dict[str, str] = {
+    # user
+    "user.by_id": "select * from user where user_id = ?",
+    "user.id_by_login": "select user_id from user where email = ? or username = ?",
+    "user.id_by_username": "select user_id from user where username = ?",
+    "user.username": "select username from user where user_id = ?",
+    "user.name": "select name from user where user_id = ?",
+    "user.points": "select cast(user_points + (select ifnull(sum(p.points), 0) from points_ledger p where p.item = 'user' and p.target_id = ? and p.folded_at is null) as signed) from user where user_id = ?",
+    "user.add_points": "update user set user_points = user_points + ? where user_id = ?",
+    "user.add_coins": "update user set user_coins = user_coins + ? where user_id = ?",
+    "user.set_last_login": "update user set last_login_at = ? where user_id = ?",
+    "user.setting_info": "select phone_number, email_notification from user where user_id = ?",
+    "user.toggle_email_notification": "update user set email_notification = 1 - email_notification where user_id = ?",
+    "user.reset_avatar": "update user set current_avatar_id = 1 where user_id = ?",
+    "user.delete": "delete from user where user_id = ?",
+    "user.badges": "select b.badge_id, b.title, b.description, b.tier, b.path from badge b join badge_user bu on b.badge_id = bu.badge_id where bu.user_id = ?",
+    "user.titles": "select t.title_id, t.name from title t join title_user tu on t.title_id = tu.title_id where tu.user_id = ?",
+    "user.avatars": "select a.avatar_id, a.path from avatar a join avatar_user au on a.avatar_id = au.avatar_id where au.user_id = ? and is_avatar = 1",
+    "user.last_question": "select question_text, created_at from question where created_by_user_id = ? order by created_at desc limit 1",
+    "user.last_answer": "select answer_text, answered_at from answer where user_id = ? order by answered_at desc limit 1",
+    "user.last_mission": "select description, completed_at from mission m join mission_user mu on m.mission_id = mu.mission_id where mu.user_id = ? and completed = 1 order by completed_at desc limit 1",
+
+    # user_stats, nello stesso ordine di USER_STATS_COLUMNS
+    "user_stats.by_user": "select question_number, answer_number, ranking_number, mission_number, active_missions, badge_missions, mission_points from user_stats where user_id = ?",
+
+    # avatar, title, badge
+    "avatar.path": "select path from avatar where avatar_id = ?",
+    "avatar.count_by_path": "select count(*) from avatar where path = ?",
+    "avatar.insert": "insert into avatar(path) values (?)",
+    "avatar.delete_by_path": "delete from avatar where path = ?",
+    "title_user.insert": "insert into title_user (title_id, user_id) values (?, ?)",
+    "badge_user.insert": "insert into badge_user (badge_id, user_id) values (?, ?)",
+
+    # llm
+    "llm.points": "select cast(llm_points + (select ifnull(sum(p.points), 0) from points_ledger p where p.item = 'llm' and p.target_id = ? and p.folded_at is null) as signed) from llm where llm_id = ?",
+    "llm.add_points": "update llm set llm_points = llm_points + ? where llm_id = ?",
+
+    # theme
+    "theme.by_id": "select name, of_the_week, theme_text, theme_subtext from theme where theme_id = ?",
+    "theme.question_count": "select count(*) from question_theme where theme_id = ?",
+    "theme.first_of_question": "select name from theme t, question_theme qt where t.theme_id = qt.theme_id and qt.question_id = ?",
+
+    # question
+    "question.text": "select question_text from question where question_id = ?",
+    "question.theme": "select theme_id from question_theme where question_id = ?",
+    "question.weekly_count": "select count(*) from question where created_at >= now() - interval 7 day",
+    "question.trending": "select question_id, question_text, upvotes, question_tags, answer_count as answers from question where created_at >= now() - interval 7 day order by upvotes desc, answers desc limit 5",
+    "question.to_ranking": "update question set status = 'ranking' where status = 'open' and created_at <= ? - interval 7 day and answer_count > ((select 5 + count(*)/2 from user))",
+    "question.to_close": "update question set status = 'close' where status = 'ranking' and created_at <= ? - interval 14 day and (select count(*) from user_ranked_question a where a.question_id = question.question_id) > ((select count(*)/2 from user))",
+    "question.points_pending": "select question_id, created_by_user_id, created_by_llm_id, answer_count from question where status = 'close' and points_assigned = 0",
+    "question.set_points_assigned": "update question set points_assigned = 1 where question_id = ?",
+
+    # answer
+    "answer.by_question": "select a.llm_id, a.user_id, cast(a.points + (select ifnull(sum(p.points), 0) from points_ledger p where p.item = 'answer' and p.target_id = a.answer_id and p.folded_at is null) as signed) from answer a where a.question_id = ?",
+    "question.add_answer": "update question set answer_count = answer_count + 1 where question_id = ?",
+    "answer.add_points": "update answer set points = points + ? where answer_id = ?",
+
+    # voti, report e ranking dell'utente su una domanda
+    "report.count": "select count(*) from report where question_id = ? and user_id = ?",
+
+    # mission
+    "mission.count": "select count(*) from mission",
+    "mission.of_user": "select type, kind, theme, description, reward_coins, reward_points, value, progress, completed, expired, started_at, reward_badge from mission m, mission_user mu where m.mission_id = mu.mission_id and mu.user_id = ? order by expired asc, completed asc, progress desc, value asc, reward_points desc, reward_coins desc",
+    "mission_user.assign_all": "insert into mission_user (user_id, mission_id) select ?, mission_id from mission",
+    "points_ledger.insert": "insert into points_ledger (item, target_id, points) values (?, ?, ?)",
+    "points_ledger.pending": "select cast(ifnull(sum(points), 0) as signed) from points_ledger where item = ? and target_id = ? and folded_at is null",
+    "points_ledger.claim": "select ledger_id, item, target_id, points, created_at from points_ledger where folded_at is null order by ledger_id limit ? for update skip locked",
+    "points_ledger.lag": "select count(*), timestampdiff(microsecond, min(created_at), now(3)) / 1000000 from points_ledger where folded_at is null",
+    "ranking.insert": "insert into user_ranked_question (user_id, question_id) values (?, ?)",
+    "question.add_ranking": "update question set rankings_times = rankings_times + 1 where question_id = ?",
+    "mission_event.insert": "insert into mission_event (user_id, event, theme) values (?, ?, ?)",
+    "mission_event.pending_users": "select user_id from mission_event where processed_at is null group by user_id order by min(event_id) limit ?",
+    "mission_event.claim": "select event_id, event, theme from mission_event where user_id = ? and processed_at is null order by event_id limit ? for update skip locked",
+    "mission_event.lag": "select count(*), timestampdiff(microsecond, min(created_at), now(3)) / 1000000 from mission_event where processed_at is null",
+    "mission_event.purge": "delete from mission_event where processed_at < now() - interval ? day",
+    "mission_user.event_state": "select m.mission_id, m.kind, m.value, mu.progress, m.reward_coins, m.reward_points, m.reward_badge, m.reward_title, m.kind = 'mission' and (m.theme is null or ? is null or m.theme = ?) from mission m join mission_user mu on mu.mission_id = m.mission_id where mu.user_id = ? and mu.completed = 0 and (mu.progress = m.value or m.kind = 'mission') order by m.mission_id for update",
+    "mission_user.complete": "update mission_user set completed = 1, completed_at = ? where mission_id = ? and user_id = ?",
+    "mission_user.to_expire": "select mu.mission_id, m.type, mu.user_id from mission m, mission_user mu where m.mission_id = mu.mission_id and expired = 0 and (type = 'daily' or type = 'weekly')",
+    "mission_user.expire": "update mission_user set expired = 1 where mission_id = ? and user_id = ? and timestampdiff(second, started_at, ?) >= ?",
+    "mission_user.to_reset": "select mission_id, user_id from mission_user where expired = 1 and completed = 0",
+    "mission_user.reset": "update mission_user set progress = 0, expired = 0, started_at = ? where mission_id = ? and user_id = ?",
+}
+
+
+# Statement già preparati per ogni connessione: se la connessione viene chiusa il suo insieme sparisce con lei
+_prepared: "weakref.WeakKeyDictionary[aiomysql.Connection, set[str]]" = weakref.WeakKeyDictionary()
+
+# Per ogni fingerprint: esecuzioni, tempo totale in secondi, righe totali e istogramma delle durate
+query_stats: dict[str, dict[str, Any]] = {}
+
+# Limiti superiori in secondi degli intervalli dell'istogramma delle durate delle query
+QUERY_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, float("inf"))
+
+# Una richiesta con più query di QUERY_COUNT_LIMIT, o che ripete la stessa query più di QUERY_REPEAT_LIMIT volte, viene segnalata
+QUERY_COUNT_LIMIT = int(os.environ.get("QUERY_COUNT_LIMIT", 30))
+QUERY_REPEAT_LIMIT = int(os.environ.get("QUERY_REPEAT_LIMIT", 5))
+
+# Righe lette dal server per ogni blocco delle select in streaming
+STREAM_CHUNK_SIZE = 500
+
+# Numero di richieste segnalate per troppe query o per query ripetute (probabile N+1)
+flagged_requests: int = 0
+
+# Query eseguite dalla richiesta corrente come (fingerprint, durata, righe), None fuori da una richiesta
+_query_log: contextvars.ContextVar[Optional[list[tuple[str, float, int]]]] = contextvars.ContextVar("query_log", default=None)
+
+# Errore MariaDB per uno statement non più presente sul server (es. dopo una riconnessione)
+ER_UNKNOWN_STMT_HANDLER = 1243
+
+# Errore MariaDB per una chiave primaria o unique duplicata
+ER_DUP_ENTRY = 1062
+
+
+def fingerprint(query: str) -> str:
+    """Metodo per ridurre una query SQL alla sua forma: valori letterali e segnaposto diventano ?, spazi e maiuscole normalizzati"""
+
+    query = re.sub(r"'(?:[^'\\]|\\.|'')*'", "?", query)
+    query = re.sub(r"%s|\b\d+\b", "?", query)
+    query = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?)", query)
+    return " ".join(query.lower().split())
+
+
+def _record(key: str, start: float, rows: int) -> None:
+    """Registra una query eseguita nelle statistiche aggregate e nel registro della richiesta corrente"""
+
+    duration = time.perf_counter() - start
+    stats = query_stats.setdefault(key, {"count": 0, "time": 0.0, "rows": 0, "histogram": [0] * len(QUERY_LATENCY_BUCKETS)})
+    stats["count"] += 1
+    stats["time"] += duration
+    stats["rows"] += rows
+    for i, bound in enumerate(QUERY_LATENCY_BUCKETS):
+        if duration <= bound:
+            stats["histogram"][i] += 1
+            break
+    log = _query_log.get()
+    if log is not None:
+        log.append((key, duration, rows))
+
+
+def begin_query_log() -> None:
+    """Metodo da chiamare all'inizio di una richiesta: da qui le query eseguite vengono registrate per la richiesta"""
+
+    _query_log.set([])
+
+
+def end_query_log(label: str) -> dict[str, Any]:
+    """Metodo da chiamare alla fine di una richiesta: riassume le query eseguite e segnala la richiesta
+    se supera QUERY_COUNT_LIMIT o ripete la stessa fingerprint più di QUERY_REPEAT_LIMIT volte"""
+
+    global flagged_requests
+    log = _query_log.get() or []
+    _query_log.set(None)
+    counts: dict[str, int] = {}
+    for query, _, _ in log:
+        counts[query] = counts.get(query, 0) + 1
+    repeated = {query: count for query, count in counts.items() if count > QUERY_REPEAT_LIMIT}
+    summary = {"queries": len(log), "time": sum(duration for _, duration, _ in log), "rows": sum(rows for _, _, rows in log), "repeated": repeated}
+    if len(log) > QUERY_COUNT_LIMIT or len(repeated) != 0:
+        flagged_requests += 1
+        print(f"Richiesta {label}: {len(log)} query in {summary['time']:.3f}s, ripetute: {repeated}")
+    return summary
+
+
+def metrics() -> dict[str, Any]:
+    """Metodo per leggere le statistiche aggregate per fingerprint, con l'istogramma delle durate indicizzato per limite superiore"""
+
+    return {
+        "flagged_requests": flagged_requests,
+        "queries": {
+            query: {
+                "count": stats["count"],
+                "time": stats["time"],
+                "rows": stats["rows"],
+                "histogram": {str(bound): count for bound, count in zip(QUERY_LATENCY_BUCKETS, stats["histogram"])},
+            }
+            for query, stats in query_stats.items()
+        },
+    }
+
+
+def _statement_name(name: str) -> str:
+    return "q_" + name.replace(".", "_")
+
+
+async def _prepare(cursor: aiomysql.Cursor, connection: aiomysql.Connection, name: str) -> None:
+    await cursor.execute(f"prepare {_statement_name(name)} from %s", (QUERIES[name],))
+    _prepared.setdefault(connection, set()).add(name)
+
+
+async def _execute_named(cursor: aiomysql.Cursor, connection: aiomysql.Connection, name: str, parametri: tuple[Any, ...]) -> None:
+    """Esegue sul cursore la query registrata con nome name, preparandola se la connessione non la conosce ancora"""
+
+    if name not in QUERIES:
+        raise KeyError(f"Query non registrata: {name}")
+    if name not in _prepared.get(connection, ()):
+        await _prepare(cursor, connection, name)
+    execute = f"execute {_statement_name(name)}" + (" using " + ", ".join(["%s"] * len(parametri))) * (len(parametri) != 0)
+    try:
+        await cursor.execute(execute, parametri)
+    except aiomysql.Error as e:
+        if e.args[0] != ER_UNKNOWN_STMT_HANDLER:
+            raise
+        await _prepare(cursor, connection, name)
+        await cursor.execute(execute, parametri)
+
+
+async def run(connection: aiomysql.Connection, name: str, *parametri: Any) -> list[tuple]:
+    """Esegue la query registrata con nome name (es. run(connection, "user.points", user_id, user_id)) e restituisce le righe.
+    Le scritture sono confermate dall'autocommit, o dalla transazione aperta sulla connessione"""
+
+    start = time.perf_counter()
+    if not QUERIES[name].lstrip().lower().startswith("select"):
+        Connection.mark_write()
+    try:
+        async with connection.cursor() as cursor:
+            await _execute_named(cursor, connection, name, parametri)
+            results = await cursor.fetchall()
+            _record(name, start, len(results) if results else cursor.rowcount)
+            return results
+    except aiomysql.Error as e:
+        print(f"Errore durante l'esecuzione della query {name}: {e}")
+        raise e
+
+
 async def execute_select(connection: aiomysql.Connection, query: str, parametri: tuple[Union[str,int], ...] = ()) -> list[tuple[str]]:
     """Esegue la query di tipo select sulla connessione e restituisce il risultato."""
 
 
+    start = time.perf_counter()
     try:
         async with connection.cursor() as cursor:
             await cursor.execute(query, parametri)
             results = await cursor.fetchall()
+            _record(fingerprint(query), start, len(results))
             return results
     except aiomysql.Error as e:
         print(f"Errore durante l'esecuzione della query SELECT: {e}")
@@ -20,15 +255,79 @@ async def execute_select(connection: aiomysql.Connection, query: str, parametri:
         
 
 
-async def execute_modify(connection: aiomysql.Connection, query: str, parametri: tuple[Union[str,int], ...] = ()) -> None:
-    """Esegue la query di tipo insert, delete o update sulla connessione."""
+async def execute_stream(connection: aiomysql.Connection, query: str, parametri: tuple[Union[str,int], ...] = (), chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[list[tuple]]:
+    """Esegue la query di tipo select con un cursore lato server e restituisce le righe a blocchi di chunk_size,
+    senza caricare tutto il risultato in memoria. Finché lo stream non è esaurito la connessione è occupata:
+    le scritture fatte durante la scansione vanno eseguite su un'altra connessione"""
 
+    start = time.perf_counter()
+    rows = 0
+    try:
+        async with connection.cursor(aiomysql.SSCursor) as cursor:
+            if query in QUERIES:
+                await _execute_named(cursor, connection, query, parametri)
+            else:
+                await cursor.execute(query, parametri)
+            while True:
+                chunk = await cursor.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                rows += len(chunk)
+                yield list(chunk)
+    except aiomysql.Error as e:
+        print(f"Errore durante la lettura in streaming: {e}")
+        raise e
+    finally:
+        _record(query if query in QUERIES else fingerprint(query), start, rows)
+
+
+async def execute_modify(connection: aiomysql.Connection, query: str, parametri: tuple[Union[str,int], ...] = ()) -> int:
+    """Esegue la query di tipo insert, delete o update sulla connessione e ritorna il numero di righe modificate.
+    Fuori da una transazione viene confermata dall'autocommit, dentro Connection.transaction() dal commit finale."""
+
+    Connection.mark_write()
+    start = time.perf_counter()
+    try:
+        async with connection.cursor() as cursor:
+            await cursor.execute(query, parametri)
+            _record(fingerprint(query), start, cursor.rowcount)
+            return cursor.rowcount
+    except aiomysql.Error as e:
+        print(f"Errore durante l'inserimento: {e}")
+        raise e
+
+
+async def execute_insert(connection: aiomysql.Connection, query: str, parametri: tuple[Union[str,int], ...] = ()) -> int:
+    """Esegue la query di tipo insert sulla connessione come execute_modify e ritorna l'id della riga appena inserita."""
+
+    Connection.mark_write()
+    start = time.perf_counter()
     try:
         async with connection.cursor() as cursor:
             await cursor.execute(query, parametri)
-            await connection.commit()
+            _record(fingerprint(query), start, cursor.rowcount)
+            return cursor.lastrowid
     except aiomysql.Error as e:
-        await connection.rollback()
         print(f"Errore durante l'inserimento: {e}")
         raise e
 
+
+
+async def execute_transaction(connection: aiomysql.Connection, queries: list[tuple[str, tuple[Union[str,int], ...]]]) -> None:
+    """Esegue più query di tipo insert, delete o update in un'unica transazione: o vanno tutte a buon fine o nessuna.
+    Ogni query può essere SQL con segnaposto %s oppure il nome di una query del registro QUERIES."""
+
+    try:
+        async with Connection.transaction(connection):
+            async with connection.cursor() as cursor:
+                for query, parametri in queries:
+                    start = time.perf_counter()
+                    if query in QUERIES:
+                        await _execute_named(cursor, connection, query, parametri)
+                        _record(query, start, cursor.rowcount)
+                    else:
+                        await cursor.execute(query, parametri)
+                        _record(fingerprint(query), start, cursor.rowcount)
+    except aiomysql.Error as e:
+        print(f"Errore durante la transazione: {e}")
+        raise e
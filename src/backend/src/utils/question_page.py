@@ -0,0 +1,295 @@
+import base64
+import datetime
+from typing import Any, Optional, Union
+import aiomysql
+
+from utils.query_execute import execute_select
+from utils.get_info import get_hours
+from utils.answer_loader import load_answers, format_answers, format_ranking, rank_answers
+from utils.wire_format import to_table
+from utils.catalog import Catalog
+from utils.votes import VoteCounter
+
+
+# Domande restituite per pagina da get_questions se il chiamante non indica un limite
+QUESTION_PAGE_LIMIT = 20
+
+# Domande della pagina con il creatore (il nome dell'llm viene dal catalogo), ordinate per (created_at, question_id) dalla più recente.
+# where e limit vengono composti solo con segnaposto %s, i valori passano sempre come parametri
+QUESTION_PAGE_QUERY = """
+select q.question_id, q.question_tags, q.question_text, q.status, q.rankings_times, q.created_at,
+       q.upvotes, q.downvotes, q.created_by_user_id, q.created_by_llm_id,
+       u.username, av.path
+from question q
+left join user u on u.user_id = q.created_by_user_id
+left join avatar av on av.avatar_id = u.current_avatar_id
+{where}
+order by q.created_at desc, q.question_id desc
+{limit}
+"""
+
+# Conteggi, flag dell'utente di sessione e tema mostrato (il primo della domanda), calcolati solo per le domande della pagina
+QUESTION_PAGE_FLAGS_QUERY = """
+select q.question_id,
+       q.answer_count,
+       (select count(*) from user_question_upvote uv where uv.question_id = q.question_id and uv.user_id = %s),
+       (select count(*) from user_question_downvote dv where dv.question_id = q.question_id and dv.user_id = %s),
+       (select count(*) from report r where r.question_id = q.question_id and r.user_id = %s),
+       (select count(*) from answer a where a.question_id = q.question_id and a.user_id = %s),
+       (select count(*) from user_ranked_question ur where ur.question_id = q.question_id and ur.user_id = %s),
+       (select min(qt.theme_id) from question_theme qt where qt.question_id = q.question_id)
+from question q
+where q.question_id in ({placeholders})
+"""
+
+QUESTION_STATUSES = ("open", "ranking", "close")
+
+CREATOR_TYPES = ("user", "llm")
+
+# Campi delle tabelle del formato v2, nell'ordine in cui compaiono nelle righe
+QUESTION_FIELDS = ("question_id", "question_tags", "question_text", "status", "ranking_times", "ranked", "ranking",
+                   "created_at", "hours", "hours_type", "theme", "creator_type", "creator", "user_avatar",
+                   "user_upvote", "user_downvote", "upvotes", "downvotes", "number_answer", "report", "answered", "answers")
+
+ANSWER_FIELDS = ("answer_id", "answer_text", "creator_type", "creator", "points", "answered_at")
+
+RANKING_FIELDS = ("answer_text", "points", "creator")
+
+
+def parse_tags(tags: str) -> list[str]:
+    """Metodo per trasformare la stringa dei tag salvata nel db in una lista di tag"""
+
+    tags = tags.split("[")[1].split("]")[0]
+    tags = tags.replace("'", "")
+    tags = tags.replace(" ", "")
+    tags = tags.split(",")
+
+    for j in range(0,3):
+        tag = tags.pop(0)
+        tag = tag.capitalize()
+        tags.append(tag)
+    return tags
+
+
+def encode_cursor(created_at: datetime.datetime, question_id: int) -> str:
+    """Metodo per creare il cursore opaco della prossima pagina a partire dall'ultima domanda restituita"""
+
+    raw = f"{created_at.strftime('%Y-%m-%d %H:%M:%S')}|{question_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    """Metodo per leggere il cursore, solleva ValueError se è stato manomesso"""
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, question_id = raw.split("|")
+        time_struct = datetime.datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S")
+        return time_struct.strftime("%Y-%m-%d %H:%M:%S"), int(question_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Cursore non valido: {cursor}") from e
+
+
+class QuestionPageEngine:
+    """Costruisce i dati della pagina delle domande con un numero fisso di query, qualunque sia il numero di domande"""
+
+    def __init__(self, connection: aiomysql.Connection, user_id: int) -> None:
+        self.connection = connection
+        self.user_id = int(user_id)
+
+        # Numero di query eseguite dall'engine, utile per i test di regressione
+        self.query_count = 0
+
+        # Cursore della pagina successiva, None se non ci sono altre domande
+        self.next_cursor: Optional[str] = None
+
+
+    async def _select(self, query: str, parametri: tuple[Union[str, int], ...] = ()) -> list[tuple]:
+        self.query_count += 1
+        return await execute_select(self.connection, query, parametri)
+
+
+    async def _load_flags(self, question_ids: list[int]) -> dict[int, tuple]:
+        """Metodo per caricare con una sola query conteggi, flag utente e tema delle domande richieste"""
+
+        if len(question_ids) == 0:
+            return {}
+        placeholders = ", ".join(["%s"] * len(question_ids))
+        rows = await self._select(QUESTION_PAGE_FLAGS_QUERY.format(placeholders = placeholders), (self.user_id,) * 5 + tuple(question_ids))
+        return {row[0]: row for row in rows}
+
+
+    async def _load_answers(self, question_ids: list[int]) -> dict[int, list[dict[str, Any]]]:
+        """Metodo per caricare con una sola query le risposte di tutte le domande richieste"""
+
+        if len(question_ids) != 0:
+            self.query_count += 1
+        return await load_answers(self.connection, question_ids)
+
+
+    async def build_records(self, limit: Optional[int] = None, cursor: Optional[str] = None, status: Optional[str] = None, theme: Optional[int] = None, creator_type: Optional[str] = None, question_id: Optional[int] = None) -> list[dict[str, Any]]:
+        """Metodo per costruire i record delle domande con valori nativi (int, datetime, liste).
+        Senza limit restituisce tutte le domande, altrimenti una pagina a partire dal cursore"""
+
+        conditions: list[str] = []
+        parametri: tuple[Union[str, int], ...] = ()
+        if cursor is not None:
+            created_at, last_id = decode_cursor(cursor)
+            conditions.append("(q.created_at < %s or (q.created_at = %s and q.question_id < %s))")
+            parametri += (created_at, created_at, last_id,)
+        if status is not None:
+            if status not in QUESTION_STATUSES:
+                raise ValueError(f"Status non valido: {status}")
+            conditions.append("q.status = %s")
+            parametri += (status,)
+        if theme is not None:
+            # Basta uno dei temi della domanda, senza raggruppare tutta question_theme
+            conditions.append("exists (select 1 from question_theme qt where qt.question_id = q.question_id and qt.theme_id = %s)")
+            parametri += (int(theme),)
+        if creator_type is not None:
+            if creator_type not in CREATOR_TYPES:
+                raise ValueError(f"Tipo di creatore non valido: {creator_type}")
+            conditions.append(f"q.created_by_{creator_type}_id is not null")
+        if question_id is not None:
+            conditions.append("q.question_id = %s")
+            parametri += (int(question_id),)
+
+        where = ("where " + " and ".join(conditions)) * (len(conditions) != 0)
+        limit_text = ""
+        if limit is not None:
+            # Una riga in più serve solo per sapere se esiste una pagina successiva
+            limit_text = "limit %s"
+            parametri += (int(limit) + 1,)
+
+        questions = await self._select(QUESTION_PAGE_QUERY.format(where = where, limit = limit_text), parametri)
+        self.next_cursor = None
+        if limit is not None and len(questions) > limit:
+            questions = questions[:limit]
+            self.next_cursor = encode_cursor(questions[-1][5], questions[-1][0])
+
+        question_ids = [question[0] for question in questions]
+        flags = await self._load_flags(question_ids)
+        answers = await self._load_answers(question_ids)
+
+        records: list[dict[str, Any]] = []
+        for question in questions:
+            question_flags = flags[question[0]]
+            hours = await get_hours(str(question[5]))
+            upvotes, downvotes = VoteCounter.fresh(question[0], question[6], question[7])
+            theme = await Catalog.theme(self.connection, question_flags[7]) if question_flags[7] is not None else None
+            record: dict[str, Any] = {
+                "question_id": question[0],
+                "question_tags": parse_tags(question[1]),
+                "question_text": question[2],
+                "status": question[3],
+                "ranking_times": question[4],
+                "ranked": question_flags[6],
+                "created_at": question[5],
+                "hours": hours["tempo"],
+                "hours_type": hours["tipo"],
+                "theme": theme["name"] if theme is not None else "",
+                "creator_type": None,
+                "creator": None,
+                "user_avatar": None,
+                "user_upvote": question_flags[2],
+                "user_downvote": question_flags[3],
+                "upvotes": upvotes,
+                "downvotes": downvotes,
+                "number_answer": question_flags[1],
+                "report": question_flags[4],
+                "answered": question_flags[5],
+                "answers": answers[question[0]],
+            }
+            if question[9] is not None:
+                record["creator_type"] = "llm"
+                record["creator"] = Catalog.llms.get(question[9])
+            elif question[8] is not None:
+                record["creator_type"] = "user"
+                record["creator"] = question[10]
+                record["user_avatar"] = question[11]
+            records.append(record)
+        return records
+
+
+    async def build(self, limit: Optional[int] = None, cursor: Optional[str] = None, status: Optional[str] = None, theme: Optional[int] = None, creator_type: Optional[str] = None, question_id: Optional[int] = None) -> dict[int, dict[str, Union[str, dict[int, dict[str, str]], list[str]]]]:
+        """Metodo per costruire il dizionario delle domande nello stesso formato di QuestionPageResponse.
+        Senza limit restituisce tutte le domande, altrimenti una pagina a partire dal cursore"""
+
+        records = await self.build_records(limit, cursor, status, theme, creator_type, question_id)
+        result: dict[int, dict[str, str]] = {}
+        i = 0
+        for record in records:
+            result[i] = {}
+            result[i]["question_id"] = str(record["question_id"])
+            result[i]["question_tags"] = record["question_tags"]
+            result[i]["question_text"] = record["question_text"]
+            result[i]["status"] = record["status"]
+
+            if record["status"] == 'ranking':
+                result[i]["ranking_times"] = str(record["ranking_times"])
+                result[i]["ranked"] = str(record["ranked"])
+            elif record["status"] == 'close':
+                result[i]["ranking_times"] = str(record["ranking_times"])
+                result[i]["ranking"] = format_ranking(record["answers"])
+
+            result[i]["created_at"] = str(record["created_at"])
+            result[i]["hours"] = str(record["hours"])
+            result[i]["hours_type"] = record["hours_type"]
+
+            result[i]["theme"] = record["theme"]
+
+            if record["creator_type"] is not None:
+                result[i]["creator_type"] = record["creator_type"]
+                if record["creator_type"] == "user":
+                    result[i]["user_avatar"] = record["user_avatar"]
+                result[i]["creator"] = record["creator"]
+
+            result[i]["user_upvote"] = str(record["user_upvote"])
+            result[i]["user_downvote"] = str(record["user_downvote"])
+            result[i]["upvotes"] = str(record["upvotes"])
+            result[i]["downvotes"] = str(record["downvotes"])
+            result[i]["number_answer"] = str(record["number_answer"])
+            result[i]["report"] = str(record["report"])
+            result[i]["answers"] = format_answers(record["answers"])
+            result[i]["answered"] = str(record["answered"])
+            i += 1
+        return result
+
+
+def question_table(records: list[dict[str, Any]]) -> dict[str, list]:
+    """Metodo per trasformare i record delle domande nella tabella compatta del formato v2,
+    con le risposte e la classifica delle domande chiuse come sotto-tabelle"""
+
+    rows = []
+    for record in records:
+        record = dict(record)
+        record["ranking"] = to_table(rank_answers(record["answers"]), RANKING_FIELDS) if record["status"] == "close" else None
+        record["answers"] = to_table(record["answers"], ANSWER_FIELDS)
+        rows.append(record)
+    return to_table(rows, QUESTION_FIELDS)
+
+
+async def get_questions(connection: aiomysql.Connection, user_id: int, limit: int = QUESTION_PAGE_LIMIT, cursor: Optional[str] = None) -> tuple[dict[int, dict[str, Union[str, dict[int, dict[str, str]], list[str]]]], Optional[str]]:
+    """Metodo per ritornare una pagina di domande della pagina delle questions e il cursore della pagina successiva.
+    Ogni pagina costa lo stesso numero di query qualunque sia la dimensione della tabella"""
+
+    engine = QuestionPageEngine(connection, user_id)
+    result = await engine.build(limit, cursor)
+    print(f"get_questions: {len(result)} domande con {engine.query_count} query")
+    return result, engine.next_cursor
+
+
+async def get_question_feed_table(connection: aiomysql.Connection, user_id: int, limit: int, cursor: Optional[str] = None, status: Optional[str] = None, theme: Optional[int] = None, creator_type: Optional[str] = None, question_id: Optional[int] = None) -> tuple[dict[str, list], Optional[str]]:
+    """Metodo per ritornare una pagina del feed delle domande nel formato compatto v2 e il cursore della pagina successiva"""
+
+    engine = QuestionPageEngine(connection, user_id)
+    records = await engine.build_records(limit, cursor, status, theme, creator_type, question_id)
+    return question_table(records), engine.next_cursor
+
+
+async def get_question_feed(connection: aiomysql.Connection, user_id: int, limit: int, cursor: Optional[str] = None, status: Optional[str] = None, theme: Optional[int] = None, creator_type: Optional[str] = None, question_id: Optional[int] = None) -> tuple[dict[int, dict[str, Union[str, dict[int, dict[str, str]], list[str]]]], Optional[str]]:
+    """Metodo per ritornare una pagina del feed delle domande e il cursore della pagina successiva"""
+
+    engine = QuestionPageEngine(connection, user_id)
+    result = await engine.build(limit, cursor, status, theme, creator_type, question_id)
+    return result, engine.next_cursor
@@ -4,7 +4,6 @@ import hashlib
 import aiomysql
 
 from utils.query_execute import execute_select
-from utils.various_tools import get_specific_from_something
 
 
 async def get_pass_and_salt(connection: aiomysql.Connection, user: str) -> dict[str,str]:
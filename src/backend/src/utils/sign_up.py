@@ -3,8 +3,8 @@ import hashlib
 import base64
 import aiomysql
 
-from utils.query_execute import execute_modify, execute_select
-from utils.various_tools import get_specific_from_something, get_something
+from utils.query_execute import execute_modify, execute_select, run
+from utils.user_stats import increment_user_stat
 
 
 def hash_password(password) -> tuple[bytes, bytes]:
@@ -51,21 +51,20 @@ async def sign_up_op(password: str, username: str, email:str, connection: aiomys
 async def insert_missions(username: str, connection: aiomysql.Connection) -> None:
     """Funzione che assegna ad ogni utente le missioni"""
 
-    user_id = await get_specific_from_something(connection, "user", "user_id", "username = %s" , (username, ))
+    user_id = await run(connection, "user.id_by_username", username)
     user_id = user_id[0][0]
 
-    missions = await get_something(connection, "mission", "mission_id")
-    for mission in missions:
-        insert_mission_query = "insert into mission_user (user_id, mission_id) values (%s, %s)"
-        await execute_modify(connection, insert_mission_query, (user_id, mission[0]))
+    # Tutte le missioni vengono assegnate con un solo insert ... select
+    await run(connection, "mission_user.assign_all", user_id)
+    missions = await run(connection, "mission.count")
+    await execute_modify(connection, *increment_user_stat(user_id, "active_missions", missions[0][0]))
     
 async def insert_title(username: str, connection: aiomysql.Connection) -> None:
     """Funzione che assegna il default title a user"""
 
-    user_id = await get_specific_from_something(connection, "user", "user_id", "username = %s" , (username, ))
+    user_id = await run(connection, "user.id_by_username", username)
     user_id = user_id[0][0]
 
-    title_query = f"insert into title_user(user_id, title_id) values({user_id}, 1)"
-    await execute_modify(connection, title_query)
+    await run(connection, "title_user.insert", 1, user_id)
 
     
\ No newline at end of file
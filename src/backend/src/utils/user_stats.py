@@ -0,0 +1,55 @@
+import aiomysql
+
+from utils.query_execute import execute_modify, run
+
+
+USER_STATS_COLUMNS = ("question_number", "answer_number", "ranking_number", "mission_number", "active_missions", "badge_missions", "mission_points")
+
+
+# Ricalcolo completo dei contatori a partire dalle tabelle base
+REPAIR_USER_STATS_QUERY = """
+insert into user_stats (user_id, question_number, answer_number, ranking_number, mission_number, active_missions, badge_missions, mission_points)
+select u.user_id,
+       (select count(*) from question q where q.created_by_user_id = u.user_id),
+       (select count(*) from answer a where a.user_id = u.user_id),
+       (select count(*) from user_ranked_question ur where ur.user_id = u.user_id),
+       (select count(*) from mission_user mu where mu.user_id = u.user_id and mu.completed = 1),
+       (select count(*) from mission_user mu where mu.user_id = u.user_id and mu.completed = 0 and mu.expired = 0),
+       (select count(*) from mission_user mu join mission m on m.mission_id = mu.mission_id where mu.user_id = u.user_id and mu.completed = 1 and m.reward_badge is not null),
+       (select ifnull(sum(m.reward_points), 0) from mission_user mu join mission m on m.mission_id = mu.mission_id where mu.user_id = u.user_id and mu.completed = 1)
+from user u
+on duplicate key update question_number = values(question_number), answer_number = values(answer_number), ranking_number = values(ranking_number),
+       mission_number = values(mission_number), active_missions = values(active_missions), badge_missions = values(badge_missions), mission_points = values(mission_points)
+"""
+
+
+def increment_user_stat(user_id: int, column: str, amount: int = 1) -> tuple[str, tuple[int, ...]]:
+    """Metodo che ritorna la query (da eseguire nella stessa transazione della scrittura) per incrementare un contatore utente"""
+
+    if column not in USER_STATS_COLUMNS:
+        raise ValueError(f"Contatore non esistente: {column}")
+    query = f"insert into user_stats (user_id, {column}) values (%s, %s) on duplicate key update {column} = {column} + values({column})"
+    return query, (user_id, amount,)
+
+
+def complete_mission_user_stat(user_id: int, badges: int, points: int, count: int = 1) -> tuple[str, tuple[int, ...]]:
+    """Metodo che ritorna la query per aggiornare i contatori al completamento di count missioni, di cui badges con badge come premio"""
+
+    query = "insert into user_stats (user_id, mission_number, active_missions, badge_missions, mission_points) values (%s, %s, %s, %s, %s) on duplicate key update mission_number = mission_number + values(mission_number), active_missions = active_missions + values(active_missions), badge_missions = badge_missions + values(badge_missions), mission_points = mission_points + values(mission_points)"
+    return query, (user_id, count, -count, badges, points,)
+
+
+async def get_user_counters(connection: aiomysql.Connection, user_id: int) -> dict[str, int]:
+    """Metodo per leggere i contatori di un utente con una sola lettura per chiave primaria"""
+
+    row = await run(connection, "user_stats.by_user", user_id)
+    if len(row) == 0:
+        return {column: 0 for column in USER_STATS_COLUMNS}
+    return {column: int(value) for column, value in zip(USER_STATS_COLUMNS, row[0])}
+
+
+async def repair_user_stats(connection: aiomysql.Connection) -> None:
+    """Metodo che ricalcola tutti i contatori utente dalle tabelle base, per correggere eventuali derive"""
+
+    print("repair_user_stats")
+    await execute_modify(connection, REPAIR_USER_STATS_QUERY)
@@ -0,0 +1,176 @@
+import asyncio
+from typing import Union
+import aiomysql
+
+from utils.connection import Connection, PoolExhaustedError
+from utils.query_execute import execute_modify, execute_select
+
+
+# Tabella dei voti per tipo di voto
+VOTE_TABLES: dict[str, str] = {
+    "upvote": "user_question_upvote",
+    "downvote": "user_question_downvote",
+}
+
+# Ogni quanti secondi i contatori in memoria vengono riportati in question, e domande aggiornate per statement
+VOTE_FLUSH_INTERVAL = 5
+VOTE_FLUSH_BATCH = 500
+
+# Domande i cui contatori upvotes/downvotes non corrispondono ai voti, come (question_id, upvotes, voti reali, downvotes, voti reali)
+VOTE_DRIFT_QUERY = """
+select q.question_id, q.upvotes, ifnull(u.votes, 0), q.downvotes, ifnull(d.votes, 0)
+from question q
+left join (select question_id, count(*) as votes from user_question_upvote group by question_id) u on u.question_id = q.question_id
+left join (select question_id, count(*) as votes from user_question_downvote group by question_id) d on d.question_id = q.question_id
+where q.upvotes <> ifnull(u.votes, 0) or q.downvotes <> ifnull(d.votes, 0)
+"""
+
+# I contatori vengono ricalcolati nello statement stesso, {ids} sono i segnaposto delle domande da correggere
+VOTE_REPAIR_QUERY = """
+update question q
+set q.upvotes = (select count(*) from user_question_upvote u where u.question_id = q.question_id),
+    q.downvotes = (select count(*) from user_question_downvote d where d.question_id = q.question_id)
+where q.question_id in ({ids})
+"""
+
+
+class VoteCounter:
+    """Contatori dei voti in memoria: ogni voto confermato aggiorna solo la tabella dei voti e il contatore
+    della domanda qui, e un task in background riporta i contatori in question.upvotes/downvotes a blocchi.
+    Chi legge i contatori dal db li completa con fresh()"""
+
+    # Voti confermati e non ancora riportati in question, per question_id: [upvotes, downvotes]
+    pending: dict[int, list[int]] = {}
+
+    flushed: int = 0
+    repaired: int = 0
+
+    _lock: asyncio.Lock = None
+
+
+    @classmethod
+    def _init_sync(cls) -> None:
+        # Gli oggetti asyncio vanno creati quando il loop è già attivo
+        if cls._lock is None:
+            cls._lock = asyncio.Lock()
+
+
+    @classmethod
+    def add(cls, kind: str, question_id: int, delta: int) -> None:
+        """Metodo per aggiungere un voto (delta 1) o la sua rimozione (delta -1) al contatore della domanda"""
+
+        counter = cls.pending.setdefault(question_id, [0, 0])
+        counter[0 if kind == "upvote" else 1] += delta
+
+
+    @classmethod
+    def fresh(cls, question_id: int, upvotes: int, downvotes: int) -> tuple[int, int]:
+        """Metodo per i contatori aggiornati di una domanda, a partire da quelli letti dal db"""
+
+        counter = cls.pending.get(question_id)
+        if counter is None:
+            return upvotes, downvotes
+        return upvotes + counter[0], downvotes + counter[1]
+
+
+    @classmethod
+    async def flush(cls, connection: aiomysql.Connection) -> int:
+        """Metodo per riportare i contatori in question con un update per blocco di domande, ritorna le domande aggiornate.
+        In caso di errore i contatori non scritti tornano in memoria per il giro successivo"""
+
+        cls._init_sync()
+        async with cls._lock:
+            return await cls._flush(connection)
+
+
+    @classmethod
+    async def _flush(cls, connection: aiomysql.Connection) -> int:
+        counters = [(question_id, counter) for question_id, counter in cls.pending.items() if counter != [0, 0]]
+        cls.pending = {}
+        written = 0
+        try:
+            while written < len(counters):
+                batch = counters[written:written + VOTE_FLUSH_BATCH]
+                cases = " ".join(["when %s then %s"] * len(batch))
+                placeholders = ", ".join(["%s"] * len(batch))
+                parametri = tuple(value for question_id, counter in batch for value in (question_id, counter[0]))
+                parametri += tuple(value for question_id, counter in batch for value in (question_id, counter[1]))
+                await execute_modify(connection, f"update question set upvotes = upvotes + case question_id {cases} end, downvotes = downvotes + case question_id {cases} end where question_id in ({placeholders})",
+                                     parametri + tuple(question_id for question_id, _ in batch))
+                written += len(batch)
+        finally:
+            for question_id, counter in counters[written:]:
+                cls.add("upvote", question_id, counter[0])
+                cls.add("downvote", question_id, counter[1])
+            cls.flushed += written
+        return written
+
+
+    @classmethod
+    async def run(cls) -> None:
+        """Task in background che riporta i contatori in question ogni VOTE_FLUSH_INTERVAL secondi"""
+
+        while True:
+            await asyncio.sleep(VOTE_FLUSH_INTERVAL)
+            if len(cls.pending) == 0:
+                continue
+            try:
+                async with Connection.get_connection() as connection:
+                    await cls.flush(connection)
+            except (aiomysql.Error, PoolExhaustedError) as e:
+                print("Errore mariadb nel salvataggio dei voti: ", e)
+            except Exception as e:
+                print("Errore nel salvataggio dei voti: ", e)
+
+
+    @classmethod
+    async def reconcile(cls, connection: aiomysql.Connection, repair: bool = True) -> list[tuple[int, int, int, int, int]]:
+        """Metodo per verificare upvotes e downvotes rispetto alle tabelle dei voti: ritorna le domande in deriva
+        (es. contatori persi in un riavvio non pulito) e, se repair è vero, le corregge. Vengono corrette solo le domande
+        con la stessa deriva prima e dopo il flush e senza voti in memoria: un voto confermato nel mentre, il cui
+        contatore non è ancora stato sommato, cambia la deriva e la domanda viene lasciata al giro successivo"""
+
+        cls._init_sync()
+        async with cls._lock:
+            before = {row[0]: row for row in await execute_select(connection, VOTE_DRIFT_QUERY)}
+            await cls._flush(connection)
+            drift = await execute_select(connection, VOTE_DRIFT_QUERY)
+            if len(drift) != 0:
+                print(f"Contatori dei voti in deriva su {len(drift)} domande: {drift[:10]}")
+                ids = [row[0] for row in drift if before.get(row[0]) == row and row[0] not in cls.pending]
+                if repair and len(ids) != 0:
+                    await execute_modify(connection, VOTE_REPAIR_QUERY.format(ids = ", ".join(["%s"] * len(ids))), tuple(ids))
+                    cls.repaired += len(ids)
+        return list(drift)
+
+
+    @classmethod
+    def stats(cls) -> dict[str, int]:
+        """Metodo per leggere lo stato dei contatori: domande in attesa di flush, domande aggiornate e corrette"""
+
+        return {"pending": len(cls.pending), "flushed": cls.flushed, "repaired": cls.repaired}
+
+
+async def vote(connection: aiomysql.Connection, kind: str, question_id: int, user_id: int) -> bool:
+    """Metodo per registrare il voto (upvote o downvote) di un utente su una domanda. Con l'indice unico su
+    (question_id, user_id) l'insert ignore è idempotente: ritorna False se il voto esisteva già"""
+
+    if kind not in VOTE_TABLES:
+        raise ValueError(f"Voto non esistente: {kind}")
+    inserted = await execute_modify(connection, f"insert ignore into {VOTE_TABLES[kind]} (question_id, user_id) values (%s, %s)", (question_id, user_id,))
+    if inserted == 0:
+        return False
+    Connection.after_commit(connection, lambda: VoteCounter.add(kind, question_id, 1))
+    return True
+
+
+async def remove_vote(connection: aiomysql.Connection, kind: str, question_id: int, user_id: int) -> bool:
+    """Metodo per rimuovere il voto di un utente su una domanda, ritorna False se il voto non esisteva"""
+
+    if kind not in VOTE_TABLES:
+        raise ValueError(f"Voto non esistente: {kind}")
+    deleted = await execute_modify(connection, f"delete from {VOTE_TABLES[kind]} where question_id = %s and user_id = %s", (question_id, user_id,))
+    if deleted == 0:
+        return False
+    Connection.after_commit(connection, lambda: VoteCounter.add(kind, question_id, -1))
+    return True
@@ -0,0 +1,19 @@
+from typing import Any, Iterable
+from fastapi.responses import ORJSONResponse
+
+
+# Versione del formato compatto usato dagli endpoint /v2
+WIRE_FORMAT_VERSION = 2
+
+
+def to_table(records: Iterable[dict[str, Any]], fields: tuple[str, ...]) -> dict[str, list]:
+    """Metodo per trasformare una lista di record in una tabella compatta: i nomi dei campi una sola volta,
+    poi una riga per record con i valori nativi (int, datetime, liste) nello stesso ordine dei campi"""
+
+    return {"fields": list(fields), "rows": [[record.get(field) for field in fields] for record in records]}
+
+
+def compact_response(**content: Any) -> ORJSONResponse:
+    """Metodo per costruire la risposta v2, serializzata con orjson senza passare dalla validazione dei modelli pydantic"""
+
+    return ORJSONResponse({"version": WIRE_FORMAT_VERSION, **content})
@@ -0,0 +1,127 @@
+"""Test differenziale del motore delle missioni: simulate_cascade, con gli stessi passi SQL di apply_mission_event,
+deve dare lo stesso avanzamento, gli stessi completamenti e gli stessi premi del vecchio check_missions ricorsivo"""
+
+import os
+import random
+import sys
+from typing import Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from utils.mission_engine import MissionState, simulate_cascade
+
+
+KINDS = ("answer", "question", "ranking", "mission")
+THEMES = (None, 1, 2)
+
+
+class Mission:
+    """Riga di mission unita a quella di mission_user di un utente"""
+
+    def __init__(self, mission_id: int, kind: str, theme: Optional[int], value: int, progress: int, rng: random.Random) -> None:
+        self.mission_id = mission_id
+        self.kind = kind
+        self.theme = theme
+        self.value = value
+        self.progress = progress
+        self.completed = False
+        self.reward_coins = rng.randint(0, 50)
+        self.reward_points = rng.randint(0, 50)
+        self.reward_badge = rng.choice((None, None, 1, 2))
+        self.reward_title = rng.choice((None, None, 3, 4))
+
+
+def matches(mission: Mission, kind: str, theme: Optional[int]) -> bool:
+    # mission.open_without_theme unita a mission.open_with_theme
+    return mission.kind == kind and (mission.theme is None or theme is None or mission.theme == theme)
+
+
+def old_check_missions(missions: list[Mission], item: str, theme: Optional[int], prizes: list[Mission]) -> None:
+    """Il vecchio ciclo missione per missione: avanza una missione, completa quelle pronte e per ogni completamento
+    richiama sé stesso con item mission. Le liste lette prima della ricorsione potevano completare due volte
+    la stessa missione: qui una missione già completata viene saltata, come fa il motore a insiemi"""
+
+    to_update = [mission for mission in missions if not mission.completed and matches(mission, item, theme)]
+    for mission in to_update:
+        if mission.completed:
+            continue
+        mission.progress += 1
+        ready = [other for other in missions if not other.completed and other.progress == other.value]
+        for completed in ready:
+            if completed.completed:
+                continue
+            completed.completed = True
+            prizes.append(completed)
+            old_check_missions(missions, "mission", theme, prizes)
+
+
+def new_engine(missions: list[Mission], item: str, theme: Optional[int]) -> list[Mission]:
+    """Gli stessi passi di apply_mission_event sulle righe in memoria, ritorna le missioni completate"""
+
+    # update mission_user set progress = progress + 1 ... mission_id in (Catalog.mission_ids(item, theme))
+    for mission in missions:
+        if not mission.completed and matches(mission, item, theme):
+            mission.progress += 1
+    # mission_user.event_state
+    rows = [(mission.mission_id, mission.kind, mission.value, mission.progress, mission.reward_coins, mission.reward_points,
+             mission.reward_badge, mission.reward_title, mission.kind == "mission" and (mission.theme is None or theme is None or mission.theme == theme))
+            for mission in missions if not mission.completed and (mission.progress == mission.value or mission.kind == "mission")]
+    states = [MissionState(row) for row in rows]
+    completed = simulate_cascade(states)
+    by_id = {mission.mission_id: mission for mission in missions}
+    for state in states:
+        by_id[state.mission_id].progress += state.delta
+    for state in completed:
+        by_id[state.mission_id].completed = True
+    return [by_id[state.mission_id] for state in completed]
+
+
+def random_missions(rng: random.Random) -> list[Mission]:
+    missions = []
+    for mission_id in range(1, rng.randint(1, 10) + 1):
+        value = rng.randint(1, 6)
+        missions.append(Mission(mission_id, rng.choice(KINDS), rng.choice(THEMES), value, rng.randint(0, value - 1), rng))
+    return missions
+
+
+def clone(missions: list[Mission]) -> list[Mission]:
+    copies = []
+    for mission in missions:
+        copy = Mission.__new__(Mission)
+        copy.__dict__.update(mission.__dict__)
+        copies.append(copy)
+    return copies
+
+
+def prize(completed: list[Mission]) -> tuple[int, int, set[int], set[int], int]:
+    return (sum(mission.reward_points for mission in completed), sum(mission.reward_coins for mission in completed),
+            {mission.reward_badge for mission in completed if mission.reward_badge is not None},
+            {mission.reward_title for mission in completed if mission.reward_title is not None}, len(completed))
+
+
+def test_simulate_cascade_matches_recursive_check_missions():
+    rng = random.Random(2024)
+    for _ in range(5000):
+        missions = random_missions(rng)
+        item = rng.choice(KINDS[:3])
+        theme = rng.choice(THEMES)
+        old, new = clone(missions), clone(missions)
+
+        old_prizes: list[Mission] = []
+        old_check_missions(old, item, theme, old_prizes)
+        new_prizes = new_engine(new, item, theme)
+
+        assert {mission.mission_id: (mission.progress, mission.completed) for mission in new} == \
+               {mission.mission_id: (mission.progress, mission.completed) for mission in old}
+        assert sorted(mission.mission_id for mission in new_prizes) == sorted(mission.mission_id for mission in old_prizes)
+        assert prize(new_prizes) == prize(old_prizes)
+
+
+def test_simulate_cascade_chain():
+    # Una missione pronta ne completa una di tipo mission a un passo dalla fine, che a sua volta ne completa un'altra
+    states = [MissionState((1, "answer", 3, 3, 0, 10, None, None, False)),
+              MissionState((2, "mission", 2, 1, 0, 20, None, None, True)),
+              MissionState((3, "mission", 3, 1, 0, 30, None, None, True))]
+    completed = simulate_cascade(states)
+    assert [mission.mission_id for mission in completed] == [1, 2, 3]
+    assert [mission.delta for mission in states] == [0, 1, 2]
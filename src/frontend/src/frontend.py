@@ -6,6 +6,7 @@ from typing import Optional, Union
 from fastapi.exceptions import RequestValidationError
 from fastapi.staticfiles import StaticFiles
 import httpx
+import orjson
 from fastapi import Depends, FastAPI, File, HTTPException, Request, Form, UploadFile
 from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
@@ -28,6 +29,8 @@ active_users = {}   # Serve per gestire il numero di utenti online
 
 token_map: dict[str, dict[str, str]] = {}   # Serve per gestire i passaggi di ID alle pagine html, con una mappatura di un hash che viene usato come chiave per l'id e un valore testuale (name, answer_text o question_text)
 
+question_llms: dict[str, dict[str, str]] = {}   # LLM con id già tokenizzati della pagina delle questions, riusati dalle card caricate con Load More
+
 
 
 async def check_token_values(token: str):
@@ -364,6 +367,50 @@ async def home_page(request: Request):
     return RedirectResponse(url="/signin", status_code=303)
 
 
+QUESTION_PAGE_SIZE = 20   # Numero di domande richieste al backend per ogni pagina del feed
+
+QUESTION_STATUS_FILTERS = {"active": "open", "ranking": "ranking", "closed": "close"}   # Stati del filtro della pagina e valori di question.status
+
+
+def table_to_dict(table: dict, start: int = 0) -> dict:
+    """Metodo per ricostruire il dizionario numerato usato dai template a partire da una tabella del formato v2 (fields + rows)"""
+
+    return {str(start + i): dict(zip(table["fields"], row)) for i, row in enumerate(table["rows"])}
+
+
+def read_questions_table(table: dict) -> dict:
+    """Metodo per ricostruire le domande del formato v2 con risposte e classifica numerate da 1 come nel formato v1"""
+
+    questions = table_to_dict(table)
+    for question in questions.values():
+        question["answers"] = table_to_dict(question["answers"], 1)
+        if question["ranking"] is not None:
+            question["ranking"] = table_to_dict(question["ranking"], 1)
+    return questions
+
+
+async def tokenize_questions(questions: dict, start: int = 0) -> dict:
+    """Metodo che sostituisce gli id di domande e risposte con i token e rinumera le chiavi a partire da start"""
+
+    result = {}
+    for key in questions.keys():
+        question = questions[key]
+        question_id_token = await genera_token("question", question["question_id"])
+        token_map[question_id_token] = {}
+        token_map[question_id_token]["id"] = question["question_id"]
+        token_map[question_id_token]["question_text"] = question["question_text"]
+        question["question_id"] = question_id_token
+        for answer_key in question["answers"]:
+            answer = question["answers"][answer_key]
+            answer_id_token = await genera_token("answer", answer["answer_id"])
+            token_map[answer_id_token] = {}
+            token_map[answer_id_token]["id"] = answer["answer_id"]
+            token_map[answer_id_token]["answer_text"] = answer["answer_text"]
+            answer["answer_id"] = answer_id_token
+        result[str(start + int(key))] = question
+    return result
+
+
 @app.get("/questions")
 async def question_page(request: Request, question_id: str = None):
     """API per il redirect alla questions page"""
@@ -389,30 +436,24 @@ async def question_page(request: Request, question_id: str = None):
         request.session["form_origin"] = "questions"
         async with httpx.AsyncClient(timeout = 60.0) as client:
             headers = {"x-api-key": SECRET_KEY, "user-id" : str(request.session["user_id"])} 
-            response = await client.get(f"{API_BASE_URL}/get_question_page_info", headers = headers)
+            response = await client.get(f"{API_BASE_URL}/v2/get_question_feed", params = {"limit": QUESTION_PAGE_SIZE}, headers = headers)
             response.raise_for_status()
-            result = response.json()
-            
-            for key in result["questions"].keys():
-                question = result["questions"][key]
-                question_id_token = await genera_token("question", question["question_id"])
-                token_map[question_id_token] = {}
-                token_map[question_id_token]["id"] = question["question_id"]
-                token_map[question_id_token]["question_text"] = question["question_text"]
-                if question_id_obj is not None and question_id_obj == question["question_id"]:
-                    question_id_obj = question_id_token
-                    print("DOMANDA TROVATA")
-                question["question_id"] = question_id_token
-                for key in question["answers"]:
-                    answer = question["answers"][key]
-                    answer_id_token = await genera_token("answer", answer["answer_id"])
-                    token_map[answer_id_token] = {}
-                    token_map[answer_id_token]["id"] = answer["answer_id"]
-                    token_map[answer_id_token]["answer_text"] = answer["answer_text"]
-                    answer["answer_id"] = answer_id_token
-                
+            result = orjson.loads(response.content)
+            questions = read_questions_table(result["questions"])
+            next_cursor = result["next_cursor"]
+
+            if question_id_obj is not None and int(question_id_obj) not in [question["question_id"] for question in questions.values()]:
+                # La domanda richiesta non è nella prima pagina, la chiediamo singolarmente
+                response = await client.get(f"{API_BASE_URL}/v2/get_question_feed", params = {"limit": 1, "question_id": int(question_id_obj)}, headers = headers)
+                response.raise_for_status()
+                for question in read_questions_table(orjson.loads(response.content)["questions"]).values():
+                    questions[str(len(questions))] = question
 
-            questions = result["questions"]
+            questions = await tokenize_questions(questions)
+            if question_id_obj is not None:
+                question_id_obj = next((question["question_id"] for question in questions.values() if token_map[question["question_id"]]["id"] == int(question_id_obj)), None)
+                if question_id_obj is not None:
+                    print("DOMANDA TROVATA")
 
             headers = {"x-api-key": SECRET_KEY}
             response = await client.get(f"{API_BASE_URL}/create_question_info", headers = headers)
@@ -435,6 +476,9 @@ async def question_page(request: Request, question_id: str = None):
                         token_map[theme_id_token]["name"] = theme["name"]
                         theme["id"] = theme_id_token
             
+            question_llms.clear()
+            question_llms.update(result["llms"])
+
             if question_id_obj is None:
 
                 return templates.TemplateResponse(
@@ -443,7 +487,8 @@ async def question_page(request: Request, question_id: str = None):
                         "request": request,
                         "questions" : questions,
                         "llms" : result["llms"],
-                        "themes" : result["themes"]
+                        "themes" : result["themes"],
+                        "next_cursor" : next_cursor
                     })
             else:
                 return templates.TemplateResponse(
@@ -453,9 +498,51 @@ async def question_page(request: Request, question_id: str = None):
                         "questions" : questions,
                         "llms" : result["llms"],
                         "themes" : result["themes"],
-                        "question_obj" : question_id_obj
+                        "question_obj" : question_id_obj,
+                        "next_cursor" : next_cursor
                     })
 
+
+@app.get("/questions_more")
+async def question_page_more(request: Request, cursor: Optional[str] = None, start: int = 0, status: Optional[str] = None, theme: Optional[str] = None, creator_type: Optional[str] = None):
+    """API che ritorna l'html di una pagina di domande filtrata per stato, tema e tipo di creatore (user o llm), chiamata dal pulsante Load More
+    (con il cursore) e al cambio di un filtro (senza cursore, dalla prima pagina)"""
+
+
+    if "user_id" not in request.session:
+        return JSONResponse(status_code=401, content={"detail": "Utente non loggato"})
+    request.session["last_active"] = time.time()
+    active_users[request.session["user_id"]] = time.time()
+    params: dict[str, Union[str, int]] = {"limit": QUESTION_PAGE_SIZE}
+    if cursor:
+        params["cursor"] = cursor
+    if status is not None:
+        if status not in QUESTION_STATUS_FILTERS:
+            return JSONResponse(status_code=400, content={"detail": "Stato non valido"})
+        params["status"] = QUESTION_STATUS_FILTERS[status]
+    if theme is not None:
+        if not await check_token_values(theme):
+            return JSONResponse(status_code=400, content={"detail": "Tema non valido"})
+        params["theme"] = int(token_map[theme]["id"])
+    if creator_type is not None:
+        if creator_type not in ("user", "llm"):
+            return JSONResponse(status_code=400, content={"detail": "Tipo di creatore non valido"})
+        params["creator_type"] = creator_type
+    async with httpx.AsyncClient(timeout = 60.0) as client:
+        headers = {"x-api-key": SECRET_KEY, "user-id" : str(request.session["user_id"])}
+        response = await client.get(f"{API_BASE_URL}/v2/get_question_feed", params = params, headers = headers)
+        response.raise_for_status()
+        result = orjson.loads(response.content)
+
+    questions = await tokenize_questions(read_questions_table(result["questions"]), start)
+    html = templates.get_template("question_cards.html").render(
+        {
+            "request": request,
+            "questions": questions,
+            "llms": question_llms
+        })
+    return JSONResponse(content = {"html": html, "next_cursor": result["next_cursor"]})
+
         
 
 @app.get("/post_question")
@@ -758,9 +845,11 @@ async def get_your_profile_page(request: Request):
         async with httpx.AsyncClient(timeout = 60.0) as client:
             headers = {"x-api-key": SECRET_KEY, "user-id": str(request.session["user_id"])}
             token_map.clear()
-            response = await client.get(f"{API_BASE_URL}/get_profile_info", headers= headers)
+            response = await client.get(f"{API_BASE_URL}/v2/get_profile_info", headers= headers)
             response.raise_for_status()
-            result = response.json()
+            result = orjson.loads(response.content)
+            result["user_question"] = table_to_dict(result["user_question"])
+            result["user_answer"] = table_to_dict(result["user_answer"])
             #print(result)
             for key in result["user_question"].keys():
                 question = result["user_question"][key]
@@ -805,7 +894,9 @@ async def get_your_profile_page(request: Request):
 
 
 
-            return templates.TemplateResponse("my_profile.html", {"request" : request, "user_data" : result['user_data'], "user_question" : result["user_question"], "user_answer" : result["user_answer"], "last_activities" : result["user_activities"], "user_avatars" : result["user_avatars"], "user_titles": result["user_titles"]})
+            request.session["profile_user_id"] = request.session["user_id"]
+
+            return templates.TemplateResponse("my_profile.html", {"request" : request, "user_data" : result['user_data'], "user_question" : result["user_question"], "user_answer" : result["user_answer"], "last_activities" : result["user_activities"], "user_avatars" : result["user_avatars"], "user_titles": result["user_titles"], "question_cursor" : result["question_cursor"], "answer_cursor" : result["answer_cursor"]})
 
 
 @app.post("/visit_profile")
@@ -826,9 +917,11 @@ async def visit_profile_page(request: Request, user_id: str = Form(...)):
         async with httpx.AsyncClient(timeout = 60.0) as client:
             headers = {"x-api-key": SECRET_KEY, "user-id": str(request.session["user_id"])}
             
-            response = await client.get(f"{API_BASE_URL}/get_profile_info", params={"user_id": int(token_map[user_id]["id"])}, headers= headers)
+            response = await client.get(f"{API_BASE_URL}/v2/get_profile_info", params={"user_id": int(token_map[user_id]["id"])}, headers= headers)
             response.raise_for_status()
-            result = response.json()
+            result = orjson.loads(response.content)
+            result["user_question"] = table_to_dict(result["user_question"])
+            result["user_answer"] = table_to_dict(result["user_answer"])
 
             user_id_token = user_id
 
@@ -854,9 +947,44 @@ async def visit_profile_page(request: Request, user_id: str = Form(...)):
 
             token_map[user_id_token] = {}
             token_map[user_id_token]["id"] = result["user_data"]["user_id"]
+            request.session["profile_user_id"] = result["user_data"]["user_id"]
             result["user_data"]["user_id"] = user_id_token
 
-            return templates.TemplateResponse("profile.html", {"request" : request, "user_data" : result['user_data'], "user_question" : result["user_question"], "user_answer" : result["user_answer"], "last_activities" : result["user_activities"]})
+            return templates.TemplateResponse("profile.html", {"request" : request, "user_data" : result['user_data'], "user_question" : result["user_question"], "user_answer" : result["user_answer"], "last_activities" : result["user_activities"], "question_cursor" : result["question_cursor"], "answer_cursor" : result["answer_cursor"]})
+
+
+@app.get("/profile_activity")
+async def profile_activity(request: Request, kind: str, cursor: str):
+    """API che ritorna l'html della pagina successiva di domande o risposte del profilo visualizzato, chiamata dai pulsanti Load More"""
+
+
+    if "user_id" not in request.session:
+        return JSONResponse(status_code=401, content={"detail": "Utente non loggato"})
+    if kind not in ("question", "answer"):
+        return JSONResponse(status_code=400, content={"detail": "Tipo di attività non valido"})
+    request.session["last_active"] = time.time()
+    active_users[request.session["user_id"]] = time.time()
+    async with httpx.AsyncClient(timeout = 60.0) as client:
+        headers = {"x-api-key": SECRET_KEY, "user-id": str(request.session["user_id"])}
+        params = {"user_id": int(request.session.get("profile_user_id", request.session["user_id"])), "cursor": cursor, "kinds": kind}
+        response = await client.get(f"{API_BASE_URL}/v2/get_user_activity", params = params, headers = headers)
+        response.raise_for_status()
+        result = orjson.loads(response.content)
+    result["activity"] = table_to_dict(result["activity"])
+
+    for key in result["activity"].keys():
+        activity = result["activity"][key]
+        question_id_token = await genera_token("question", activity["question_id"])
+        token_map[question_id_token] = {}
+        token_map[question_id_token]["id"] = activity["question_id"]
+        token_map[question_id_token]["question_text"] = activity["question_text"]
+        activity["question_id"] = question_id_token
+
+    if kind == "question":
+        html = templates.get_template("profile_questions.html").render({"request": request, "user_question": result["activity"]})
+    else:
+        html = templates.get_template("profile_answers.html").render({"request": request, "user_answer": result["activity"]})
+    return JSONResponse(content = {"html": html, "next_cursor": result["next_cursor"]})
 
 
 
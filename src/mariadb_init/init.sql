@@ -116,7 +116,7 @@ insert into badge(title, description, tier, path) values
 create table if not exists mission(
     mission_id int AUTO_INCREMENT primary key,
     type ENUM('daily','weekly','objective'),
-    kind ENUM('answer','question','ranking','llm','user', 'mission'),        /*--indica su cosa va a contare il valore (es: rispondi a 10 domande -> kind=answer , crea 10 domande sul calcio -> kind=question theme=calcio)*/
+    kind ENUM('answer','question','ranking','llm','user', 'mission', 'leaderboard'),        /*--indica su cosa va a contare il valore (es: rispondi a 10 domande -> kind=answer , crea 10 domande sul calcio -> kind=question theme=calcio)*/
     theme int default null,
     description text not null,
     reward_coins int not null,
@@ -218,9 +218,9 @@ insert into mission(type, kind, description, reward_coins, reward_points, reward
 
 -- Ranking / Leaderboard
 insert into mission(type, kind, description, reward_coins, reward_points, reward_badge, reward_title, value) values
-('objective', 'ranking', 'Entra nella top 100', 100, 50, 7, 8, 100),
-('objective', 'ranking', 'Entra nella top 50', 250, 125, 8, 9, 50),
-('objective', 'ranking', 'Entra nella top 10', 500, 250, 9, 10, 10);
+('objective', 'leaderboard', 'Entra nella top 100', 100, 50, 7, 8, 100),
+('objective', 'leaderboard', 'Entra nella top 50', 250, 125, 8, 9, 50),
+('objective', 'leaderboard', 'Entra nella top 10', 500, 250, 9, 10, 10);
 
 -- Missioni completate
 insert into mission(type, kind, description, reward_coins, reward_points, reward_badge, reward_title, value) values
@@ -296,7 +296,7 @@ create table if not exists question(
     created_at timestamp default CURRENT_TIMESTAMP,
     rankings_times int default 0,
     points_assigned int default 0,
-    /*--answers_number int default 0, si può fare con count **/
+    answer_count int not null default 0,    /* mantenuto da insert_answer, ricalcolabile con ricalcola_answer_count */
     upvotes int default 0,
     status ENUM('open', 'ranking', 'close') default 'open',
     downvotes int default 0,
@@ -379,4 +379,18 @@ create table if not exists user_ranked_question(
     primary key(user_id, question_id),
     foreign key(user_id) references user(user_id) on delete cascade on update cascade, 
     foreign key(question_id) references question(question_id) on delete cascade on update cascade
-)
+);
+
+
+/* Contatori per utente mantenuti dalle operazioni di scrittura, ricalcolabili con repair_user_stats */
+create table if not exists user_stats(
+    user_id int primary key,
+    question_number int not null default 0,
+    answer_number int not null default 0,
+    ranking_number int not null default 0,
+    mission_number int not null default 0,      /* missioni completate */
+    active_missions int not null default 0,     /* missioni non completate e non scadute */
+    badge_missions int not null default 0,      /* missioni completate con badge come premio */
+    mission_points int not null default 0,      /* punti guadagnati con le missioni */
+    foreign key(user_id) references user(user_id) on delete cascade on update cascade
+);